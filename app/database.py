@@ -12,4 +12,4 @@ engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-# Tables are created on app startup in `app.main` after models are imported
+# Tables are created and upgraded on app startup by `app.migrations.upgrade`
@@ -0,0 +1,281 @@
+"""Versioned schema migrations, applied in order at startup.
+
+Each migration runs once, inside its own transaction, and is recorded in the
+`schema_migrations` table. Steps are written defensively (check before
+create/alter) so databases created by older versions of the app through
+`create_all` upgrade cleanly. Tables are created from definitions frozen in
+this module as they were when the migration was written, never from the live
+`app.models`, so an applied migration keeps its meaning as the models
+evolve. Append new migrations to `MIGRATIONS`; never edit or reorder applied
+ones.
+
+`upgrade` holds a lock while it runs (a lock file next to an SQLite database,
+an advisory lock on PostgreSQL), so the workers of one deployment starting
+together apply each migration once.
+"""
+import contextlib
+import logging
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table,
+    UniqueConstraint, inspect, select, text,
+)
+
+from app.services.persistence import fingerprint, stat_bucket
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the lock is then skipped
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_version_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", DateTime),
+)
+
+# Arbitrary key of the PostgreSQL advisory lock held by `upgrade`
+_PG_LOCK_KEY = 0x1A7E5C4E
+
+
+def _create(conn, *tables):
+    for table in tables:
+        table.create(bind=conn, checkfirst=True)
+
+
+def _add_column(conn, table, name, ddl_type):
+    cols = [c["name"] for c in inspect(conn).get_columns(table)]
+    if name not in cols:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+
+
+# -- table definitions, frozen at the migration that creates them ----------
+
+_v1 = MetaData()
+
+_vulnerabilities_v1 = Table(
+    "vulnerabilities", _v1,
+    Column("id", Integer, primary_key=True),
+    Column("pattern", String),
+    Column("severity", String),
+    Column("count", Integer),
+    Column("recommendation", String, nullable=True),
+)
+
+_v3 = MetaData()
+
+_scan_jobs_v3 = Table(
+    "scan_jobs", _v3,
+    Column("id", Integer, primary_key=True),
+    Column("status", String, index=True),
+    Column("path", String),
+    Column("mode", String, nullable=True),
+    Column("workers", Integer),
+    Column("include_ai", Boolean),
+    Column("findings_total", Integer),
+    Column("critical", Integer),
+    Column("high", Integer),
+    Column("medium", Integer),
+    Column("recommendations_done", Integer),
+    Column("error", String, nullable=True),
+    Column("created_at", DateTime),
+    Column("started_at", DateTime, nullable=True),
+    Column("finished_at", DateTime, nullable=True),
+)
+
+_recommendation_cache_v3 = Table(
+    "recommendation_cache", _v3,
+    Column("key", String, primary_key=True),
+    Column("model", String),
+    Column("pattern", String, nullable=True),
+    Column("recommendation", String),
+    Column("created_at", DateTime, index=True),
+)
+
+_v4 = MetaData()
+
+_scans_v4 = Table(
+    "scans", _v4,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String),
+    Column("target", String, nullable=True),
+    Column("created_at", DateTime, index=True),
+)
+
+_scanned_files_v4 = Table(
+    "scanned_files", _v4,
+    Column("id", Integer, primary_key=True),
+    Column("scan_id", Integer, ForeignKey("scans.id"), nullable=False),
+    Column("path", String),
+    UniqueConstraint("scan_id", "path", name="uq_scanned_files_scan_path"),
+)
+
+_findings_v4 = Table(
+    "findings", _v4,
+    Column("id", Integer, primary_key=True),
+    Column("scan_id", Integer, ForeignKey("scans.id"), nullable=False),
+    Column("file_id", Integer, ForeignKey("scanned_files.id"), nullable=True),
+    Column("line", Integer, nullable=True),
+    Column("code", String, nullable=True),
+    Column("pattern", String),
+    Column("severity", String),
+    Column("fingerprint", String(40), nullable=False),
+    Column("count", Integer),
+    Column("recommendation", String, nullable=True),
+    Column("created_at", DateTime, index=True),
+    UniqueConstraint("scan_id", "fingerprint", name="uq_findings_scan_fingerprint"),
+    Index("ix_findings_scan_severity", "scan_id", "severity"),
+    Index("ix_findings_fingerprint", "fingerprint"),
+)
+
+_v5 = MetaData()
+
+_finding_stats_v5 = Table(
+    "finding_stats", _v5,
+    Column("bucket", DateTime, primary_key=True),
+    Column("severity", String, primary_key=True),
+    Column("pattern", String, primary_key=True),
+    Column("count", Integer),
+)
+
+
+# -- migrations ------------------------------------------------------------
+
+def _initial(conn):
+    _create(conn, _vulnerabilities_v1)
+
+
+def _vulnerability_recommendation(conn):
+    # Tables created before the field existed lack the column
+    _add_column(conn, "vulnerabilities", "recommendation", "VARCHAR")
+
+
+def _jobs_and_cache(conn):
+    _create(conn, _scan_jobs_v3, _recommendation_cache_v3)
+
+
+def _normalized_findings(conn):
+    _create(conn, _scans_v4, _scanned_files_v4, _findings_v4)
+    _add_column(conn, "scan_jobs", "scan_id", "INTEGER REFERENCES scans(id)")
+    # Job results now live in `findings` under the job's scan
+    if inspect(conn).has_table("scan_job_results"):
+        conn.execute(text("DROP TABLE scan_job_results"))
+
+    # Carry legacy rows over under a single "legacy" scan
+    legacy = _vulnerabilities_v1
+    rows = conn.execute(select(legacy)).mappings().all()
+    if not rows:
+        return
+    now = datetime.now(timezone.utc)
+    scan_id = conn.execute(
+        _scans_v4.insert().values(kind="legacy", target="vulnerabilities", created_at=now)
+    ).inserted_primary_key[0]
+    conn.execute(_findings_v4.insert(), [
+        {
+            "scan_id": scan_id,
+            "pattern": r["pattern"],
+            "severity": r["severity"],
+            # Legacy rows carry no file/code; keep them distinct by old id
+            "fingerprint": fingerprint(f"legacy:{r['id']}", r["pattern"], None),
+            "count": r["count"] or 1,
+            "recommendation": r["recommendation"],
+            "created_at": now,
+        }
+        for r in rows
+    ])
+
+
+def _finding_stats(conn):
+    _create(conn, _finding_stats_v5)
+    # Backfill the counters from existing findings; memory is O(buckets)
+    totals = {}
+    findings = _findings_v4.c
+    result = conn.execution_options(stream_results=True, yield_per=1000).execute(
+        select(findings.created_at, findings.severity, findings.pattern, findings.count)
+    )
+    now = datetime.now(timezone.utc)
+    for created_at, severity, pattern, count in result:
+        key = (stat_bucket(created_at or now), severity or "", pattern or "")
+        totals[key] = totals.get(key, 0) + (count or 1)
+    if totals:
+        conn.execute(_finding_stats_v5.insert(), [
+            {"bucket": b, "severity": sev, "pattern": pat, "count": n}
+            for (b, sev, pat), n in totals.items()
+        ])
+
+
+def _job_skipped_files(conn):
+    _add_column(conn, "scan_jobs", "skipped", "VARCHAR")
+
+
+def _job_heartbeat(conn):
+    _add_column(conn, "scan_jobs", "owner", "VARCHAR")
+    _add_column(conn, "scan_jobs", "heartbeat_at", "DATETIME")
+
+
+MIGRATIONS = [
+    (1, "initial vulnerabilities table", _initial),
+    (2, "vulnerabilities.recommendation column", _vulnerability_recommendation),
+    (3, "scan jobs and recommendation cache", _jobs_and_cache),
+    (4, "normalized scans, scanned files and findings", _normalized_findings),
+    (5, "rolling finding statistics", _finding_stats),
+    (6, "scan_jobs.skipped column", _job_skipped_files),
+    (7, "scan_jobs.owner and heartbeat_at columns", _job_heartbeat),
+]
+
+
+@contextlib.contextmanager
+def _upgrade_lock(engine):
+    """Serialize `upgrade` across the processes sharing `engine`'s database."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _PG_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _PG_LOCK_KEY})
+                conn.commit()
+        return
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or fcntl is None or not database or database == ":memory:":
+        yield
+        return
+    with open(os.path.abspath(database) + ".migrate.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def upgrade(engine):
+    """Apply every migration newer than the database's recorded version."""
+    with _upgrade_lock(engine):
+        _version_table.create(bind=engine, checkfirst=True)
+        with engine.connect() as conn:
+            applied = set(conn.execute(select(_version_table.c.version)).scalars())
+
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            try:
+                with engine.begin() as conn:
+                    step(conn)
+                    conn.execute(_version_table.insert().values(
+                        version=version, name=name, applied_at=datetime.now(timezone.utc),
+                    ))
+                logger.info("migrations: applied %d (%s)", version, name)
+            except Exception:
+                # Without a lock (other databases) another worker may have applied it
+                with engine.connect() as conn:
+                    done = conn.execute(
+                        select(_version_table.c.version).where(_version_table.c.version == version)
+                    ).first()
+                if done is None:
+                    raise
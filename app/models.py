@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, String, UniqueConstraint,
+)
 from app.database import Base
 
 class Vulnerability(Base):
+    """Legacy flat findings table, superseded by `Finding`.
+
+    Kept so `app.migrations` can copy existing rows into the normalized schema.
+    """
     __tablename__ = "vulnerabilities"
 
     id = Column(Integer, primary_key=True)
@@ -9,3 +15,100 @@ class Vulnerability(Base):
     severity = Column(String)
     count = Column(Integer)
     recommendation = Column(String, nullable=True)
+
+
+class Scan(Base):
+    """One scan run: an uploaded file, a project path or a scan job."""
+    __tablename__ = "scans"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String)  # file | project | job | legacy
+    target = Column(String, nullable=True)
+    created_at = Column(DateTime, index=True)
+
+
+class ScannedFile(Base):
+    __tablename__ = "scanned_files"
+    __table_args__ = (UniqueConstraint("scan_id", "path", name="uq_scanned_files_scan_path"),)
+
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=False)
+    path = Column(String)
+
+
+class Finding(Base):
+    """A deduplicated finding within a scan.
+
+    `fingerprint` identifies the same issue (file, rule, code) regardless of
+    its line number; repeats within a scan increment `count` instead of adding
+    rows.
+    """
+    __tablename__ = "findings"
+    __table_args__ = (
+        UniqueConstraint("scan_id", "fingerprint", name="uq_findings_scan_fingerprint"),
+        Index("ix_findings_scan_severity", "scan_id", "severity"),
+        Index("ix_findings_fingerprint", "fingerprint"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=False)
+    file_id = Column(Integer, ForeignKey("scanned_files.id"), nullable=True)
+    line = Column(Integer, nullable=True)
+    code = Column(String, nullable=True)
+    pattern = Column(String)
+    severity = Column(String)
+    fingerprint = Column(String(40), nullable=False)
+    count = Column(Integer, default=1)
+    recommendation = Column(String, nullable=True)
+    created_at = Column(DateTime, index=True)
+
+
+class FindingStat(Base):
+    """Rolling finding counters per hour, severity and pattern.
+
+    Maintained incrementally by `persistence.FindingWriter` so dashboards read
+    O(buckets) rows instead of scanning `findings`.
+    """
+    __tablename__ = "finding_stats"
+
+    bucket = Column(DateTime, primary_key=True)  # start of the hour (UTC)
+    severity = Column(String, primary_key=True)
+    pattern = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+
+class ScanJob(Base):
+    """A project scan submitted through `/scan-jobs` and run by `app.services.jobs`."""
+    __tablename__ = "scan_jobs"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, index=True)  # queued | running | done | failed
+    path = Column(String)
+    mode = Column(String, nullable=True)
+    workers = Column(Integer, default=1)
+    include_ai = Column(Boolean, default=False)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=True)
+    findings_total = Column(Integer, default=0)
+    critical = Column(Integer, default=0)
+    high = Column(Integer, default=0)
+    medium = Column(Integer, default=0)
+    recommendations_done = Column(Integer, default=0)
+    skipped = Column(String, nullable=True)  # JSON list of `ingest.skip_record` entries
+    error = Column(String, nullable=True)
+    # "host:pid" of the process running the job, refreshed every heartbeat
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class RecommendationCache(Base):
+    """Persistent tier of the AI recommendation cache (see `app.services.rec_cache`)."""
+    __tablename__ = "recommendation_cache"
+
+    key = Column(String, primary_key=True)  # sha256 of model, pattern and normalized snippet
+    model = Column(String)
+    pattern = Column(String, nullable=True)
+    recommendation = Column(String)
+    created_at = Column(DateTime, index=True)
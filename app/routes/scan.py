@@ -1,43 +1,58 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import json
 import os
-from app.services.sast import scan_code, scan_code_with_ai
+from datetime import datetime
+from app.services.sast import add_ai_recommendations
 from app.database import SessionLocal
-from app.models import Vulnerability
+from app.models import Finding, ScanJob, ScannedFile
 
-from app.services.project_scanner import scan_project
-from app.services.recommender import generate_recommendation
+from app.services.enrichment import scheduler as enrichment_scheduler
+from app.services.executors import run_cpu, run_db
+from app.services.findings import FindingSet
+from app.services.archive_scanner import ArchiveError, iter_scan_archive, open_archive
+from app.services.ingest import apply_limits
+from app.services.metrics import phase
+from app.services.rule_packs import scan_source
+from app.services.project_scanner import iter_scan_project, scan_project
+from app.services.jobs import JobQueueFull, job_to_dict, submit_scan_job
+from app.services.persistence import FindingWriter, create_scan
+from app.services.finding_queries import (
+    STAT_GROUPS, finding_select, finding_stats, parse_fields, row_to_dict,
+)
 
 router = APIRouter()
 
 
 @router.post("/scan-file")
-async def scan_file(background_tasks: BackgroundTasks, file: UploadFile = File(...), include_ai: bool = False):
+async def scan_file(file: UploadFile = File(...), include_ai: bool = False, mode: str = None):
     """Scan an uploaded file and return findings immediately.
 
-    Recommendations are generated asynchronously in the background and written
-    to the database; the initial response contains findings without AI recommendations.
+    Recommendations are generated asynchronously by the `enrichment` scheduler
+    and written to the database; the initial response contains findings without
+    AI recommendations. Their progress is at `/scans/{scan_id}/enrichment`.
+    `mode=ast` switches to the syntax-aware engine (see `sast.scan_code`).
+    Scanning and database work run on `executors` pools, never on the event loop.
     """
     import traceback
 
     try:
-        content = await file.read()
+        with phase("upload"):
+            content = await file.read()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read uploaded file: {e}")
-    # Try UTF-8 decode first, fall back to latin-1 or replacement to avoid crashing
-    try:
-        code = content.decode("utf-8")
-    except UnicodeDecodeError:
-        try:
-            code = content.decode("latin-1")
-        except Exception:
-            code = content.decode("utf-8", errors="replace")
+    # Same limits as project scans: no binaries, nothing over SCAN_MAX_FILE_BYTES
+    endpos, skip = apply_limits(file.filename, content)
+    skipped = [skip] if skip else []
 
     # Run rule-based scan immediately and return findings promptly
     try:
+        # Rules are picked by the file's extension; unknown ones are scanned as Python
+        results = await run_cpu(scan_source, content, file.filename or "", mode, endpos, size=endpos) if endpos else []
         if include_ai:
-            results = scan_code_with_ai(code)
-        else:
-            results = scan_code(code)
+            # Blocks on the LLM; Starlette's thread pool keeps that off the loop too
+            await run_in_threadpool(add_ai_recommendations, results)
     except Exception:
         results = []
 
@@ -55,157 +70,325 @@ async def scan_file(background_tasks: BackgroundTasks, file: UploadFile = File(.
 
     # Wrap the rest of the processing so we can return a helpful error locally
     try:
-        db = SessionLocal()
-        vuln_ids = []
         try:
-            for finding in results:
-                vuln = Vulnerability(
-                    pattern=finding.get("pattern"),
-                    severity=finding.get("severity"),
-                    count=1,
-                    recommendation=None,
-                )
-                db.add(vuln)
-                # Ensure the instance is persisted and has an id before collecting it
-                try:
-                    db.flush()
-                    db.refresh(vuln)
-                except Exception:
-                    # If refresh/flush fail, continue; id may be available after commit
-                    pass
-                vuln_ids.append(vuln.id)
-            try:
-                db.commit()
-            except Exception as e:
-                # If the DB schema is missing the `recommendation` column (common when
-                # the table was created before the field was added), attempt to alter
-                # the table to add the column and retry the insert once.
-                msg = str(e)
-                db.rollback()
-                if "no column named recommendation" in msg or "has no column named recommendation" in msg:
-                    try:
-                        from app.database import engine
-                        from sqlalchemy import text
-                        # Use a transactional connection and SQLAlchemy text() for DDL
-                        with engine.begin() as conn:
-                            conn.execute(text('ALTER TABLE vulnerabilities ADD COLUMN recommendation VARCHAR'))
-                    except Exception:
-                        # If we cannot alter the table, re-raise the original error
-                        raise
-
-                    # Retry persistence in a fresh session
-                    try:
-                        new_db = SessionLocal()
-                        new_ids = []
-                        for finding in results:
-                            v = Vulnerability(
-                                pattern=finding.get("pattern"),
-                                severity=finding.get("severity"),
-                                count=1,
-                                recommendation=None,
-                            )
-                            new_db.add(v)
-                        try:
-                            new_db.commit()
-                        except Exception:
-                            new_db.rollback()
-                            raise
-                        finally:
-                            # collect ids
-                            for v in new_db.query(Vulnerability).order_by(Vulnerability.id.desc()).limit(len(results)).all()[::-1]:
-                                vuln_ids.append(v.id)
-                            new_db.close()
-                    except Exception:
-                        raise
-                else:
-                    raise
+            scan_id, vuln_ids = await run_db(_persist_upload, file.filename, results)
         except Exception:
-            # Close DB and surface a controlled error to the client
-            db.close()
             raise HTTPException(status_code=500, detail="Failed to persist scan results")
-        finally:
-            db.close()
 
-        # Schedule background enrichment of recommendations
+        # Queue the findings for enrichment, most severe first
         try:
-            background_tasks.add_task(_enrich_recommendations_background, vuln_ids, results)
+            run = enrichment_scheduler.start(scan_id)
+            run.add_many(results, vuln_ids)
+            run.close()
         except Exception:
             # If scheduling fails, ignore — we already returned findings
             pass
 
-        # Build summary counts
-        critical = sum(1 for f in results if f.get("severity") == "CRITICAL")
-        high = sum(1 for f in results if f.get("severity") == "HIGH")
-        medium = sum(1 for f in results if f.get("severity") == "MEDIUM")
-
-        summary = {
-            "critical": critical,
-            "high": high,
-            "medium": medium,
-            "total": len(results),
-        }
-
-        return {"filename": file.filename, "summary": summary, "findings": results}
+        return {"filename": file.filename, "scan_id": scan_id, "summary": _summarize(results, skipped), "findings": results}
+    except HTTPException:
+        raise
     except Exception as e:
         tb = traceback.format_exc()
         # For local debugging return the traceback in the response body
         raise HTTPException(status_code=500, detail={"error": str(e), "trace": tb})
 
 
-def _enrich_recommendations_background(vuln_ids, findings):
-    """Background task: persist recommendations on the vulnerabilities.
-
-    If the finding already has an `ai_recommendation` (set by scan_code_with_ai),
-    reuse it directly to avoid a redundant LLM call. Otherwise call generate_recommendation.
-    """
+def _persist_upload(filename, findings):
+    """Store one scan row and its findings; returns `(scan_id, finding ids)`."""
     db = SessionLocal()
     try:
-        for vid, finding in zip(vuln_ids, findings):
-            # Prefer recommendation already computed synchronously
-            rec = finding.get("ai_recommendation") or finding.get("recommendation")
-            if not rec:
-                try:
-                    rec = generate_recommendation(finding)
-                except Exception:
-                    rec = None
-            if rec:
-                try:
-                    vuln = db.get(Vulnerability, vid)
-                    if vuln:
-                        vuln.recommendation = rec
-                        db.add(vuln)
-                except Exception:
-                    pass
-        try:
+        # One scan row, then one bulk upsert for all findings of the upload
+        with phase("db_write"):
+            scan = create_scan(db, "file", filename)
+            vuln_ids = FindingWriter(db, scan.id, default_path=filename).write(findings)
             db.commit()
-        except Exception:
-            db.rollback()
+        return scan.id, vuln_ids
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
 
+def _summarize(findings, skipped=()):
+    """Count findings per reported severity in a single pass.
+
+    `skipped` lists the files that were not (fully) scanned, see `ingest.skip_record`.
+    A `FindingSet` is counted from its columns.
+    """
+    summary = {"critical": 0, "high": 0, "medium": 0, "total": 0}
+    if isinstance(findings, FindingSet):
+        for severity, n in findings.counts("severity").items():
+            severity = (severity or "").lower()
+            if severity in summary:
+                summary[severity] += n
+        summary["total"] = len(findings)
+        findings = ()
+    for f in findings:
+        severity = (f.get("severity") or "").lower()
+        if severity in summary:
+            summary[severity] += 1
+        summary["total"] += 1
+    summary["skipped"] = list(skipped)
+    return summary
+
+
+# Rows fetched per round trip by the streaming export
+_EXPORT_BATCH = 1000
+
 
 @router.get('/vulnerabilities')
-def list_vulnerabilities():
-    """Return all stored vulnerabilities with recommendations (if any)."""
+def list_vulnerabilities(
+    request: Request,
+    response: Response,
+    after: int = 0,
+    limit: int = 100,
+    severity: str = None,
+    pattern: str = None,
+    scan_id: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    fields: str = None,
+):
+    """Return one page of stored findings, as a list like before pagination.
+
+    Filters (`severity` may be a comma-separated list, `since`/`until` bound
+    `created_at`) run in the database, and `fields` limits the returned
+    columns. Pages are keyed on id: unless this is the last page, the
+    `X-Next-After` header holds the value to pass back as `after`, and the
+    `Link` header the URL of the next page.
+    """
+    try:
+        names = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    limit = max(1, min(limit, 1000))
+    stmt = finding_select(names, severity, pattern, scan_id, since, until, after).limit(limit)
+    db = SessionLocal()
+    try:
+        with phase("db_query"):
+            items = [row_to_dict(r) for r in db.execute(stmt)]
+        if len(items) == limit:
+            next_after = items[-1]["id"]
+            response.headers["X-Next-After"] = str(next_after)
+            response.headers["Link"] = f'<{request.url.include_query_params(after=next_after)}>; rel="next"'
+        return items
+    finally:
+        db.close()
+
+
+@router.get('/vulnerabilities/stats')
+def vulnerability_stats(
+    group_by: str = "severity",
+    bucket: str = "hour",
+    scan_id: int = None,
+    since: datetime = None,
+    until: datetime = None,
+):
+    """Return finding counts grouped by `severity`, `pattern` and/or `bucket`.
+
+    `group_by` is a comma-separated list; `bucket` (hour or day) sets the
+    width of time buckets. Counts are aggregated in the database: from the
+    rolling `finding_stats` counters, or from `findings` when `scan_id` is
+    given.
+    """
+    keys = [k.strip() for k in group_by.split(",") if k.strip()]
+    unknown = [k for k in keys if k not in STAT_GROUPS]
+    if unknown or not keys:
+        raise HTTPException(status_code=400, detail=f"group_by must be a subset of {', '.join(STAT_GROUPS)}")
+    if bucket not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="bucket must be hour or day")
+    db = SessionLocal()
+    try:
+        with phase("db_query"):
+            groups = finding_stats(db, keys, bucket, scan_id, since, until)
+        return {
+            "group_by": keys,
+            "total": sum(g["count"] for g in groups),
+            "groups": groups,
+        }
+    finally:
+        db.close()
+
+
+@router.get('/vulnerabilities/export')
+def export_vulnerabilities(
+    severity: str = None,
+    pattern: str = None,
+    scan_id: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    fields: str = None,
+):
+    """Stream every matching finding as NDJSON.
+
+    Rows are read through a server-side cursor in fixed-size batches, so
+    neither the database driver nor the app holds the full result set.
+    """
+    try:
+        names = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stmt = finding_select(names, severity, pattern, scan_id, since, until).execution_options(
+        stream_results=True, yield_per=_EXPORT_BATCH,
+    )
+
+    def rows():
+        db = SessionLocal()
+        try:
+            for batch in db.execute(stmt).partitions():
+                yield "".join(json.dumps(row_to_dict(r)) + "\n" for r in batch)
+        finally:
+            db.close()
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+# Maximum number of findings waiting for a recommendation while streaming; the
+# scan pauses when this many are pending so memory stays flat on huge projects.
+_STREAM_MAX_PENDING = 200
+_STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _encode_event(fmt, event, data):
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+def _stream_project_scan(path, mode, workers, fmt):
+    """Yield `finding`, `recommendation` and a final `summary` event.
+
+    Findings are sent as soon as the scanner produces them; recommendations are
+    queued with the `enrichment` scheduler, most severe first, and sent whenever
+    they complete, keyed by the `id` of their finding. Findings dropped for the
+    budget or deadline get a null recommendation. If the client disconnects,
+    the run is cancelled so its queued findings are not sent to the model.
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    summary = {"critical": 0, "high": 0, "medium": 0, "total": 0}
+    skipped = []
+    pending = {}
+
+    def drain(block):
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            idx = pending.pop(fut)
+            try:
+                rec = fut.result() or None
+            except Exception:
+                rec = None
+            yield _encode_event(fmt, "recommendation", {"id": idx, "ai_recommendation": rec})
+
+    run = enrichment_scheduler.start()
+    try:
+        for idx, finding in enumerate(iter_scan_project(path, mode, workers=workers, skipped=skipped)):
+            severity = (finding.get("severity") or "").lower()
+            if severity in summary:
+                summary[severity] += 1
+            summary["total"] += 1
+            yield _encode_event(fmt, "finding", {"id": idx, "finding": finding})
+
+            pending[run.add(finding)] = idx
+            while pending and len(pending) >= _STREAM_MAX_PENDING:
+                yield from drain(block=True)
+            if pending:
+                yield from drain(block=False)
+
+        run.close()
+        while pending:
+            yield from drain(block=True)
+    finally:
+        # Also reached when the client disconnects (GeneratorExit): nobody
+        # reads the remaining recommendations, so do not pay for them
+        if pending:
+            run.cancel()
+            pending.clear()
+        run.close()
+
+    summary["skipped"] = skipped
+    yield _encode_event(fmt, "summary", {"summary": summary})
+
+
+# Findings of an archive scan are persisted in chunks of this many rows
+_ARCHIVE_WRITE_CHUNK = 500
+
+
+def _stream_archive_scan(members, filename, mode, fmt):
+    """Yield a `finding` event per finding and a final `summary` event.
+
+    Findings are also stored under one "archive" scan, written in chunks as
+    the archive is read, so they can be listed through `/vulnerabilities`.
+    """
+    skipped = []
+    chunk = []
     db = SessionLocal()
     try:
-        rows = db.query(Vulnerability).all()
-        return [
-            {
-                'id': r.id,
-                'pattern': r.pattern,
-                'severity': r.severity,
-                'count': r.count,
-                'recommendation': r.recommendation,
-            }
-            for r in rows
-        ]
+        scan_id = create_scan(db, "archive", filename).id
+        db.commit()
+        writer = FindingWriter(db, scan_id)
+        summary = {"critical": 0, "high": 0, "medium": 0, "total": 0}
+        for idx, finding in enumerate(iter_scan_archive(members, mode, skipped)):
+            severity = (finding.get("severity") or "").lower()
+            if severity in summary:
+                summary[severity] += 1
+            summary["total"] += 1
+            chunk.append(finding)
+            if len(chunk) >= _ARCHIVE_WRITE_CHUNK:
+                writer.write(chunk)
+                db.commit()
+                chunk.clear()
+            yield _encode_event(fmt, "finding", {"id": idx, "finding": finding})
+        writer.write(chunk)
+        db.commit()
     finally:
         db.close()
 
+    summary["skipped"] = skipped
+    yield _encode_event(fmt, "summary", {"scan_id": scan_id, "summary": summary})
+
+
+@router.post("/scan-archive")
+def scan_archive(file: UploadFile = File(...), mode: str = None, stream: str = "ndjson"):
+    """Scan every source file in an uploaded zip or tar(.gz) archive.
+
+    The archive is never extracted: members are read one at a time and the
+    findings are streamed back (`stream=ndjson` or `sse`) while later members
+    are still being read. See `archive_scanner.iter_scan_archive` for the
+    member and size limits.
+    """
+    if stream not in _STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="stream must be ndjson or sse")
+    try:
+        members = open_archive(file.file)
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        _stream_archive_scan(members, file.filename, mode, stream),
+        media_type=_STREAM_MEDIA_TYPES[stream],
+    )
+
+
+@router.get("/recommendation-cache/stats")
+def recommendation_cache_stats():
+    """Return hit/miss counters of the AI recommendation cache in this process."""
+    from app.services.rec_cache import recommendation_cache
+    return recommendation_cache.snapshot()
+
+
 @router.post("/scan-project")
-def scan_project_endpoint(path: str):
+def scan_project_endpoint(path: str, mode: str = None, workers: int = 1, stream: str = None):
+    """Scan a folder visible to the server.
+
+    By default the full result is returned as one JSON body. With
+    `stream=ndjson` or `stream=sse` the response is streamed instead: one
+    `finding` event per finding as it is found, `recommendation` events as AI
+    recommendations complete, and a closing `summary` event.
+    """
+    if stream is not None and stream not in _STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="stream must be one of: ndjson, sse")
+
     # Validate that the path exists inside the running environment
     if not os.path.exists(path):
         raise HTTPException(
@@ -217,28 +400,129 @@ def scan_project_endpoint(path: str):
             ),
         )
 
-    results = scan_project(path)
-    for finding in results:
-        try:
-            rec = generate_recommendation(finding)
-            if rec:
-                finding["ai_recommendation"] = rec
-            else:
-                finding["ai_recommendation"] = None
-        except Exception:
-            finding["ai_recommendation"] = None
-            pass
+    if stream:
+        return StreamingResponse(
+            _stream_project_scan(path, mode, workers, stream),
+            media_type=_STREAM_MEDIA_TYPES[stream],
+        )
+
+    skipped = []
+    results = scan_project(path, mode, workers=workers, skipped=skipped)
+    run = enrichment_scheduler.start()
+    # Rows are read from the FindingSet columns; only the queued ones become dicts
+    futures = run.add_many(results)
+    run.close()
+    run.wait()
+    results.set_recommendations(fut.result() if fut is not None else None for fut in futures)
+
+    # also return a summary like the file scanner; the findings are encoded
+    # straight from the FindingSet columns, in chunks
+    return StreamingResponse(
+        _findings_body({"summary": _summarize(results, skipped)}, results),
+        media_type="application/json",
+    )
 
-    # also return a summary like the file scanner
-    critical = sum(1 for f in results if f["severity"] == "CRITICAL")
-    high = sum(1 for f in results if f["severity"] == "HIGH")
-    medium = sum(1 for f in results if f["severity"] == "MEDIUM")
 
-    summary = {
-        "critical": critical,
-        "high": high,
-        "medium": medium,
-        "total": len(results),
-    }
+# Findings encoded per chunk of a JSON response body
+_JSON_CHUNK = 1000
 
-    return {"summary": summary, "findings": results}
\ No newline at end of file
+
+def _findings_body(head, findings):
+    """Yield `head` as a JSON object with an extra `findings` array, in pieces."""
+    yield json.dumps(head)[:-1] + ', "findings": ['
+    sep = ""
+    batch = []
+    for text in findings.iter_json():
+        batch.append(text)
+        if len(batch) >= _JSON_CHUNK:
+            yield sep + ", ".join(batch)
+            sep, batch = ", ", []
+    if batch:
+        yield sep + ", ".join(batch)
+    yield "]}"
+
+
+@router.post("/scan-jobs", status_code=202)
+def create_scan_job(path: str, mode: str = None, workers: int = 1, include_ai: bool = False):
+    """Queue a project scan and return its job id without waiting for it."""
+    if not os.path.exists(path):
+        raise HTTPException(status_code=400, detail="Path not found inside the running process.")
+    try:
+        job_id = submit_scan_job(path, mode, workers=workers, include_ai=include_ai)
+    except JobQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Scan queue is full, retry later.",
+            headers={"Retry-After": "30"},
+        )
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/scans/{scan_id}/enrichment")
+def get_enrichment_progress(scan_id: int):
+    """Return the recommendation progress of a scan (see `enrichment.EnrichmentRun.progress`).
+
+    Only scans enriched by this process since it started are known.
+    """
+    run = enrichment_scheduler.run(scan_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No enrichment for this scan in this process")
+    return run.progress()
+
+
+@router.get("/scan-jobs/{job_id}")
+def get_scan_job(job_id: int):
+    """Return the status, progress counters and timings of a scan job."""
+    db = SessionLocal()
+    try:
+        job = db.get(ScanJob, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job_to_dict(job)
+    finally:
+        db.close()
+
+
+@router.get("/scan-jobs/{job_id}/results")
+def get_scan_job_results(job_id: int, after: int = 0, limit: int = 100):
+    """Return one page of a job's findings.
+
+    Pages are keyed on result id: pass the returned `next_after` as `after`
+    to fetch the next page; it is null on the last page.
+    """
+    limit = max(1, min(limit, 1000))
+    db = SessionLocal()
+    try:
+        job = db.get(ScanJob, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        rows = []
+        if job.scan_id is not None:
+            rows = (
+                db.query(Finding, ScannedFile.path)
+                .outerjoin(ScannedFile, Finding.file_id == ScannedFile.id)
+                .filter(Finding.scan_id == job.scan_id, Finding.id > after)
+                .order_by(Finding.id)
+                .limit(limit)
+                .all()
+            )
+        return {
+            "job_id": job_id,
+            "scan_id": job.scan_id,
+            "results": [
+                {
+                    "id": r.id,
+                    "file": path,
+                    "line": r.line,
+                    "code": r.code,
+                    "pattern": r.pattern,
+                    "severity": r.severity,
+                    "count": r.count,
+                    "ai_recommendation": r.recommendation,
+                }
+                for r, path in rows
+            ],
+            "next_after": rows[-1][0].id if len(rows) == limit else None,
+        }
+    finally:
+        db.close()
\ No newline at end of file
@@ -1,58 +1,125 @@
+import concurrent.futures
 import os
-import logging
-import requests
 import json
-try:
-    import openai as _openai_pkg
-    from openai import OpenAI
-except Exception:
-    _openai_pkg = None
-    OpenAI = None
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import metrics
+from app.services.llm_client import LLMClient
 
 logger = logging.getLogger(__name__)
 
 
-# Configure client: prefer OpenRouter if OPENROUTER_API_KEY is set, otherwise use OPENAI_API_KEY
+# Configure client: prefer OpenRouter if OPENROUTER_API_KEY is set, otherwise use OPENAI_API_KEY.
+# Both speak the same chat-completions REST API, so one pooled `LLMClient`
+# serves either provider.
 _client = None
 _client_type = None
 
 _OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
 _OPENROUTER_BASE = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+_OPENAI_BASE = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Models tried, in order, when the primary model's circuit breaker is open
+_FALLBACK_MODELS = [
+    m.strip()
+    for m in os.getenv(
+        "OPENROUTER_FALLBACK_MODELS", "google/gemma-3-12b-it:free,google/gemma-3-4b-it:free"
+    ).split(",")
+    if m.strip()
+]
 
 # Development helper: allow a fake AI mode when no real client is available
 FAKE_AI = os.getenv("FAKE_AI", "false").lower() in ("1", "true", "yes")
 
-# If an OpenRouter API key is provided, prefer calling the OpenRouter HTTP API
-# directly via `requests` (no SDK required).
+
+def _current_model() -> str:
+    if _client_type == "openrouter":
+        # Default to a stable free-tier model; override via OPENROUTER_MODEL env var
+        return os.getenv("OPENROUTER_MODEL", "google/gemma-3-27b-it:free")
+    return os.getenv("OPENAI_MODEL", "gpt-4")
+
+
 if _OPENROUTER_KEY:
     _client_type = "openrouter"
-    logger.info("ai_helper: configured OpenRouter via HTTP (requests)")
-elif OpenAI is not None:
-    _openai_key = os.getenv("OPENAI_API_KEY")
-    if _openai_key:
-        try:
-            _client = OpenAI(api_key=_openai_key)
-            _client_type = "openai"
-            logger.info("ai_helper: configured OpenAI SDK client")
-        except Exception as e:
-            logger.warning("ai_helper: failed to create OpenAI client: %s", e)
-
-
-def generate_ai_recommendation(code_snippet: str) -> str:
+    _extra_headers = {}
+    if os.getenv("OPENROUTER_SITE_URL"):
+        _extra_headers["HTTP-Referer"] = os.getenv("OPENROUTER_SITE_URL")
+    if os.getenv("OPENROUTER_SITE_NAME"):
+        _extra_headers["X-Title"] = os.getenv("OPENROUTER_SITE_NAME")
+    _client = LLMClient(
+        _OPENROUTER_BASE, _OPENROUTER_KEY, [_current_model()] + _FALLBACK_MODELS, _extra_headers,
+    )
+    logger.info("ai_helper: configured OpenRouter via pooled HTTP client")
+elif os.getenv("OPENAI_API_KEY"):
+    _client_type = "openai"
+    _client = LLMClient(_OPENAI_BASE, os.getenv("OPENAI_API_KEY"), [_current_model()])
+    logger.info("ai_helper: configured OpenAI via pooled HTTP client")
+
+# Shared pool for callers that enrich many findings at once. The HTTP work is
+# bounded by the client's semaphore and rate limiter; these threads only wait.
+_ENRICH_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_MAX_CONCURRENCY", "8")) * 2,
+    thread_name_prefix="ai-enrich",
+)
+
+
+def _metric_families():
+    if _client is None:
+        return []
+    data = _client.snapshot()
+    counters = [
+        ("invisithreat_llm_requests_total", "requests", "HTTP requests sent to the LLM provider."),
+        ("invisithreat_llm_rate_limited_total", "rate_limited", "LLM responses with HTTP 429."),
+        ("invisithreat_llm_fallbacks_total", "fallbacks", "Requests routed to a fallback model."),
+        ("invisithreat_llm_errors_total", "errors", "Failed LLM requests."),
+        ("invisithreat_llm_rejected_total", "rejected", "Requests refused because every breaker was open."),
+    ]
+    families = [(name, "counter", help_text, [({}, data[key])]) for name, key, help_text in counters]
+    families.append((
+        "invisithreat_llm_breaker_open", "gauge", "1 while a model's circuit breaker is open.",
+        [({"model": model}, int(state == "open")) for model, state in data["breakers"].items()],
+    ))
+    return families
+
+
+metrics.registry.add_collector(_metric_families)
+
+
+def generate_ai_recommendation(code_snippet: str, pattern: str = None, timeout: float = None) -> str:
     """Return an AI-generated recommendation for a small code snippet.
 
-    Supports OpenRouter (preferred) and standard OpenAI SDK usage. If no client is
-    configured, returns None.
+    Supports OpenRouter (preferred) and OpenAI through the shared `LLMClient`.
+    If no client is configured, or no answer came within `timeout` seconds,
+    returns None. Results are cached by normalized snippet, `pattern` and
+    model (see `rec_cache`), so repeated lines cost a single LLM call.
     """
     # If fake AI mode is enabled, return a deterministic, local recommendation.
     if os.getenv("FAKE_AI", "false").lower() in ("1", "true", "yes"):
         return _fake_recommendation(code_snippet)
 
-    # If we neither have an SDK client nor OpenRouter HTTP configured, skip.
-    if _client is None and _client_type != "openrouter":
+    if _client is None:
         logger.debug("ai_helper: no client configured, skipping AI recommendation")
         return None
 
+    from app.services.rec_cache import recommendation_cache
+    return recommendation_cache.get_or_compute(
+        code_snippet,
+        lambda: _request_recommendation(code_snippet, timeout),
+        pattern=pattern,
+        model=_current_model(),
+    )
+
+
+def submit_ai_recommendation(code_snippet: str, pattern: str = None, timeout: float = None):
+    """Run `generate_ai_recommendation` on the shared pool; return a Future."""
+    return _ENRICH_POOL.submit(generate_ai_recommendation, code_snippet, pattern, timeout)
+
+
+def _request_recommendation(code_snippet: str, timeout: float = None) -> str:
+    """Make the actual LLM round trip for `generate_ai_recommendation`."""
     prompt = f"""You are a security expert. Analyze the following code snippet and:
 1. Identify any security vulnerabilities present.
 2. Explain the risk clearly and concisely.
@@ -63,100 +130,201 @@ Code snippet:
 """
 
     try:
-        if _client_type == "openrouter":
-            # Default to a stable free-tier model; override via OPENROUTER_MODEL env var
-            model = os.getenv("OPENROUTER_MODEL", "google/gemma-3-27b-it:free")
-            headers = {
-                "Authorization": f"Bearer {_OPENROUTER_KEY}",
-                "Content-Type": "application/json",
-            }
-            referer = os.getenv("OPENROUTER_SITE_URL")
-            title = os.getenv("OPENROUTER_SITE_NAME")
-            if referer:
-                headers["HTTP-Referer"] = referer
-            if title:
-                headers["X-Title"] = title
-            payload = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-            }
-            url = _OPENROUTER_BASE.rstrip('/') + "/chat/completions"
-            logger.debug("ai_helper: POST %s model=%s", url, model)
-
-            # Retry with exponential backoff for rate-limit (429) errors.
-            # On persistent 429, fall back to a lighter free-tier model.
-            _FALLBACK_MODELS = [
-                "google/gemma-3-12b-it:free",
-                "google/gemma-3-4b-it:free",
-            ]
-            max_attempts = 3
-            resp = None
-            for attempt in range(max_attempts):
-                current_model = model if attempt == 0 else _FALLBACK_MODELS[min(attempt - 1, len(_FALLBACK_MODELS) - 1)]
-                payload["model"] = current_model
-                logger.debug("ai_helper: attempt %d/%d model=%s", attempt + 1, max_attempts, current_model)
-                resp = requests.post(url, headers=headers, json=payload, timeout=60)
-                if resp.status_code == 429:
-                    wait = 2 ** attempt  # 1s, 2s, 4s
-                    logger.warning(
-                        "ai_helper: rate-limited (429) on model=%s, waiting %ds before retry",
-                        current_model, wait,
-                    )
-                    import time
-                    time.sleep(wait)
-                    continue
-                break  # success or non-429 error
-
-            if not resp.ok:
-                logger.error(
-                    "ai_helper: OpenRouter returned HTTP %s: %s",
-                    resp.status_code,
-                    resp.text[:500],
-                )
-                resp.raise_for_status()
-            response = resp.json()
+        # Retries, Retry-After handling and model fallback live in the client
+        out = _client.complete([{"role": "user", "content": prompt}], timeout=timeout)
+    except Exception as e:
+        logger.exception("ai_helper: exception during LLM call: %s", e)
+        return None
+
+    if out:
+        logger.debug("ai_helper: received response length=%d", len(out))
+    else:
+        logger.warning("ai_helper: received empty response from LLM")
+    return out
+
+
+# Batched enrichment: findings per request are capped both by an estimated
+# token budget for the item payload and by a hard item count.
+BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "3000"))
+BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "40"))
+# Overall deadline for recommendations a request waits on (`/scan-file?include_ai=true`)
+INLINE_TIMEOUT = float(os.getenv("LLM_INLINE_TIMEOUT", "30"))
+
+_BATCH_INSTRUCTIONS = """You are a security expert. For each finding in the JSON array below:
+1. Identify the security vulnerability in `code` (flagged by rule `pattern`).
+2. Explain the risk clearly and concisely.
+3. Provide a concrete, secure fix or mitigation.
+
+Reply with ONLY a JSON array, one object per finding, in the form
+[{"id": "<finding id>", "recommendation": "<text>"}]. Do not add prose outside the array.
+
+Findings:
+"""
+_JSON_ARRAY = re.compile(r"\[.*\]", re.DOTALL)
+
+
+def _estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for code and English
+    return len(text) // 4 + 1
+
+
+def _pack_batches(items, budget: int = None, max_items: int = None):
+    """Split `items` (dicts with id/file/pattern/code) into request-sized batches.
+
+    Items are grouped by file and pattern first so related lines share a
+    prompt, then packed greedily until the token budget or item cap is hit.
+    """
+    budget = budget or BATCH_TOKEN_BUDGET
+    max_items = max_items or BATCH_MAX_ITEMS
+    ordered = sorted(items, key=lambda it: (it.get("file") or "", it.get("pattern") or ""))
+    batch, used = [], 0
+    for item in ordered:
+        cost = _estimate_tokens(json.dumps(item))
+        if batch and (used + cost > budget or len(batch) >= max_items):
+            yield batch
+            batch, used = [], 0
+        batch.append(item)
+        used += cost
+    if batch:
+        yield batch
+
+
+def _parse_batch_response(text: str):
+    """Map finding id -> recommendation from a model reply; tolerate code fences and chatter."""
+    if not text:
+        return {}
+    m = _JSON_ARRAY.search(text)
+    if not m:
+        return {}
+    try:
+        data = json.loads(m.group())
+    except ValueError:
+        return {}
+    out = {}
+    if isinstance(data, list):
+        for entry in data:
+            if isinstance(entry, dict) and entry.get("recommendation"):
+                out[str(entry.get("id"))] = str(entry["recommendation"])
+    return out
+
+
+def generate_ai_recommendations(findings, timeout: float = None):
+    """Return one recommendation (or None) per finding, using batched prompts.
+
+    Cached snippets are answered from `rec_cache`; identical snippets are sent
+    once, and snippets another caller is already asking about wait for that
+    caller's answer (`RecommendationCache.claim`); the rest are packed into a few multi-finding requests that ask for a
+    JSON array keyed by finding id. Items the model skipped or answered with
+    malformed output fall back to a single-finding request.
+    With `timeout`, the whole call returns within that many seconds; requests
+    still running then are cancelled and their findings get None.
+    """
+    if os.getenv("FAKE_AI", "false").lower() in ("1", "true", "yes"):
+        return [_fake_recommendation(f.get("code", "")) for f in findings]
+    if _client is None:
+        return [None] * len(findings)
+
+    from app.services.rec_cache import cache_key, recommendation_cache
+
+    model = _current_model()
+    results = [None] * len(findings)
+    pending = {}  # cache key -> batch item; its `slots` are the finding indexes
+    joined = {}   # cache key -> (future of the caller computing it, finding indexes)
+    for idx, f in enumerate(findings):
+        snippet, pattern = f.get("code", ""), f.get("pattern")
+        key = cache_key(snippet, pattern, model)
+        if key in pending:
+            pending[key]["slots"].append(idx)
+            continue
+        if key in joined:
+            joined[key][1].append(idx)
+            continue
+        # Registers the key as in flight, so concurrent callers wait for this one
+        cached, fut, owner = recommendation_cache.claim(snippet, pattern, model)
+        if cached:
+            results[idx] = cached
+        elif not owner:
+            joined[key] = (fut, [idx])
         else:
-            model = os.getenv("OPENAI_MODEL", "gpt-4")
-            logger.debug("ai_helper: calling OpenAI model=%s", model)
-            response = _client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-            )
-
-        # Extract text from the response; different SDKs may vary slightly.
-        try:
-            # OpenRouter REST returns choices -> message -> content
-            out = response['choices'][0]['message']['content']
-        except Exception:
-            # Fallback for SDK-like object responses
+            pending[key] = {
+                "id": f"f{len(pending)}",
+                "file": f.get("file"),
+                "pattern": pattern,
+                "code": snippet,
+                "slots": [idx],
+            }
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+    settled = set()
+
+    def settle(item, rec):
+        # Every claimed key is released exactly once, answered or not
+        settled.add(item["id"])
+        recommendation_cache.release(item["code"], rec, item["pattern"], model)
+        for idx in item["slots"]:
+            results[idx] = rec
+
+    try:
+        submitted = []
+        for batch in _pack_batches(list(pending.values())):
+            payload = [{"id": it["id"], "pattern": it["pattern"], "code": it["code"]} for it in batch]
+            prompt = _BATCH_INSTRUCTIONS + json.dumps(payload, indent=1)
+            submitted.append((batch, _client.submit([{"role": "user", "content": prompt}])))
+
+        retry = []
+        for batch, fut in submitted:
             try:
-                out = response.choices[0].message.content
-            except Exception:
-                out = getattr(response, 'text', None) or getattr(response, 'content', None) or None
+                answers = _parse_batch_response(fut.result(remaining()))
+            except concurrent.futures.TimeoutError:
+                fut.cancel()
+                logger.warning("ai_helper: batch request cancelled at the %.1fs deadline", timeout)
+                answers = {}
+            except Exception as e:
+                logger.warning("ai_helper: batch request failed: %s", e)
+                answers = {}
+            if len(answers) < len(batch):
+                logger.warning("ai_helper: batch reply covered %d/%d findings", len(answers), len(batch))
+            for item in batch:
+                rec = answers.get(item["id"])
+                if rec:
+                    settle(item, rec)
+                else:
+                    retry.append(item)
 
-        if out:
-            logger.debug("ai_helper: received response length=%d", len(out))
-        else:
-            logger.warning("ai_helper: received empty response from LLM")
-        return out
+        # Per-item fallback for anything the batch replies did not cover. The
+        # keys are claimed by this call, so the request is made directly
+        # rather than through `generate_ai_recommendation`, which would wait
+        # on that claim.
+        if deadline is not None and remaining() <= 0:
+            retry = []
+        futures = [
+            (item, _ENRICH_POOL.submit(_request_recommendation, item["code"], remaining())) for item in retry
+        ]
+        for item, fut in futures:
+            try:
+                rec = fut.result(remaining()) or None
+            except Exception:
+                # Includes the deadline; the request itself is cancelled by its own timeout
+                rec = None
+            settle(item, rec)
 
-    except Exception as e:
-        logger.exception("ai_helper: exception during LLM call: %s", e)
-        msg = str(e).lower()
-        # Detect rate-limiting and optionally fall back to fake recommendations
-        is_rate_limit = (
-            "rate limit" in msg or "rate_limit" in msg or "ratelimit" in msg
-            or (
-                _openai_pkg is not None
-                and getattr(_openai_pkg, 'RateLimitError', None)
-                and isinstance(e, getattr(_openai_pkg, 'RateLimitError'))
-            )
-        )
-        if is_rate_limit:
-            logger.warning("ai_helper: LLM rate-limited: %s", e)
-            if os.getenv("FAKE_AI", "false").lower() in ("1", "true", "yes"):
-                return _fake_recommendation(code_snippet)
-        return None
+        # Snippets another caller was already computing
+        for fut, slots in joined.values():
+            try:
+                rec = fut.result(remaining()) or None
+            except Exception:
+                rec = None
+            for idx in slots:
+                results[idx] = rec
+    finally:
+        for item in pending.values():
+            if item["id"] not in settled:
+                settle(item, None)
+    return results
 
 
 def is_ai_available() -> bool:
@@ -164,10 +332,6 @@ def is_ai_available() -> bool:
     # If fake AI explicitly enabled, report available even without a client.
     if os.getenv("FAKE_AI", "false").lower() in ("1", "true", "yes"):
         return True
-    # If OpenRouter HTTP mode is configured, consider AI available.
-    if _client_type == "openrouter":
-        use_ai = os.getenv("USE_AI", "true").lower()
-        return use_ai in ("1", "true", "yes")
     if _client is None:
         return False
     use_ai = os.getenv("USE_AI", "true").lower()
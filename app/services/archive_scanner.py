@@ -0,0 +1,137 @@
+import os
+import posixpath
+import tarfile
+import zipfile
+
+from app.services.ingest import MAX_FILE_BYTES, OVERSIZE, apply_limits, skip_record
+from app.services.metrics import BYTES_READ, FILES_SCANNED, phase
+from app.services.rule_packs import is_supported, scan_source
+from app.services.walker import exclude_rules, is_excluded
+
+# Protection against archive bombs: stop after this many members or once this
+# many bytes have been decompressed, whichever comes first.
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "20000"))
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Bytes pulled from the upload per read while walking a tar stream
+_READ_CHUNK = 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """Raised when the upload is not a zip or tar archive that can be read."""
+
+
+def _wanted(name: str, rules) -> bool:
+    # Members are matched like paths relative to the scan root (see `walker`)
+    name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    return is_supported(name) and not is_excluded(name, rules)
+
+
+def _zip_members(zf):
+    with zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            # Members are opened by offset, so skipping one costs nothing
+            yield info.filename, info.file_size, lambda limit, info=info: _read_zip(zf, info, limit), 0
+
+
+def _read_zip(zf, info, limit):
+    with zf.open(info) as f:
+        return f.read(limit)
+
+
+def _tar_members(tf):
+    with tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            # A stream can only move past a member by decompressing all of it
+            read = lambda limit, member=member: tf.extractfile(member).read(limit)
+            yield member.name, member.size, read, member.size
+
+
+def open_archive(fileobj):
+    """Open a zip or tar upload and return an iterator over its members.
+
+    Each member is `(name, size, read, skip_cost)` where `read(limit)`
+    returns up to `limit` decompressed bytes and `skip_cost` is how many
+    bytes get decompressed to move past the member, read or not. Zip needs a
+    seekable file (its directory sits at the end; Starlette spools uploads to
+    a temporary file); tar is opened in stream mode ("r|*"), which reads
+    front to back in chunks and never seeks, whatever the compression. Raises
+    ArchiveError for anything else.
+    """
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    try:
+        if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+            return _zip_members(zipfile.ZipFile(fileobj))
+        return _tar_members(tarfile.open(fileobj=fileobj, mode="r|*", bufsize=_READ_CHUNK))
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        raise ArchiveError(f"not a readable zip or tar archive: {e}")
+
+
+def iter_scan_archive(members, mode: str = None, skipped: list = None):
+    """Yield findings for every source member of an archive from `open_archive`.
+
+    Members are read and scanned one at a time, without extracting anything
+    to disk, so memory is bounded by the largest member (itself capped at
+    `ingest.MAX_FILE_BYTES`) rather than by the archive. The usual binary and
+    size checks apply per member; skipped members, and the rest of the
+    archive once ARCHIVE_MAX_MEMBERS or ARCHIVE_MAX_BYTES is reached, are
+    reported through `skipped` as in `project_scanner.iter_scan_project`.
+    Every member counts toward ARCHIVE_MAX_BYTES, including the ones that are
+    not scanned but must still be decompressed to get past them (tar).
+    """
+    count = 0
+    total = 0
+    rules = exclude_rules()
+    try:
+        for name, size, read, skip_cost in members:
+            count += 1
+            if count > ARCHIVE_MAX_MEMBERS:
+                if skipped is not None:
+                    skipped.append(skip_record(name, "archive_member_limit"))
+                return
+            wanted = _wanted(name, rules)
+            if not wanted or (size > MAX_FILE_BYTES and OVERSIZE != "truncate"):
+                # Not read, but skipping it may still decompress all of it
+                total += skip_cost
+                if total > ARCHIVE_MAX_BYTES:
+                    if skipped is not None:
+                        skipped.append(skip_record(name, "archive_size_limit", size))
+                    return
+                if wanted and skipped is not None:
+                    # The header size is enough to decide
+                    skipped.append(skip_record(name, "too_large", size))
+                continue
+            if total + max(min(size, MAX_FILE_BYTES), skip_cost) > ARCHIVE_MAX_BYTES:
+                if skipped is not None:
+                    skipped.append(skip_record(name, "archive_size_limit", size))
+                return
+            try:
+                # Header sizes can lie, so the read itself is capped; one byte
+                # over the cap tells an oversized member from one at the limit
+                with phase("read"):
+                    data = read(MAX_FILE_BYTES + 1)
+            except (OSError, RuntimeError, zipfile.BadZipFile, tarfile.TarError, EOFError):
+                total += skip_cost
+                if skipped is not None:
+                    skipped.append(skip_record(name, "unreadable", size))
+                continue
+            total += max(len(data), skip_cost)
+            endpos, skip = apply_limits(name, data, max(size, len(data)))
+            if skip is not None and skipped is not None:
+                skipped.append(skip)
+            if not endpos:
+                continue
+            FILES_SCANNED.inc()
+            BYTES_READ.inc(endpos)
+            for finding in scan_source(data, name, mode, endpos):
+                finding["file"] = name
+                yield finding
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError):
+        # Damaged past this point; keep what was already scanned
+        if skipped is not None:
+            skipped.append(skip_record(None, "archive_corrupt"))
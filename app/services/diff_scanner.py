@@ -0,0 +1,114 @@
+import os
+import re
+import subprocess
+
+from app.services.project_scanner import _scan_file
+from app.services.rule_packs import supported_extensions
+from app.services.walker import exclude_rules, is_excluded
+
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+# C-style escapes git uses in quoted path names
+_ESCAPES = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13, '"': 34, "\\": 92}
+
+
+def _git(folder_path: str, *args):
+    out = subprocess.run(
+        ["git", "-C", folder_path, "-c", "core.quotePath=false", *args],
+        check=True, capture_output=True, text=True, encoding="utf-8", errors="replace",
+    )
+    return out.stdout
+
+
+def _unquote(path: str) -> str:
+    """Decode a path as git writes it in diff headers ("..." with C escapes, UTF-8 octets)."""
+    if not (len(path) >= 2 and path[0] == path[-1] == '"'):
+        return path
+    raw = bytearray()
+    i, body = 0, path[1:-1]
+    while i < len(body):
+        c = body[i]
+        if c != "\\" or i + 1 == len(body):
+            raw += c.encode("utf-8")
+            i += 1
+        elif body[i + 1] in _ESCAPES:
+            raw.append(_ESCAPES[body[i + 1]])
+            i += 2
+        else:
+            raw.append(int(body[i + 1:i + 4], 8) & 0xFF)
+            i += 4
+    return raw.decode("utf-8", errors="replace")
+
+
+def _new_path(header: str):
+    """The path of a `+++ ` header line relative to the diff root, or None for /dev/null."""
+    target = header[4:]
+    # Git ends names containing a space with a TAB
+    if target.endswith("\t"):
+        target = target[:-1]
+    target = _unquote(target)
+    return target[2:] if target.startswith("b/") else None
+
+
+def changed_lines(base: str, folder_path: str = "."):
+    """Map each added/modified source file to the set of its changed line numbers.
+
+    Only local git objects are read (no fetch). Changes are taken from the
+    merge base of `base` and HEAD to the working tree, i.e. what a pull
+    request against `base` would introduce. Paths are relative to
+    `folder_path`.
+    """
+    merge_base = _git(folder_path, "merge-base", base, "HEAD").strip()
+    diff = _git(
+        folder_path, "diff", "--relative", "--no-color", "--no-ext-diff", "-U0",
+        # Fixed prefixes whatever diff.noprefix / diff.mnemonicPrefix say
+        "--src-prefix=a/", "--dst-prefix=b/",
+        "--diff-filter=AMR", merge_base, "--", *sorted(f"*{ext}" for ext in supported_extensions()),
+    )
+
+    changes = {}
+    current = None
+    # File headers run from `diff --git` to the first hunk; only there are
+    # `--- `/`+++ ` names rather than removed or added lines
+    in_header = False
+    after_old = False
+    rules = exclude_rules()
+    # Not splitlines(): source lines may hold form feeds and other separators
+    for line in diff.split("\n"):
+        if line.startswith("diff --git "):
+            in_header, after_old, current = True, False, None
+            continue
+        if in_header and not line.startswith("@@"):
+            if line.startswith("+++ ") and after_old:
+                current = _new_path(line)
+                if current is not None and is_excluded(current, rules):
+                    current = None
+                if current is not None:
+                    changes.setdefault(current, set())
+            after_old = line.startswith("--- ")
+            continue
+        in_header = False
+        if current is None:
+            continue
+        m = _HUNK.match(line)
+        if m:
+            start = int(m.group(1))
+            count = int(m.group(2)) if m.group(2) is not None else 1
+            changes[current].update(range(start, start + count))
+    return changes
+
+
+def iter_scan_diff(base: str, folder_path: str = ".", mode: str = None, skipped: list = None):
+    """Scan only the files changed since `base`, yielding findings on changed lines.
+
+    Skipped files are appended to `skipped` as in `project_scanner.iter_scan_project`.
+    """
+    for rel_path, lines in changed_lines(base, folder_path).items():
+        if not lines:
+            continue
+        findings = _scan_file(os.path.join(folder_path, rel_path), mode, skipped)
+        yield from (f for f in findings if f["line"] in lines)
+
+
+def scan_diff(base: str, folder_path: str = ".", mode: str = None, skipped: list = None):
+    """`iter_scan_diff` as a list."""
+    return list(iter_scan_diff(base, folder_path, mode, skipped))
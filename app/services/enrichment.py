@@ -0,0 +1,494 @@
+"""Recommendation enrichment, scheduled by severity, budget and deadline.
+
+Findings are not enriched in the order they were found. Callers open a run
+per scan with `scheduler.start(scan_id)` and add its findings. A few worker
+threads (ENRICH_WORKERS) repeatedly take the most urgent queued findings
+(CRITICAL before HIGH before MEDIUM; within a severity, older runs first and
+newest first within a run), send them as one batched request
+(`recommender.generate_recommendations`) and store the answers on the
+findings' rows.
+
+Each run has:
+
+- a budget: at most ENRICH_SCAN_BUDGET of its findings are sent to the
+  model. Findings below ENRICH_ALWAYS_SEVERITY are only admitted while they
+  fit the budget left; past that a new finding either replaces the least
+  severe one queued or is dropped on arrival, so a huge scan holds at most
+  a budget's worth of them and the budget goes to the worst ones;
+- a deadline: findings not started ENRICH_DEADLINE seconds after the run
+  began are dropped;
+- progress counters (`EnrichmentRun.progress`), served by
+  `GET /scans/{scan_id}/enrichment`.
+
+A run whose consumer went away (a client disconnected from a stream) is
+`cancel`led: its queued findings are dropped instead of costing LLM calls.
+
+Identical snippets (see `rec_cache.cache_key`) queued by several runs at
+once are sent once and the answer goes to all of them; later repeats are
+answered by `rec_cache`. Findings that already carry a recommendation (from
+`include_ai`) are stored without an LLM call and cost no budget.
+"""
+import functools
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from app.database import SessionLocal
+from app.services.findings import FindingSet
+from app.services.metrics import phase
+from app.services.persistence import bulk_update_recommendations
+from app.services.rec_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "2"))
+ENRICH_SCAN_BUDGET = int(os.getenv("ENRICH_SCAN_BUDGET", "500"))
+ENRICH_DEADLINE = float(os.getenv("ENRICH_DEADLINE", "600"))
+ENRICH_ALWAYS_SEVERITY = os.getenv("ENRICH_ALWAYS_SEVERITY", "CRITICAL").upper()
+
+SEVERITY_ORDER = ("CRITICAL", "HIGH", "MEDIUM")
+
+# Findings taken per batched request; defaults to the LLM batch cap
+BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", os.getenv("LLM_BATCH_MAX_ITEMS", "40")))
+
+# Idle workers wake up this often to drop findings whose deadline passed
+_SWEEP_SECONDS = 1.0
+# Finished runs kept for `progress` lookups
+_MAX_FINISHED_RUNS = 1000
+# Priority of findings that already have a recommendation: store them first
+_PREFILLED = -1
+# Findings taken under the lock at a time by `EnrichmentRun.add_many`
+_ADD_CHUNK = 1000
+
+
+def _record(finding):
+    """`(severity, pattern, code, recommendation, finding)` of a finding dict, as `_add` takes it."""
+    rec = finding.get("ai_recommendation") or finding.get("recommendation")
+    return finding.get("severity"), finding.get("pattern"), finding.get("code", ""), rec, finding
+
+
+def _rank(severity) -> int:
+    severity = (severity or "").upper()
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else len(SEVERITY_ORDER)
+
+
+def _built(finding) -> dict:
+    return finding if isinstance(finding, dict) else finding()
+
+
+class _Target:
+    """One finding of one run waiting for a recommendation."""
+
+    __slots__ = ("run", "vuln_id", "future", "item", "capped")
+
+    def __init__(self, run, vuln_id, item):
+        self.run = run
+        self.vuln_id = vuln_id
+        self.future = Future()
+        self.item = item
+        # Queued and held against the run's budget (see `EnrichmentScheduler._admit`)
+        self.capped = False
+
+
+class _Item:
+    """A snippet to enrich, shared by every target with the same cache key."""
+
+    __slots__ = ("key", "finding", "rank", "run_seq", "state", "rec", "targets")
+
+    def __init__(self, key, finding, rank, run_seq, rec=None):
+        self.key = key
+        self.finding = finding
+        self.rank = rank
+        self.run_seq = run_seq
+        self.state = "queued"  # queued | running | finished | dropped
+        self.rec = rec
+        self.targets = []
+
+
+class EnrichmentRun:
+    """The findings of one scan, enriched under one budget and deadline.
+
+    Add findings with `add`/`add_many`, then `close` the run once all of
+    them are in; `wait` returns when every finding is resolved. The futures
+    returned by `add` resolve to the recommendation, or None when the model
+    gave none or the finding was dropped.
+    """
+
+    def __init__(self, scheduler, scan_id, budget: int, deadline: float, seq: int):
+        self.scan_id = scan_id
+        self.seq = seq
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + deadline
+        self.sent = 0
+        self.done = 0
+        self.failed = 0
+        self.dropped = {"budget": 0, "deadline": 0, "cancelled": 0}
+        self.closed = False
+        self._pending = set()
+        self._capped = 0     # queued targets held against the budget
+        self._evictable = []  # (-rank, seq, target) of those, least severe on top
+        self._scheduler = scheduler
+
+    def add(self, finding, vuln_id=None) -> Future:
+        """Queue `finding`; with `vuln_id` its recommendation is also stored on that row."""
+        fut = self._scheduler._add(self, [(_record(finding), vuln_id)])[0]
+        if fut is None:
+            fut = Future()
+            fut.set_result(None)
+        return fut
+
+    def add_many(self, findings, vuln_ids=None):
+        """Queue several findings at once; returns their futures in order.
+
+        `findings` may be any iterable and is consumed in chunks. Findings
+        dropped on arrival for the budget get None instead of a future, so a
+        large scan costs no objects for them. Rows of a `FindingSet` are read
+        from its columns; a dict is built only for the rows that get queued.
+        """
+        vuln_ids = iter(vuln_ids) if vuln_ids is not None else itertools.repeat(None)
+        if isinstance(findings, FindingSet):
+            records = (
+                (severity, pattern, code, rec, functools.partial(findings.__getitem__, i))
+                for i, code, pattern, severity, rec in findings.index_records()
+            )
+        else:
+            records = map(_record, findings)
+        futures = []
+        entries = zip(records, vuln_ids)
+        while True:
+            chunk = list(itertools.islice(entries, _ADD_CHUNK))
+            if not chunk:
+                return futures
+            futures += self._scheduler._add(self, chunk)
+
+    def close(self):
+        """Mark the run complete: no more findings will be added."""
+        with self._scheduler._cond:
+            self.closed = True
+            self._scheduler._cond.notify_all()
+
+    def cancel(self):
+        """Close the run and drop its findings not sent yet; their futures resolve to None."""
+        with self._scheduler._cond:
+            self.closed = True
+            for target in [t for t in self._pending if t.item.state == "queued"]:
+                self._scheduler._drop(target, "cancelled")
+            self._scheduler._cond.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.closed and not self._pending
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the run is closed and resolved; False on timeout."""
+        end = None if timeout is None else time.monotonic() + timeout
+        cond = self._scheduler._cond
+        with cond:
+            while not self.finished:
+                now = time.monotonic()
+                if now >= self.deadline:
+                    self._scheduler._expire(self)
+                    if self.finished:
+                        break
+                if end is not None and now >= end:
+                    return False
+                limit = max(self.deadline - now, 0) or _SWEEP_SECONDS
+                cond.wait(limit if end is None else min(limit, end - now))
+        return True
+
+    def progress(self) -> dict:
+        """Counters of the run; `queued` and `in_flight` count findings still waiting."""
+        with self._scheduler._cond:
+            in_flight = sum(1 for t in self._pending if t.item.state == "running")
+            return {
+                "scan_id": self.scan_id,
+                "state": "done" if self.finished else "running",
+                "budget": self.budget,
+                "sent": self.sent,
+                "done": self.done,
+                "failed": self.failed,
+                "queued": len(self._pending) - in_flight,
+                "in_flight": in_flight,
+                "dropped": dict(self.dropped),
+                "deadline_in": round(max(self.deadline - time.monotonic(), 0.0), 1),
+            }
+
+
+class EnrichmentScheduler:
+    """Priority queue of findings to enrich, drained by a pool of worker threads."""
+
+    def __init__(self, workers: int = ENRICH_WORKERS, batch_size: int = BATCH_SIZE):
+        self._workers = workers
+        self._batch_size = batch_size
+        self._cond = threading.Condition()
+        # (rank, run seq, -seq, seq, item): worst severity, then oldest run, then newest
+        self._heap = []
+        self._seq = itertools.count()
+        self._run_seq = itertools.count()
+        self._by_key = {}  # cache key -> queued or running item
+        self._runs = OrderedDict()  # scan id -> run
+        self._active = set()  # runs with unresolved findings
+        self._outstanding = 0
+        self._threads = []
+        self._stopping = False
+
+    def start(self, scan_id=None, budget: int = None, deadline: float = None) -> EnrichmentRun:
+        """Open a run; runs with a `scan_id` can be looked up with `run`."""
+        run = EnrichmentRun(
+            self, scan_id,
+            ENRICH_SCAN_BUDGET if budget is None else budget,
+            ENRICH_DEADLINE if deadline is None else deadline,
+            next(self._run_seq),
+        )
+        if scan_id is not None:
+            with self._cond:
+                self._runs[scan_id] = run
+                self._runs.move_to_end(scan_id)
+                self._forget_finished()
+        return run
+
+    def run(self, scan_id):
+        """The latest run of `scan_id`, or None if it is unknown here."""
+        with self._cond:
+            return self._runs.get(scan_id)
+
+    def _forget_finished(self):
+        excess = len(self._runs) - _MAX_FINISHED_RUNS
+        for scan_id in [s for s, r in self._runs.items() if r.finished][:max(excess, 0)]:
+            del self._runs[scan_id]
+
+    def _add(self, run, entries):
+        """Queue `entries` of `(record, vuln_id)`; returns a future, or None if dropped, per entry.
+
+        A record is `(severity, pattern, code, recommendation, finding)` where
+        `finding` is the finding dict or a callable building it; it is only
+        built for findings that start a new item.
+        """
+        always = _rank(ENRICH_ALWAYS_SEVERITY)
+        with self._cond:
+            self._ensure_workers()
+            futures = []
+            added = 0
+            for (severity, pattern, code, rec, finding), vuln_id in entries:
+                if rec:
+                    item = _Item(None, _built(finding), _PREFILLED, run.seq, rec)
+                    self._push(item)
+                else:
+                    rank = _rank(severity)
+                    if rank > always and not self._admit(run, rank):
+                        run.dropped["budget"] += 1
+                        futures.append(None)
+                        continue
+                    key = cache_key(code or "", pattern)
+                    item = self._by_key.get(key)
+                    if item is None:
+                        item = self._by_key[key] = _Item(key, _built(finding), rank, run.seq)
+                        self._push(item)
+                target = _Target(run, vuln_id, item)
+                if item.rank > always and item.state == "queued":
+                    target.capped = True
+                    run._capped += 1
+                    heapq.heappush(run._evictable, (-item.rank, next(self._seq), target))
+                item.targets.append(target)
+                run._pending.add(target)
+                futures.append(target.future)
+                added += 1
+            self._outstanding += added
+            if added:
+                self._active.add(run)
+            self._cond.notify_all()
+        return futures
+
+    def _admit(self, run, rank) -> bool:
+        """Make room in `run`'s budget for a finding of `rank`; False if it does not fit.
+
+        Queued findings below ENRICH_ALWAYS_SEVERITY are held to the budget
+        left. When that is full, the least severe of them gives way to a more
+        severe newcomer; the caller holds the lock.
+        """
+        if run.sent + run._capped < run.budget:
+            return True
+        heap = run._evictable
+        while heap and not heap[0][2].capped:
+            heapq.heappop(heap)  # sent or dropped since
+        if not heap or -heap[0][0] <= rank:
+            return False
+        self._drop(heapq.heappop(heap)[2], "budget")
+        return True
+
+    def _push(self, item):
+        seq = next(self._seq)
+        heapq.heappush(self._heap, (item.rank, item.run_seq, -seq, seq, item))
+
+    def _resolve(self, target, rec, reason=None):
+        """Settle one target; the caller holds the lock."""
+        run = target.run
+        run._pending.discard(target)
+        if reason is not None:
+            run.dropped[reason] += 1
+        elif rec:
+            run.done += 1
+        else:
+            run.failed += 1
+        if not run._pending:
+            self._active.discard(run)
+            run._evictable.clear()
+        self._outstanding -= 1
+        target.future.set_result(rec)
+
+    def _drop(self, target, reason):
+        if target.capped:
+            target.capped = False
+            target.run._capped -= 1
+        item = target.item
+        item.targets.remove(target)
+        if not item.targets and item.state == "queued":
+            item.state = "dropped"
+            if self._by_key.get(item.key) is item:
+                del self._by_key[item.key]
+        self._resolve(target, None, reason)
+
+    def _expire(self, run):
+        """Drop the queued findings of `run` (its deadline has passed)."""
+        for target in [t for t in run._pending if t.item.state == "queued" and t.item.rank != _PREFILLED]:
+            self._drop(target, "deadline")
+
+    def _exhaust(self, run):
+        """Drop the queued findings of `run` that may not exceed its budget."""
+        always = _rank(ENRICH_ALWAYS_SEVERITY)
+        for target in [t for t in run._pending if t.item.state == "queued" and t.item.rank > always]:
+            self._drop(target, "budget")
+
+    def _sweep(self):
+        now = time.monotonic()
+        for run in [r for r in self._active if r.deadline <= now]:
+            self._expire(run)
+
+    def _take_batch(self):
+        """Pop the most urgent items, charging their runs' budgets; the caller holds the lock."""
+        self._sweep()
+        batch = []
+        always = _rank(ENRICH_ALWAYS_SEVERITY)
+        while self._heap and len(batch) < self._batch_size:
+            item = heapq.heappop(self._heap)[-1]
+            if item.state != "queued":
+                continue  # dropped while waiting
+            if item.rank != _PREFILLED:
+                for target in list(item.targets):
+                    run = target.run
+                    if run.sent >= run.budget and item.rank > always:
+                        self._drop(target, "budget")
+                if item.state != "queued":
+                    continue
+            item.state = "running"
+            for target in item.targets:
+                if target.capped:
+                    target.capped = False
+                    target.run._capped -= 1
+            if item.rank != _PREFILLED:
+                for run in {t.run for t in item.targets}:
+                    run.sent += 1
+                    if run.sent == run.budget:
+                        self._exhaust(run)
+            batch.append(item)
+        return batch
+
+    def _process(self, batch):
+        from app.services.recommender import generate_recommendations
+
+        todo = [item for item in batch if item.rec is None]
+        if todo:
+            try:
+                recs = generate_recommendations([item.finding for item in todo])
+            except Exception:
+                logger.exception("enrichment: batch of %d findings failed", len(todo))
+                recs = [None] * len(todo)
+            for item, rec in zip(todo, recs):
+                item.rec = rec
+
+        with self._cond:
+            # Later duplicates start a new item, answered by `rec_cache`
+            for item in batch:
+                item.state = "finished"
+                if item.key is not None and self._by_key.get(item.key) is item:
+                    del self._by_key[item.key]
+            settled = [(item, list(item.targets)) for item in batch]
+
+        pairs = [(t.vuln_id, item.rec) for item, targets in settled if item.rec
+                 for t in targets if t.vuln_id is not None]
+        if pairs:
+            db = SessionLocal()
+            try:
+                with phase("db_write"):
+                    bulk_update_recommendations(db, pairs)
+                db.commit()
+            except Exception:
+                logger.exception("enrichment: cannot store recommendations")
+                db.rollback()
+            finally:
+                db.close()
+
+        with self._cond:
+            for item, targets in settled:
+                for target in targets:
+                    self._resolve(target, item.rec)
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._stopping:
+                    self._cond.wait(_SWEEP_SECONDS)
+                    self._sweep()
+                if self._stopping and not self._heap:
+                    return
+                batch = self._take_batch()
+                self._cond.notify_all()
+            if batch:
+                self._process(batch)
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._worker, name=f"enrich-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until every queued finding is resolved; False on timeout."""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._outstanding:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def shutdown(self):
+        """Let the workers finish the queue, then stop them (a later `add` restarts them)."""
+        with self._cond:
+            threads, self._threads = self._threads, []
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in threads:
+            thread.join()
+
+
+scheduler = EnrichmentScheduler()
+
+
+def wait_idle(timeout: float = None) -> bool:
+    return scheduler.wait_idle(timeout)
+
+
+def shutdown():
+    scheduler.shutdown()
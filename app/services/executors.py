@@ -0,0 +1,133 @@
+"""Executors that keep blocking work off the event loop.
+
+`async` endpoints must not scan or touch the database on the event loop
+thread: a single slow upload would stall every other request of the
+worker. They hand that work to one of these pools instead:
+
+- `run_cpu(fn, *args)` runs CPU-bound scanning on a process pool shared by
+  all requests (SCAN_PROCESSES, one per CPU by default), so concurrent
+  uploads use every core instead of taking turns on the GIL. Inputs under
+  SCAN_PROCESS_MIN_BYTES run on a small thread pool of their own
+  (SCAN_THREADS) instead, where the scan is cheaper than shipping the bytes
+  to another process, without taking threads from persistence.
+- `run_db(fn, *args)` runs synchronous SQLAlchemy work on a dedicated
+  thread pool (DB_THREADS), separate from Starlette's default one, so slow
+  queries cannot starve the sync endpoints.
+
+All keep the caller's context, so `metrics.phase` timings still end up in
+the request's `Server-Timing` header. Pools are created on first use and
+closed by `shutdown` when the app stops.
+
+Scan processes are started with `mp_context()` (forkserver, or spawn where
+that is unavailable), never forked from the server: the server already runs
+the LLM client's loop, the enrichment workers and the database threads, and
+a fork could copy a lock one of them holds into a child that never gets it
+released.
+"""
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services import metrics
+
+SCAN_PROCESSES = int(os.getenv("SCAN_PROCESSES", "0")) or os.cpu_count() or 1
+SCAN_PROCESS_MIN_BYTES = int(os.getenv("SCAN_PROCESS_MIN_BYTES", str(64 * 1024)))
+SCAN_THREADS = int(os.getenv("SCAN_THREADS", "4"))
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+
+_cpu_pool = None
+_small_pool = None
+_db_pool = None
+_lock = threading.Lock()
+
+
+def mp_context():
+    """The start method for scan processes: forkserver where available, else spawn."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _get_cpu_pool():
+    global _cpu_pool
+    with _lock:
+        if _cpu_pool is None:
+            # Workers are not forked, so they start with empty metrics; they
+            # send theirs back per call
+            _cpu_pool = ProcessPoolExecutor(max_workers=SCAN_PROCESSES, mp_context=mp_context())
+        return _cpu_pool
+
+
+def _get_small_pool():
+    global _small_pool
+    with _lock:
+        if _small_pool is None:
+            _small_pool = ThreadPoolExecutor(max_workers=SCAN_THREADS, thread_name_prefix="scan")
+        return _small_pool
+
+
+def _get_db_pool():
+    global _db_pool
+    with _lock:
+        if _db_pool is None:
+            _db_pool = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+        return _db_pool
+
+
+async def _run_thread(pool, fn, *args):
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args))
+
+
+async def run_db(fn, *args):
+    """Await `fn(*args)` on the database thread pool."""
+    return await _run_thread(_get_db_pool(), fn, *args)
+
+
+async def run_cpu(fn, *args, size: int = None):
+    """Await `fn(*args)` on the scan process pool.
+
+    `fn` and its arguments must be picklable. Pass the input `size` in bytes
+    to keep small inputs in a thread. If the pool died (a worker was killed),
+    it is replaced and the call retried once.
+    """
+    if size is not None and size < SCAN_PROCESS_MIN_BYTES:
+        return await _run_thread(_get_small_pool(), fn, *args)
+    loop = asyncio.get_running_loop()
+    for attempt in (1, 2):
+        pool = _get_cpu_pool()
+        try:
+            result, worker_metrics = await loop.run_in_executor(
+                pool, functools.partial(metrics.call_and_take, fn, *args),
+            )
+        except BrokenProcessPool:
+            _discard_cpu_pool(pool)
+            if attempt == 2:
+                raise
+            continue
+        metrics.merge_worker(worker_metrics)
+        return result
+
+
+def _discard_cpu_pool(pool):
+    global _cpu_pool
+    with _lock:
+        if _cpu_pool is pool:
+            _cpu_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    """Stop every pool; called once the server stops accepting requests."""
+    global _cpu_pool, _small_pool, _db_pool
+    with _lock:
+        pools = (_cpu_pool, _small_pool, _db_pool)
+        _cpu_pool = _small_pool = _db_pool = None
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,243 @@
+"""Compact, column-oriented storage for the findings of large scans.
+
+A finding dict costs several hundred bytes, most of it dict overhead and
+per-finding objects. `FindingSet` keeps one row per finding spread over
+typed columns instead:
+
+- `file`: index into the list of distinct paths (one string per file);
+- `rule`: index into the table of distinct `(pattern, severity, extras)`
+  combinations, so rule strings are stored once per rule;
+- `line`: an unsigned int array;
+- `code`: every code line concatenated into one UTF-8 buffer, cut by an
+  array of end offsets.
+
+Iterating yields ordinary finding dicts (same keys, same key order as the
+scanners produce), built on demand, so code that loops over findings works
+unchanged. Counting, filtering and JSON or database output work on the
+columns without building those dicts.
+"""
+import json
+from array import array
+from collections import Counter
+
+# Keys with a column of their own; any other key is part of the rule entry
+_COLUMN_KEYS = frozenset(("line", "code", "pattern", "severity", "file", "ai_recommendation"))
+_COUNT_KEYS = ("severity", "pattern", "file")
+
+
+class FindingSet:
+    """An append-only sequence of findings stored column-wise (see module doc)."""
+
+    __slots__ = ("_files", "_file_index", "_rules", "_rule_index", "_file", "_rule", "_line",
+                 "_code", "_code_end", "_recs")
+
+    def __init__(self, findings=()):
+        self._files = []        # distinct paths, None included
+        self._file_index = {}
+        self._rules = []        # distinct (pattern, severity, ((key, value), ...))
+        self._rule_index = {}
+        self._file = array("I")
+        self._rule = array("I")
+        self._line = array("I")  # 0 stands for no line
+        self._code = bytearray()
+        self._code_end = array("Q")
+        self._recs = None       # per-row `ai_recommendation`, once one is set
+        self.extend(findings)
+
+    # -- building --------------------------------------------------------
+
+    def _intern_file(self, path) -> int:
+        idx = self._file_index.get(path)
+        if idx is None:
+            idx = self._file_index[path] = len(self._files)
+            self._files.append(path)
+        return idx
+
+    def _intern_rule(self, rule) -> int:
+        idx = self._rule_index.get(rule)
+        if idx is None:
+            idx = self._rule_index[rule] = len(self._rules)
+            self._rules.append(rule)
+        return idx
+
+    def append(self, finding):
+        """Add one finding dict."""
+        extras = tuple((k, v) for k, v in finding.items() if k not in _COLUMN_KEYS)
+        self._rule.append(self._intern_rule((finding.get("pattern"), finding.get("severity"), extras)))
+        self._file.append(self._intern_file(finding.get("file")))
+        self._line.append(finding.get("line") or 0)
+        self._code += (finding.get("code") or "").encode("utf-8", "surrogatepass")
+        self._code_end.append(len(self._code))
+        if "ai_recommendation" in finding or self._recs is not None:
+            if self._recs is None:
+                self._recs = [None] * (len(self._line) - 1)
+            self._recs.append(finding.get("ai_recommendation"))
+
+    def extend(self, findings):
+        """Add finding dicts, or all rows of another FindingSet."""
+        if not isinstance(findings, FindingSet):
+            for finding in findings:
+                self.append(finding)
+            return
+        files = [self._intern_file(p) for p in findings._files]
+        rules = [self._intern_rule(r) for r in findings._rules]
+        self._file.extend(files[i] for i in findings._file)
+        self._rule.extend(rules[i] for i in findings._rule)
+        self._line.extend(findings._line)
+        base = len(self._code)
+        self._code += findings._code
+        self._code_end.extend(end + base for end in findings._code_end)
+        if findings._recs is not None or self._recs is not None:
+            if self._recs is None:
+                self._recs = [None] * (len(self._line) - len(findings))
+            self._recs.extend(findings._recs or [None] * len(findings))
+
+    def set_recommendations(self, recs):
+        """Set `ai_recommendation` on every row, in order."""
+        recs = list(recs)
+        if len(recs) != len(self):
+            raise ValueError(f"expected {len(self)} recommendations, got {len(recs)}")
+        self._recs = recs
+
+    # -- reading ---------------------------------------------------------
+
+    def __len__(self):
+        return len(self._line)
+
+    def _code_at(self, i: int) -> str:
+        start = self._code_end[i - 1] if i else 0
+        return self._code[start:self._code_end[i]].decode("utf-8", "surrogatepass")
+
+    def _row(self, i: int) -> dict:
+        pattern, severity, extras = self._rules[self._rule[i]]
+        line = self._line[i]
+        finding = {"line": line or None, "code": self._code_at(i), "pattern": pattern, "severity": severity}
+        finding.update(extras)
+        path = self._files[self._file[i]]
+        if path is not None:
+            finding["file"] = path
+        if self._recs is not None:
+            finding["ai_recommendation"] = self._recs[i]
+        return finding
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("finding index out of range")
+        return self._row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def __repr__(self):
+        return f"<FindingSet {len(self)} findings in {len(self._files)} files>"
+
+    def __getstate__(self):
+        # The lookup dicts are rebuilt on load; pickles cross process pools
+        return (self._files, self._rules, self._file, self._rule, self._line,
+                self._code, self._code_end, self._recs)
+
+    def __setstate__(self, state):
+        (self._files, self._rules, self._file, self._rule, self._line,
+         self._code, self._code_end, self._recs) = state
+        self._file_index = {p: i for i, p in enumerate(self._files)}
+        self._rule_index = {r: i for i, r in enumerate(self._rules)}
+
+    def records(self):
+        """Yield `(file, line, code, pattern, severity)` per row, without building dicts."""
+        files, rules = self._files, self._rules
+        for i in range(len(self)):
+            pattern, severity = rules[self._rule[i]][:2]
+            yield files[self._file[i]], self._line[i] or None, self._code_at(i), pattern, severity
+
+    def index_records(self):
+        """Yield `(index, code, pattern, severity, ai_recommendation)` per row, without building dicts.
+
+        For consumers that look at every row but need the full dict of only a
+        few (`self[index]`), such as the enrichment scheduler.
+        """
+        rules, recs = self._rules, self._recs
+        for i in range(len(self)):
+            pattern, severity = rules[self._rule[i]][:2]
+            yield i, self._code_at(i), pattern, severity, recs[i] if recs is not None else None
+
+    # -- counting and filtering -------------------------------------------
+
+    def counts(self, by: str = "severity") -> dict:
+        """Number of findings per severity, pattern or file.
+
+        Counted once per distinct rule or file index rather than per finding
+        dict.
+        """
+        if by not in _COUNT_KEYS:
+            raise ValueError(f"by must be one of {', '.join(_COUNT_KEYS)}")
+        out = {}
+        if by == "file":
+            for idx, n in Counter(self._file).items():
+                out[self._files[idx]] = out.get(self._files[idx], 0) + n
+            return out
+        pos = 0 if by == "pattern" else 1
+        for idx, n in Counter(self._rule).items():
+            key = self._rules[idx][pos]
+            out[key] = out.get(key, 0) + n
+        return out
+
+    def _take(self, rows) -> "FindingSet":
+        out = FindingSet()
+        for i in rows:
+            out._file.append(out._intern_file(self._files[self._file[i]]))
+            out._rule.append(out._intern_rule(self._rules[self._rule[i]]))
+            out._line.append(self._line[i])
+            start = self._code_end[i - 1] if i else 0
+            out._code += self._code[start:self._code_end[i]]
+            out._code_end.append(len(out._code))
+            if self._recs is not None:
+                if out._recs is None:
+                    out._recs = []
+                out._recs.append(self._recs[i])
+        return out
+
+    def filter(self, severity=None, pattern=None, file=None) -> "FindingSet":
+        """Return the findings matching every given criterion, as a new FindingSet.
+
+        Each criterion is a value or a collection of accepted values. Rules
+        and files are matched once each; rows are then selected by index.
+        """
+        def accepted(value):
+            return None if value is None else ({value} if isinstance(value, str) else set(value))
+
+        severities, patterns, files = accepted(severity), accepted(pattern), accepted(file)
+        rules = {
+            i for i, (pat, sev, _extras) in enumerate(self._rules)
+            if (severities is None or sev in severities) and (patterns is None or pat in patterns)
+        }
+        paths = None if files is None else {i for i, p in enumerate(self._files) if p in files}
+        return self._take(
+            i for i in range(len(self))
+            if self._rule[i] in rules and (paths is None or self._file[i] in paths)
+        )
+
+    # -- output ----------------------------------------------------------
+
+    def iter_json(self):
+        """Yield each finding as JSON text, formatted like `json.dumps` of its dict.
+
+        Rule and file fragments are encoded once and reused, so only the line
+        number, code and recommendation are encoded per row.
+        """
+        dumps = json.dumps
+        rule_parts = []
+        for pattern, severity, extras in self._rules:
+            part = f', "pattern": {dumps(pattern)}, "severity": {dumps(severity)}'
+            part += "".join(f", {dumps(k)}: {dumps(v)}" for k, v in extras)
+            rule_parts.append(part)
+        file_parts = ["" if p is None else f', "file": {dumps(p)}' for p in self._files]
+        for i in range(len(self)):
+            line = self._line[i]
+            text = (f'{{"line": {line if line else "null"}, "code": {dumps(self._code_at(i))}'
+                    f"{rule_parts[self._rule[i]]}{file_parts[self._file[i]]}")
+            if self._recs is not None:
+                text += f', "ai_recommendation": {dumps(self._recs[i])}'
+            yield text + "}"
@@ -0,0 +1,101 @@
+import mmap
+import os
+from contextlib import contextmanager
+
+from app.services.metrics import BYTES_READ, FILES_SCANNED, FILES_SKIPPED, phase
+
+# Files larger than this are skipped, or only their first MAX_FILE_BYTES are
+# scanned when SCAN_OVERSIZE=truncate.
+MAX_FILE_BYTES = int(os.getenv("SCAN_MAX_FILE_BYTES", str(32 * 1024 * 1024)))
+OVERSIZE = os.getenv("SCAN_OVERSIZE", "skip").lower()
+
+# Files at least this large are memory-mapped instead of read into memory
+MMAP_THRESHOLD = int(os.getenv("SCAN_MMAP_THRESHOLD", str(1024 * 1024)))
+
+# A NUL byte within the first SNIFF_BYTES marks a file as binary (as git does)
+SNIFF_BYTES = 8192
+
+
+class SkippedFile(Exception):
+    """Raised by `open_source` for a file that will not be scanned."""
+
+    def __init__(self, reason: str, size: int = None):
+        super().__init__(reason)
+        self.reason = reason  # binary | too_large | unreadable
+        self.size = size
+
+
+def skip_record(path: str, reason: str, size: int = None) -> dict:
+    """The entry reported in scan summaries for a skipped or truncated file."""
+    FILES_SKIPPED.inc(reason=reason)
+    return {"file": path, "reason": reason, "size": size}
+
+
+def is_binary(buf) -> bool:
+    return buf.find(b"\0", 0, SNIFF_BYTES) >= 0
+
+
+def _truncate_at(buf, limit: int) -> int:
+    """Cut at the last newline before `limit` so no partial line is scanned."""
+    cut = buf.rfind(b"\n", 0, limit)
+    return cut + 1 if cut >= 0 else limit
+
+
+def apply_limits(path: str, buf, size: int = None):
+    """Apply the binary and size checks to contents already in memory.
+
+    Returns `(endpos, skip)`: scan `buf[:endpos]` (nothing when `endpos` is
+    0), and report `skip` when it is not None. `size` is the full size when
+    `buf` holds only a prefix of the contents.
+    """
+    size = len(buf) if size is None else size
+    if is_binary(buf):
+        return 0, skip_record(path, "binary", size)
+    if size > MAX_FILE_BYTES:
+        if OVERSIZE != "truncate":
+            return 0, skip_record(path, "too_large", size)
+        return _truncate_at(buf, MAX_FILE_BYTES), skip_record(path, "truncated", size)
+    return len(buf), None
+
+
+@contextmanager
+def open_source(path: str, max_bytes: int = None, oversize: str = None):
+    """Open `path` for scanning and yield `(buf, endpos, size, truncated)`.
+
+    `buf` is the file's bytes, memory-mapped when the file is at least
+    MMAP_THRESHOLD bytes so its pages are shared with the OS cache instead of
+    copied; only `buf[:endpos]` is to be scanned. Raises SkippedFile for
+    binary files, files that cannot be read and, unless `oversize` is
+    "truncate", files over `max_bytes`.
+    """
+    max_bytes = MAX_FILE_BYTES if max_bytes is None else max_bytes
+    oversize = oversize or OVERSIZE
+    try:
+        f = open(path, "rb")
+    except OSError:
+        raise SkippedFile("unreadable")
+    with f:
+        try:
+            with phase("read"):
+                size = os.fstat(f.fileno()).st_size
+                if size > max_bytes and oversize != "truncate":
+                    raise SkippedFile("too_large", size)
+                # An empty file cannot be mapped, whatever the threshold
+                mapped = size >= max(MMAP_THRESHOLD, 1)
+                if mapped:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    buf = f.read(max_bytes + 1)
+        except OSError:
+            raise SkippedFile("unreadable")
+        try:
+            if is_binary(buf):
+                raise SkippedFile("binary", size)
+            truncated = len(buf) > max_bytes
+            endpos = _truncate_at(buf, max_bytes) if truncated else len(buf)
+            FILES_SCANNED.inc()
+            BYTES_READ.inc(endpos)
+            yield buf, endpos, size, truncated
+        finally:
+            if mapped:
+                buf.close()
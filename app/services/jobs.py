@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+
+from app.database import SessionLocal
+from app.models import Finding, ScanJob
+from app.services.persistence import FindingWriter, create_scan
+
+logger = logging.getLogger(__name__)
+
+# Number of scan jobs that run at the same time, and how many more may wait
+# for a free slot before new submissions are rejected.
+JOB_WORKERS = int(os.getenv("SCAN_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("SCAN_JOB_QUEUE_SIZE", "8"))
+
+# Jobs belong to the process that accepted them, which refreshes their
+# heartbeat every JOB_HEARTBEAT seconds. Queued/running jobs whose heartbeat
+# is older than JOB_STALE_AFTER lost their process and are marked failed.
+JOB_HEARTBEAT = float(os.getenv("SCAN_JOB_HEARTBEAT", "15"))
+JOB_STALE_AFTER = float(os.getenv("SCAN_JOB_STALE_AFTER", "60"))
+
+# Findings are written to the database in chunks of this many rows
+_RESULT_CHUNK = 500
+
+_ACTIVE = ("queued", "running")
+_HOST = socket.gethostname()
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="scan-job")
+_admitted = 0
+_admitted_lock = threading.Lock()
+_heartbeat = None
+
+
+class JobQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+def _now():
+    # Naive UTC, like the `DateTime` columns it is stored in and compared against
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _owner() -> str:
+    # Computed per call: worker processes may be forked after import
+    return f"{_HOST}:{os.getpid()}"
+
+
+def _release(_future=None):
+    global _admitted
+    with _admitted_lock:
+        _admitted -= 1
+
+
+def submit_scan_job(path: str, mode: str = None, workers: int = 1, include_ai: bool = False) -> int:
+    """Record a queued job and hand it to the worker pool; return its id.
+
+    Raises JobQueueFull instead of queueing without bound when the pool is
+    saturated, so callers can answer 503 and stay responsive.
+    """
+    global _admitted
+    with _admitted_lock:
+        if _admitted >= JOB_WORKERS + JOB_QUEUE_SIZE:
+            raise JobQueueFull()
+        _admitted += 1
+    _ensure_heartbeat()
+
+    try:
+        db = SessionLocal()
+        try:
+            job = ScanJob(
+                status="queued",
+                path=path,
+                mode=mode,
+                workers=workers,
+                include_ai=include_ai,
+                owner=_owner(),
+                heartbeat_at=_now(),
+                created_at=_now(),
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+        future = _executor.submit(_run_job, job_id)
+    except Exception:
+        _release()
+        raise
+    future.add_done_callback(_release)
+    return job_id
+
+
+def _run_job(job_id: int):
+    from app.services.project_scanner import iter_scan_project
+
+    db = SessionLocal()
+    try:
+        job = db.get(ScanJob, job_id)
+        job.status = "running"
+        job.started_at = _now()
+        db.commit()
+
+        job.scan_id = create_scan(db, "job", job.path).id
+        writer = FindingWriter(db, job.scan_id)
+        counts = {"CRITICAL": 0, "HIGH": 0, "MEDIUM": 0}
+        total = 0
+        chunk = []
+        skipped = []
+
+        def flush():
+            writer.write(chunk)
+            chunk.clear()
+            job.findings_total = total
+            job.skipped = json.dumps(skipped)
+            job.critical = counts["CRITICAL"]
+            job.high = counts["HIGH"]
+            job.medium = counts["MEDIUM"]
+            db.commit()
+
+        for finding in iter_scan_project(job.path, job.mode, workers=job.workers, skipped=skipped):
+            total += 1
+            if finding.get("severity") in counts:
+                counts[finding["severity"]] += 1
+            chunk.append(finding)
+            if len(chunk) >= _RESULT_CHUNK:
+                flush()
+        flush()
+
+        if job.include_ai:
+            _enrich_job(db, job)
+
+        job.status = "done"
+        job.finished_at = _now()
+        db.commit()
+    except Exception as e:
+        logger.exception("jobs: scan job %s failed", job_id)
+        db.rollback()
+        job = db.get(ScanJob, job_id)
+        if job is not None:
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = _now()
+            db.commit()
+    finally:
+        db.close()
+
+
+# Seconds between progress updates of a job's enrichment
+_PROGRESS_INTERVAL = 1.0
+
+
+def _enrich_job(db, job):
+    from app.services.enrichment import scheduler
+
+    # Offer every finding first so the scheduler can start with the worst ones;
+    # past the budget only the most severe are kept queued
+    run = scheduler.start(job.scan_id)
+    last_id = 0
+    while True:
+        rows = (
+            db.query(Finding)
+            .filter(Finding.scan_id == job.scan_id, Finding.id > last_id)
+            .order_by(Finding.id)
+            .limit(_RESULT_CHUNK)
+            .all()
+        )
+        if not rows:
+            break
+        run.add_many(
+            ({"code": row.code, "pattern": row.pattern, "severity": row.severity} for row in rows),
+            [row.id for row in rows],
+        )
+        last_id = rows[-1].id
+    run.close()
+
+    while True:
+        finished = run.wait(_PROGRESS_INTERVAL)
+        # Findings settled so far, whether enriched, failed or dropped
+        p = run.progress()
+        job.recommendations_done = p["done"] + p["failed"] + sum(p["dropped"].values())
+        db.commit()
+        if finished:
+            break
+
+
+def _ensure_heartbeat():
+    global _heartbeat
+    with _admitted_lock:
+        if _heartbeat is None or not _heartbeat.is_alive():
+            _heartbeat = threading.Thread(target=_beat, name="scan-job-heartbeat", daemon=True)
+            _heartbeat.start()
+
+
+def _beat():
+    """Keep this process's jobs fresh and fail the ones other processes left behind."""
+    while True:
+        time.sleep(JOB_HEARTBEAT)
+        db = SessionLocal()
+        try:
+            db.query(ScanJob).filter(ScanJob.owner == _owner(), ScanJob.status.in_(_ACTIVE)).update(
+                {ScanJob.heartbeat_at: _now()}, synchronize_session=False,
+            )
+            db.commit()
+        except Exception:
+            logger.exception("jobs: cannot refresh job heartbeats")
+            db.rollback()
+        finally:
+            db.close()
+        try:
+            recover_interrupted_jobs()
+        except Exception:
+            logger.exception("jobs: cannot recover interrupted jobs")
+
+
+def recover_interrupted_jobs():
+    """Mark queued/running jobs whose process stopped sending heartbeats as failed.
+
+    Safe to call from every worker process: jobs of live processes, this one
+    or a sibling, have a recent heartbeat and are left alone.
+    """
+    cutoff = _now() - timedelta(seconds=JOB_STALE_AFTER)
+    db = SessionLocal()
+    try:
+        stale = (
+            db.query(ScanJob)
+            .filter(
+                ScanJob.status.in_(_ACTIVE),
+                or_(ScanJob.heartbeat_at.is_(None), ScanJob.heartbeat_at < cutoff),
+            )
+            .all()
+        )
+        for job in stale:
+            job.status = "failed"
+            job.error = "interrupted: the server process running it stopped"
+            job.finished_at = _now()
+        db.commit()
+    finally:
+        db.close()
+
+
+def job_to_dict(job):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "path": job.path,
+        "mode": job.mode,
+        "workers": job.workers,
+        "scan_id": job.scan_id,
+        "include_ai": bool(job.include_ai),
+        "progress": {
+            "findings": job.findings_total or 0,
+            "recommendations": job.recommendations_done or 0,
+        },
+        "summary": {
+            "critical": job.critical or 0,
+            "high": job.high or 0,
+            "medium": job.medium or 0,
+            "total": job.findings_total or 0,
+            "skipped": json.loads(job.skipped) if job.skipped else [],
+        },
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,293 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.services.metrics import phase
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`.
+
+    `block_for` lets a provider's Retry-After push every caller back at once
+    instead of each request discovering the 429 on its own.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block_for(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Per-model breaker: open after `threshold` consecutive failures for `cooldown` seconds.
+
+    After the cooldown one trial request is let through (half-open); success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a request that says nothing about the model's health (e.g. cancelled).
+
+        A half-open trial is given back so the next request can try again.
+        """
+        self._trial = False
+
+
+def _retry_after(resp) -> float:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return 0.0
+
+
+class LLMClient:
+    """Shared, connection-pooled client for OpenAI-compatible chat completion APIs.
+
+    One instance per process owns a keep-alive `httpx.AsyncClient` on a private
+    event loop thread. Every request passes a global concurrency semaphore and
+    a token bucket sized from the provider's rate limit, and is routed to the
+    first model (primary, then fallbacks) whose circuit breaker is closed.
+    Synchronous callers use `complete`; coroutines can await `complete_async`
+    from any event loop.
+    """
+
+    def __init__(self, base_url: str, api_key: str, models, headers=None):
+        self.base_url = base_url.rstrip("/")
+        self.models = list(models)
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self.headers.update(headers or {})
+        self.timeout = _env_float("LLM_TIMEOUT", "60")
+        self.max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        rpm = _env_float("LLM_RATE_LIMIT_RPM", "20")
+        self.bucket_rate = rpm / 60.0
+        self.bucket_capacity = max(1.0, _env_float("LLM_RATE_LIMIT_BURST", "5"))
+        threshold = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+        cooldown = _env_float("LLM_BREAKER_COOLDOWN", "60")
+        self.breakers = {m: CircuitBreaker(threshold, cooldown) for m in self.models}
+        self.stats = {"requests": 0, "rate_limited": 0, "fallbacks": 0, "errors": 0, "rejected": 0}
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<LLMClient {self.base_url} models={self.models}>"
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    # Loop-bound primitives must be created on the loop itself
+                    self._http = httpx.AsyncClient(
+                        base_url=self.base_url,
+                        headers=self.headers,
+                        timeout=self.timeout,
+                        limits=httpx.Limits(
+                            max_connections=self.max_concurrency,
+                            max_keepalive_connections=self.max_concurrency,
+                        ),
+                    )
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    self._bucket = TokenBucket(self.bucket_rate, self.bucket_capacity)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="llm-client", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+        return self._loop
+
+    def _pick_model(self, excluded=()):
+        for i, model in enumerate(self.models):
+            if model not in excluded and self.breakers[model].allow():
+                if i:
+                    self.stats["fallbacks"] += 1
+                return model
+        return None
+
+    async def _send(self, model: str, messages, attempt: int):
+        """Make one request to `model`; returns `(outcome, value)`.
+
+        `outcome` is "ok" with the reply text, "failure" (worth a retry,
+        counts against the model's breaker) or "refused" with the HTTP status
+        of a client error, which another model may still accept.
+        """
+        await self._bucket.acquire()
+        async with self._semaphore:
+            self.stats["requests"] += 1
+            logger.debug("llm_client: attempt %d/%d model=%s", attempt + 1, self.max_attempts, model)
+            try:
+                with phase("llm"):
+                    resp = await self._http.post(
+                        "/chat/completions", json={"model": model, "messages": messages},
+                    )
+            except httpx.HTTPError as e:
+                logger.warning("llm_client: request to model=%s failed: %s", model, e)
+                self.stats["errors"] += 1
+                return "failure", None
+
+        if resp.status_code == 429:
+            wait = _retry_after(resp) or 2 ** attempt
+            self.stats["rate_limited"] += 1
+            logger.warning("llm_client: rate-limited (429) on model=%s, backing off %.1fs", model, wait)
+            self._bucket.block_for(wait)
+            return "failure", None
+        if resp.status_code >= 500:
+            logger.warning("llm_client: model=%s returned HTTP %s", model, resp.status_code)
+            self.stats["errors"] += 1
+            return "failure", None
+        if resp.status_code >= 400:
+            logger.error("llm_client: model=%s returned HTTP %s: %s", model, resp.status_code, resp.text[:500])
+            self.stats["errors"] += 1
+            return "refused", resp.status_code
+        try:
+            return "ok", resp.json()["choices"][0]["message"]["content"]
+        except Exception:
+            logger.warning("llm_client: malformed response from model=%s", model)
+            self.stats["errors"] += 1
+            return "failure", None
+
+    async def _complete(self, messages):
+        # Models that refused this request; retrying them will not help
+        refused = set()
+        for attempt in range(self.max_attempts):
+            model = self._pick_model(refused)
+            if model is None:
+                if refused:
+                    logger.warning("llm_client: every available model refused the request")
+                else:
+                    self.stats["rejected"] += 1
+                    logger.warning("llm_client: all model circuit breakers are open")
+                return None
+            # Every path settles the breaker, or a half-open trial would never end
+            breaker = self.breakers[model]
+            try:
+                outcome, value = await self._send(model, messages, attempt)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except BaseException:
+                breaker.record_failure()
+                raise
+            if outcome == "ok":
+                breaker.record_success()
+                return value
+            if outcome == "refused":
+                refused.add(model)
+                # An unknown model or a bad key stays broken; a bad request says nothing about the model
+                if value in (401, 403, 404):
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            else:
+                breaker.record_failure()
+        return None
+
+    def submit(self, messages):
+        """Schedule a completion and return a `concurrent.futures.Future`."""
+        return asyncio.run_coroutine_threadsafe(self._complete(messages), self._ensure_loop())
+
+    def complete(self, messages, timeout: float = None):
+        """Blocking completion; returns the response text, or None on failure or timeout.
+
+        Past `timeout` seconds the request is cancelled, retries and back-off
+        included.
+        """
+        fut = self.submit(messages)
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            logger.warning("llm_client: no completion within %.1fs, cancelled", timeout)
+            return None
+
+    async def complete_async(self, messages):
+        return await asyncio.wrap_future(self.submit(messages))
+
+    def snapshot(self):
+        data = dict(self.stats)
+        data["breakers"] = {m: b.state for m, b in self.breakers.items()}
+        return data
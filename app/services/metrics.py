@@ -0,0 +1,315 @@
+"""Process-local metrics, rendered in the Prometheus text format.
+
+Counters, gauges and latency histograms are kept in memory and served by
+`GET /metrics`. `phase(name)` times a block: it feeds the
+`invisithreat_phase_seconds` histogram and, inside an HTTP request, the
+request's `Server-Timing` header (see `ServerTimingMiddleware`). Values that
+other services already count (LLM client, recommendation cache) are read at
+scrape time through collectors instead of being counted twice.
+
+Set METRICS_ENABLED=false to turn everything into no-ops.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Latency buckets in seconds, from sub-millisecond regex matches to LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Phase durations of the current request, in seconds; None outside requests
+_timings = ContextVar("invisithreat_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            running = 0
+            for bound, count in zip(self.buckets, state):
+                running += count
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, [("le", bound)]), running
+            yield f"{self.name}_bucket", _format_labels(self.labels, key, [("le", "+Inf")]), state[-1]
+            yield f"{self.name}_sum", _format_labels(self.labels, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labels, key), state[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn):
+        """Register `fn() -> [(name, kind, help, [(labels dict, value)])]`, called per scrape."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+    def take(self):
+        """Return and reset the counter and histogram values (for worker processes)."""
+        out = {}
+        for metric in self._metrics:
+            if metric.kind in ("counter", "histogram"):
+                with metric._lock:
+                    if metric._values:
+                        out[metric.name] = metric._values
+                        metric._values = {}
+        return out
+
+    def merge(self, values):
+        """Add values returned by `take` in another process."""
+        by_name = {m.name: m for m in self._metrics}
+        for name, entries in values.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            with metric._lock:
+                for key, value in entries.items():
+                    if metric.kind == "counter":
+                        metric._values[key] = metric._values.get(key, 0) + value
+                    else:
+                        state = metric._values.setdefault(key, [0] * len(value[:-2]) + [0.0, 0])
+                        metric._values[key] = [a + b for a, b in zip(state, value)]
+
+    def reset(self):
+        for metric in self._metrics:
+            with metric._lock:
+                metric._values = {}
+
+
+registry = Registry()
+
+PHASE_SECONDS = registry.add(Histogram(
+    "invisithreat_phase_seconds", "Time spent per pipeline phase.", ("phase",)))
+HTTP_SECONDS = registry.add(Histogram(
+    "invisithreat_http_request_seconds", "HTTP request latency until the response starts.",
+    ("method", "route", "status")))
+FILES_SCANNED = registry.add(Counter(
+    "invisithreat_files_scanned_total", "Files read and matched."))
+BYTES_READ = registry.add(Counter(
+    "invisithreat_bytes_read_total", "Bytes of source scanned."))
+FILES_SKIPPED = registry.add(Counter(
+    "invisithreat_files_skipped_total", "Files skipped or truncated, by reason.", ("reason",)))
+FINDINGS = registry.add(Counter(
+    "invisithreat_findings_total", "Findings reported by the rule engines.", ("severity",)))
+PREFILTER_SKIPS = registry.add(Counter(
+    "invisithreat_prefilter_skips_total",
+    "Rule set scans skipped because the file contains none of the rules' literals."))
+AST_FALLBACKS = registry.add(Counter(
+    "invisithreat_ast_fallbacks_total", "AST scans that fell back to the regex engine."))
+ENRICH_INFLIGHT = registry.add(Gauge(
+    "invisithreat_enrichment_inflight", "Findings waiting for an AI recommendation."))
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        PHASE_SECONDS.observe(elapsed, phase=self.name)
+        timings = _timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name: str):
+    """Context manager timing one occurrence of pipeline phase `name`."""
+    return _Phase(name) if ENABLED else _NO_PHASE
+
+
+def timed_iter(iterable, name: str):
+    """Yield from `iterable`, charging the time spent producing items to phase `name`."""
+    if not ENABLED:
+        yield from iterable
+        return
+    it = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def call_and_take(fn, *args):
+    """Process-pool entry point: run `fn(*args)` and ship this worker's metrics back.
+
+    The parent passes the second element to `merge_worker`.
+    """
+    return fn(*args), registry.take() if ENABLED else {}
+
+
+def merge_worker(values):
+    """Merge a worker's metrics and charge its phase time to the current request."""
+    if not values:
+        return
+    registry.merge(values)
+    timings = _timings.get()
+    if timings is not None:
+        for (name,), state in values.get(PHASE_SECONDS.name, {}).items():
+            timings[name] = timings.get(name, 0.0) + state[-2]
+
+
+def render() -> str:
+    return registry.render()
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a `Server-Timing` header and recording request latency.
+
+    The header lists the phases timed while handling the request, in
+    milliseconds, plus `total`. Streaming responses only carry the phases
+    that ran before their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start
+                route = getattr(scope.get("route"), "path", "unmatched")
+                HTTP_SECONDS.observe(
+                    total, method=scope["method"], route=route, status=message["status"],
+                )
+                parts = [f"{name};dur={secs * 1000:.1f}" for name, secs in timings.items()]
+                parts.append(f"total;dur={total * 1000:.1f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(parts).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
@@ -0,0 +1,186 @@
+import hashlib
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update
+
+from app.models import Finding, FindingStat, Scan, ScannedFile
+from app.services.findings import FindingSet
+
+# Rows per statement; keeps parameter lists under driver/SQLite limits
+BULK_CHUNK = 1000
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def fingerprint(path, pattern, code) -> str:
+    """Stable identity of a finding: same file, rule and code, any line."""
+    raw = f"{path or ''}\0{pattern or ''}\0{(code or '').strip()}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def stat_bucket(ts: datetime) -> datetime:
+    """Truncate a timestamp to the start of its hour (the `finding_stats` bucket)."""
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def create_scan(db, kind: str, target: str = None) -> Scan:
+    scan = Scan(kind=kind, target=target, created_at=_now())
+    db.add(scan)
+    db.flush()
+    return scan
+
+
+def _upsert_insert(dialect):
+    """Return the dialect's INSERT .. ON CONFLICT construct, or None if unsupported."""
+    if not getattr(dialect, "insert_returning", False):
+        return None
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+class FindingWriter:
+    """Write findings of one scan in bulk, deduplicating by fingerprint.
+
+    Each `write` call resolves (and creates) `ScannedFile` rows for new paths,
+    collapses repeated fingerprints, then upserts one row per fingerprint:
+    `INSERT .. ON CONFLICT (scan_id, fingerprint) DO UPDATE SET count = count +
+    excluded.count RETURNING id` on PostgreSQL/SQLite, a select-then-write
+    fallback elsewhere. Repeats across calls therefore increment `count` too.
+    The per hour/severity/pattern counters in `finding_stats` are bumped in
+    the same transaction, which the caller owns.
+    """
+
+    def __init__(self, db, scan_id: int, default_path: str = None):
+        self.db = db
+        self.scan_id = scan_id
+        self.default_path = default_path
+        self._file_ids = {}
+        self._upsert = _upsert_insert(db.get_bind().dialect)
+
+    def _resolve_files(self, paths):
+        new = sorted({p for p in paths if p is not None and p not in self._file_ids})
+        for start in range(0, len(new), BULK_CHUNK):
+            objs = [ScannedFile(scan_id=self.scan_id, path=p) for p in new[start:start + BULK_CHUNK]]
+            self.db.add_all(objs)
+            self.db.flush()
+            self._file_ids.update((obj.path, obj.id) for obj in objs)
+
+    def write(self, findings):
+        """Persist `findings`; return the `Finding.id` of each, in input order.
+
+        `findings` are dicts, or a `FindingSet`, whose rows are read from its
+        columns without building a dict each.
+        """
+        if isinstance(findings, FindingSet):
+            records = list(findings.records())
+        else:
+            records = [(f.get("file"), f.get("line"), f.get("code"), f.get("pattern"), f.get("severity"))
+                       for f in findings]
+        paths = [path or self.default_path for path, *_rest in records]
+        self._resolve_files(paths)
+
+        rows = {}
+        fps = []
+        stats = {}
+        now = _now()
+        for (_file, line, code, pattern, severity), path in zip(records, paths):
+            key = (severity or "", pattern or "")
+            stats[key] = stats.get(key, 0) + 1
+            fp = fingerprint(path, pattern, code)
+            fps.append(fp)
+            row = rows.get(fp)
+            if row is not None:
+                row["count"] += 1
+                continue
+            rows[fp] = {
+                "scan_id": self.scan_id,
+                "file_id": self._file_ids.get(path),
+                "line": line,
+                "code": code,
+                "pattern": pattern,
+                "severity": severity,
+                "fingerprint": fp,
+                "count": 1,
+                "recommendation": None,
+                "created_at": now,
+            }
+
+        ids = {}
+        values = list(rows.values())
+        for start in range(0, len(values), BULK_CHUNK):
+            ids.update(self._write_chunk(values[start:start + BULK_CHUNK]))
+        self._bump_stats(stat_bucket(now), stats)
+        return [ids[fp] for fp in fps]
+
+    def _bump_stats(self, bucket, stats):
+        """Add this write's per (severity, pattern) occurrences to `finding_stats`."""
+        if not stats:
+            return
+        values = [
+            {"bucket": bucket, "severity": sev, "pattern": pat, "count": n}
+            for (sev, pat), n in stats.items()
+        ]
+        if self._upsert is not None:
+            stmt = self._upsert(FindingStat).values(values)
+            self.db.execute(stmt.on_conflict_do_update(
+                index_elements=[FindingStat.bucket, FindingStat.severity, FindingStat.pattern],
+                set_={"count": FindingStat.count + stmt.excluded["count"]},
+            ))
+            return
+        for v in values:
+            row = self.db.get(FindingStat, (v["bucket"], v["severity"], v["pattern"]))
+            if row is None:
+                self.db.add(FindingStat(**v))
+            else:
+                row.count = (row.count or 0) + v["count"]
+        self.db.flush()
+
+    def _write_chunk(self, values):
+        if self._upsert is not None:
+            stmt = self._upsert(Finding).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Finding.scan_id, Finding.fingerprint],
+                set_={"count": Finding.count + stmt.excluded["count"]},
+            ).returning(Finding.fingerprint, Finding.id)
+            return dict(self.db.execute(stmt).all())
+
+        by_fp = {v["fingerprint"]: v for v in values}
+        existing = dict(self.db.execute(
+            select(Finding.fingerprint, Finding.id).where(
+                Finding.scan_id == self.scan_id, Finding.fingerprint.in_(list(by_fp)),
+            )
+        ).all())
+        for fp, fid in existing.items():
+            self.db.execute(
+                update(Finding).where(Finding.id == fid).values(count=Finding.count + by_fp[fp]["count"])
+            )
+        objs = [Finding(**v) for fp, v in by_fp.items() if fp not in existing]
+        self.db.add_all(objs)
+        self.db.flush()
+        existing.update((obj.fingerprint, obj.id) for obj in objs)
+        return existing
+
+
+def bulk_update_recommendations(db, pairs):
+    """Set `recommendation` for many findings at once.
+
+    `pairs` is an iterable of `(finding_id, recommendation)`; empty
+    recommendations and repeated ids are skipped. Uses the ORM bulk
+    UPDATE-by-primary-key path, i.e. one executemany per chunk instead of a
+    `db.get` per row.
+    """
+    params = {}
+    for fid, rec in pairs:
+        if fid is not None and rec and fid not in params:
+            params[fid] = {"id": fid, "recommendation": rec}
+    params = list(params.values())
+    for start in range(0, len(params), BULK_CHUNK):
+        db.execute(update(Finding), params[start:start + BULK_CHUNK])
+    return len(params)
@@ -1,33 +1,239 @@
+import hashlib
 import os
-from app.services.sast import scan_code
-
-def scan_project(folder_path: str):
-    all_findings = []
-
-    for root, dirs, files in os.walk(folder_path):
-        # Skip common non-project directories to avoid false positives and speed up scan
-        dirs[:] = [d for d in dirs if d not in (".git", "venv", "__pycache__", "node_modules")]
-        for file in files:
-            if file.endswith(".py"):
-                file_path = os.path.join(root, file)
-
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        code = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, "r", encoding="latin-1") as f:
-                            code = f.read()
-                    except Exception:
-                        continue  # skip unreadable files
-                except Exception:
-                    continue  # skip files we can't open
-
-                findings = scan_code(code)
-
-                for finding in findings:
-                    finding["file"] = file_path
-
-                all_findings.extend(findings)
-
-    return all_findings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from app.services import metrics
+from app.services.executors import mp_context
+from app.services.findings import FindingSet
+from app.services.ingest import MAX_FILE_BYTES, SkippedFile, open_source, skip_record
+from app.services.rule_packs import scan_source, supported_extensions
+from app.services.walker import iter_files
+
+# Target amount of source (in bytes) handed to a worker process at once.
+# Sizing batches by bytes rather than file count keeps a few huge generated
+# files from stalling one worker while the others sit idle.
+BATCH_BYTES = int(os.getenv("SCAN_BATCH_BYTES", str(4 * 1024 * 1024)))
+
+
+def _iter_source_files(folder_path: str, exclude=None):
+    """Yield every file that a rule applies to (see `rule_packs.supported_extensions`).
+
+    Excluded, ignored and non-project directories are pruned by `walker.iter_files`.
+    """
+    return iter_files(folder_path, supported_extensions(), exclude)
+
+
+def _scan_file(file_path: str, mode: str = None, skipped: list = None):
+    """Scan one file; skipped or truncated files are appended to `skipped`."""
+    try:
+        with open_source(file_path) as (buf, endpos, size, truncated):
+            findings = scan_source(buf, file_path, mode, endpos)
+    except SkippedFile as e:
+        if skipped is not None:
+            skipped.append(skip_record(file_path, e.reason, e.size))
+        return []
+    if truncated and skipped is not None:
+        skipped.append(skip_record(file_path, "truncated", size))
+
+    for finding in findings:
+        finding["file"] = file_path
+
+    return findings
+
+
+def _scan_batch(paths, mode: str = None):
+    """Worker entry point: scan a batch of files.
+
+    Returns `(findings, skipped)`, both in walk order; `findings` is a
+    `FindingSet`, which is also much cheaper to send back from a worker.
+    """
+    findings = FindingSet()
+    skipped = []
+    for file_path in paths:
+        findings.extend(_scan_file(file_path, mode, skipped))
+    return findings, skipped
+
+
+def _scan_batch_for_cache(items, mode: str = None):
+    """Worker entry point for cached scans.
+
+    `items` are `(path, known_sha256)` pairs. Each result is
+    `(path, size, mtime_ns, sha256, findings, skip)`; `findings` is None when
+    the content hash still matches `known_sha256` and the cached entry is
+    valid. Skipped and truncated files carry their skip record in `skip` and
+    no size, so they are never cached and are reported on every scan.
+    """
+    out = []
+    for file_path, known_sha in items:
+        try:
+            with open_source(file_path) as (buf, endpos, size, truncated):
+                if truncated:
+                    skip = skip_record(file_path, "truncated", size)
+                    out.append((file_path, None, None, None, scan_source(buf, file_path, mode, endpos), skip))
+                    continue
+                st = os.stat(file_path)
+                sha = hashlib.sha256(buf).hexdigest()
+                if sha == known_sha:
+                    out.append((file_path, st.st_size, st.st_mtime_ns, sha, None, None))
+                    continue
+                findings = scan_source(buf, file_path, mode, endpos)
+        except (SkippedFile, OSError) as e:
+            reason = getattr(e, "reason", "unreadable")
+            out.append((file_path, None, None, None, [], skip_record(file_path, reason, getattr(e, "size", None))))
+            continue
+        out.append((file_path, st.st_size, st.st_mtime_ns, sha, findings, None))
+    return out
+
+
+def _batches(items, batch_bytes: int = BATCH_BYTES, key=None):
+    """Group `items` into consecutive batches of roughly `batch_bytes` each."""
+    batch = []
+    size = 0
+    for item in items:
+        try:
+            file_size = os.path.getsize(key(item) if key else item)
+        except OSError:
+            file_size = 0
+        batch.append(item)
+        size += file_size
+        if size >= batch_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def _run_batches(fn, batches, mode, workers):
+    """Yield `fn(batch, mode)` results in batch order, in-process or on a pool."""
+    if workers <= 1:
+        for batch in batches:
+            yield fn(batch, mode)
+        return
+    # Workers are not forked, so they start with empty metrics; they send
+    # theirs back with each batch
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context()) as pool:
+        # `map` yields results in submission order, which keeps output deterministic
+        for result, worker_metrics in pool.map(metrics.call_and_take, repeat(fn), batches, repeat(mode)):
+            metrics.merge_worker(worker_metrics)
+            yield result
+
+
+def _iter_scan_cached(folder_path: str, mode, workers, cache_path, skipped, exclude):
+    from app.services.scan_cache import ScanCache
+
+    cache = ScanCache(cache_path, mode)
+    try:
+        # Cheap pass: stat every file and serve unchanged ones from the cache
+        slots = []   # per file, in walk order: cached findings or None
+        misses = []  # (path, last known sha256) for files that must be read
+        for file_path in metrics.timed_iter(_iter_source_files(folder_path, exclude), "walk"):
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            findings, sha = cache.lookup(file_path, st.st_size, st.st_mtime_ns)
+            if st.st_size > MAX_FILE_BYTES:
+                # Re-apply the size limit; it may have changed since caching
+                findings = None
+            slots.append((file_path, findings))
+            if findings is None:
+                misses.append((file_path, sha))
+
+        if workers > 1:
+            batches = _batches(misses, key=lambda item: item[0])
+        else:
+            batches = ([item] for item in misses)
+        scanned = (
+            result
+            for results in _run_batches(_scan_batch_for_cache, batches, mode, workers)
+            for result in results
+        )
+
+        # Merge cache hits with freshly scanned files, both in walk order
+        for file_path, findings in slots:
+            if findings is None:
+                _path, size, mtime_ns, sha, findings, skip = next(scanned)
+                if skip is not None and skipped is not None:
+                    skipped.append(skip)
+                if findings is None:
+                    # Content unchanged, only the mtime moved
+                    findings = cache.cached_findings(file_path)
+                if size is not None:
+                    cache.store(file_path, size, mtime_ns, sha, findings)
+            for finding in findings:
+                finding["file"] = file_path
+                yield finding
+    finally:
+        cache.close()
+
+
+def iter_scan_project(
+    folder_path: str, mode: str = None, workers: int = 1, cache_path: str = None, skipped: list = None,
+    exclude=None,
+):
+    """Yield findings for every source file under `folder_path` as they are found.
+
+    Python files and the file types covered by rule packs are scanned, each
+    with only the rules for its extension (see `rule_packs.scan_source`).
+
+    With `workers` > 1 the files are split into byte-sized batches and scanned
+    by a process pool; `workers=0` uses one process per CPU. Findings are
+    produced in the same walk order as a serial scan either way.
+
+    `cache_path` (default: the SCAN_CACHE environment variable) enables the
+    incremental cache in `scan_cache.ScanCache`: files whose size and mtime, or
+    failing that content hash, are unchanged since the last scan are not
+    rescanned.
+
+    Files are read through `ingest.open_source`: large ones are memory-mapped
+    and binary, unreadable or oversized ones are skipped (see
+    SCAN_MAX_FILE_BYTES and SCAN_OVERSIZE). When `skipped` is a list, a
+    `skip_record` is appended to it for every skipped or truncated file.
+
+    Directories are walked by `walker.iter_files`, which honors `.gitignore`
+    files for untracked paths and the SCAN_EXCLUDE patterns for all;
+    `exclude` adds more patterns in the same `.gitignore` syntax.
+    """
+    for chunk in _iter_chunks(folder_path, mode, workers, cache_path, skipped, exclude):
+        yield from chunk
+
+
+def _iter_chunks(folder_path, mode, workers, cache_path, skipped, exclude):
+    """Yield the findings of `iter_scan_project` in walk order, in chunks.
+
+    Chunks are the `FindingSet` of each scanned batch, or with the cache an
+    iterator of finding dicts.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if cache_path is None:
+        cache_path = os.getenv("SCAN_CACHE")
+    if cache_path:
+        yield _iter_scan_cached(folder_path, mode, workers, cache_path, skipped, exclude)
+        return
+
+    paths = metrics.timed_iter(_iter_source_files(folder_path, exclude), "walk")
+    # Serially, one file per batch so the first findings surface immediately
+    batches = _batches(paths) if workers > 1 else ([p] for p in paths)
+    for findings, batch_skipped in _run_batches(_scan_batch, batches, mode, workers):
+        if skipped is not None:
+            skipped.extend(batch_skipped)
+        yield findings
+
+
+def scan_project(
+    folder_path: str, mode: str = None, workers: int = 1, cache_path: str = None, skipped: list = None,
+    exclude=None,
+):
+    """Scan every source file under `folder_path` and return all findings.
+
+    See `iter_scan_project` for the parameters. The findings are collected
+    into a `FindingSet`, which iterates like the list of finding dicts it
+    replaces but takes a fraction of the memory on large scans.
+    """
+    findings = FindingSet()
+    for chunk in _iter_chunks(folder_path, mode, workers, cache_path, skipped, exclude):
+        findings.extend(chunk)
+    return findings
@@ -0,0 +1,250 @@
+import builtins
+import hashlib
+import keyword
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# In-process tier: number of entries and seconds an entry stays fresh. The same
+# TTL applies to rows read back from the database tier.
+CACHE_SIZE = int(os.getenv("REC_CACHE_SIZE", "2048"))
+CACHE_TTL = int(os.getenv("REC_CACHE_TTL", str(7 * 24 * 3600)))
+
+_TOKEN = re.compile(
+    r"""(?P<str>[rbuRBU]{0,2}("[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*'))"""
+    r"|(?P<num>\b\d[\d_.xXoObBeEjJ]*\b)"
+    r"|(?P<name>[A-Za-z_]\w*)"
+    r"|(?P<ws>\s+|#.*)"
+    r"|(?P<op>.)"
+)
+_KEEP_NAMES = frozenset(keyword.kwlist) | frozenset(dir(builtins)) | {"self", "cls"}
+
+
+def normalize_snippet(snippet: str) -> str:
+    """Reduce a code line to its shape so near-identical lines share a key.
+
+    Whitespace and comments are dropped and local identifiers are renamed in
+    order of appearance. String and number literals are kept verbatim, as
+    are keywords, builtins and dotted names (`pickle.loads`, `os.system`):
+    they carry the security meaning of the line (`eval("1 + 1")` is not
+    `eval(user_input)`, nor `os.chmod(p, 0o777)` `os.chmod(p, 0o600)`).
+    """
+    out = []
+    names = {}
+    prev = ""
+    for m in _TOKEN.finditer(snippet or ""):
+        kind = m.lastgroup
+        text = m.group()
+        if kind == "ws":
+            continue
+        # Literals are matched as whole tokens only so their content is not
+        # taken for names; they stay as written
+        if kind == "name":
+            nxt = snippet[m.end():m.end() + 1]
+            if text not in _KEEP_NAMES and prev != "." and nxt != ".":
+                text = names.setdefault(text, f"v{len(names)}")
+        out.append(text)
+        prev = text
+    return " ".join(out)
+
+
+def cache_key(snippet: str, pattern: str = None, model: str = None) -> str:
+    raw = f"{model or ''}\0{pattern or ''}\0{normalize_snippet(snippet)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    """Two-tier cache: an in-process LRU backed by the `recommendation_cache` table.
+
+    `get_or_compute` coalesces concurrent requests for the same key so only
+    one LLM call is made; the other callers wait for its result. Callers that
+    make the call themselves (batched prompts) use `claim` and `release`. Failed calls
+    (None) are never cached. Database errors only disable the persistent tier;
+    the table itself is created by `app.migrations.upgrade`, like every other.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: int = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lru = OrderedDict()  # key -> (expires_at, recommendation)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return entry[1]
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._lru[key] = (time.monotonic() + self.ttl, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _session(self):
+        from app.database import SessionLocal
+        from app.models import RecommendationCache as Row
+
+        return SessionLocal(), Row
+
+    def _db_get(self, key):
+        try:
+            db, Row = self._session()
+            try:
+                row = db.get(Row, key)
+                if row is None:
+                    return None
+                created = row.created_at
+                if created is not None and created.tzinfo is None:
+                    created = created.replace(tzinfo=timezone.utc)
+                if created is not None and created < datetime.now(timezone.utc) - timedelta(seconds=self.ttl):
+                    return None
+                return row.recommendation
+            finally:
+                db.close()
+        except Exception as e:
+            logger.debug("rec_cache: database lookup failed: %s", e)
+            self._count("errors")
+            return None
+
+    def _db_put(self, key, value, model, pattern):
+        try:
+            db, Row = self._session()
+            try:
+                db.merge(Row(
+                    key=key,
+                    model=model,
+                    pattern=pattern,
+                    recommendation=value,
+                    created_at=datetime.now(timezone.utc),
+                ))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+        except Exception as e:
+            logger.debug("rec_cache: database store failed: %s", e)
+            self._count("errors")
+
+    def get(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        value = self._db_get(key)
+        if value is not None:
+            self._count("db_hits")
+            self._memory_put(key, value)
+        return value
+
+    def lookup(self, snippet, pattern=None, model=None):
+        """Return the cached recommendation for a snippet, or None, counting a miss."""
+        value = self.get(cache_key(snippet, pattern, model))
+        if value is None:
+            self._count("misses")
+        return value
+
+    def put(self, snippet, value, pattern=None, model=None):
+        if not value:
+            return
+        key = cache_key(snippet, pattern, model)
+        self._memory_put(key, value)
+        self._db_put(key, value, model, pattern)
+
+    def claim(self, snippet, pattern=None, model=None):
+        """Look up a snippet and, on a miss, claim the right to compute it.
+
+        Returns `(value, future, owner)`: the cached value if there is one;
+        otherwise the in-flight future for the key, with `owner` True when
+        this caller registered it and must `release` it with the result, or
+        False when another caller is already computing it (wait on `future`).
+        """
+        key = cache_key(snippet, pattern, model)
+        value = self.get(key)
+        if value is not None:
+            return value, None, False
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        self._count("misses" if owner else "coalesced")
+        return None, fut, owner
+
+    def release(self, snippet, value, pattern=None, model=None, error: BaseException = None):
+        """Settle a key claimed with `claim`: cache `value` and wake the callers waiting on it."""
+        key = cache_key(snippet, pattern, model)
+        with self._lock:
+            fut = self._inflight.pop(key, None)
+        if value and error is None:
+            self._memory_put(key, value)
+            self._db_put(key, value, model, pattern)
+        if fut is not None:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(value)
+
+    def get_or_compute(self, snippet, compute, pattern=None, model=None):
+        value, fut, owner = self.claim(snippet, pattern, model)
+        if value is not None:
+            return value
+        if not owner:
+            return fut.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            self.release(snippet, None, pattern, model, error=e)
+            raise
+        self.release(snippet, value, pattern, model)
+        return value
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data["memory_entries"] = len(self._lru)
+            data["inflight"] = len(self._inflight)
+        lookups = data["memory_hits"] + data["db_hits"] + data["misses"] + data["coalesced"]
+        data["hit_ratio"] = (lookups - data["misses"]) / lookups if lookups else 0.0
+        return data
+
+
+# Shared by every request in this process
+recommendation_cache = RecommendationCache()
+
+
+def _metric_families():
+    data = recommendation_cache.snapshot()
+    lookups = [({"result": name}, data[name]) for name in ("memory_hits", "db_hits", "misses", "coalesced", "errors")]
+    return [
+        ("invisithreat_recommendation_cache_lookups_total", "counter",
+         "Recommendation cache lookups by result.", lookups),
+        ("invisithreat_recommendation_cache_entries", "gauge",
+         "Recommendations held in the in-process cache.", [({}, data["memory_entries"])]),
+    ]
+
+
+metrics.registry.add_collector(_metric_families)
@@ -1,3 +1,6 @@
+from app.services.metrics import ENRICH_INFLIGHT, phase
+
+
 def generate_recommendation(finding):
     """Return an AI-generated recommendation for the finding.
 
@@ -5,32 +8,52 @@ def generate_recommendation(finding):
     caller does not attach a static recommendation.
     """
     try:
-        from app.services.ai_helper import generate_ai_recommendation, is_ai_available
+        from app.services.ai_helper import is_ai_available, submit_ai_recommendation
     except Exception:
         return None
 
     # Only use AI-generated recommendations. If AI is not configured, return None.
     try:
-        if not (is_ai_available() and generate_ai_recommendation):
+        if not is_ai_available():
             return None
     except Exception:
         return None
 
     try:
+        from concurrent.futures import TimeoutError as FuturesTimeout
         snippet = finding.get("code", "")
-        # Run AI call in a short-lived thread with timeout to avoid blocking the request
+        # Run the AI call on the shared enrichment pool with a timeout to avoid blocking the request
+        future = submit_ai_recommendation(snippet, finding.get("pattern"))
+        ENRICH_INFLIGHT.inc()
         try:
-            from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
-            with ThreadPoolExecutor(max_workers=1) as ex:
-                future = ex.submit(generate_ai_recommendation, snippet)
-                try:
-                    ai_resp = future.result(timeout=90)
-                except FuturesTimeout:
-                    return None
-        except Exception:
-            # If concurrency primitives unavailable, fall back to direct call
-            ai_resp = generate_ai_recommendation(snippet)
+            with phase("enrich"):
+                ai_resp = future.result(timeout=90)
+        except FuturesTimeout:
+            return None
+        finally:
+            ENRICH_INFLIGHT.dec()
 
         return ai_resp if ai_resp else None
     except Exception:
         return None
+
+
+def generate_recommendations(findings):
+    """Return an AI-generated recommendation (or None) for each finding, in order.
+
+    Uses batched multi-finding prompts, so a large scan costs a handful of LLM
+    requests instead of one per finding.
+    """
+    findings = list(findings)
+    try:
+        from app.services.ai_helper import generate_ai_recommendations, is_ai_available
+        if not is_ai_available():
+            return [None] * len(findings)
+        ENRICH_INFLIGHT.inc(len(findings))
+        try:
+            with phase("enrich"):
+                return [rec if rec else None for rec in generate_ai_recommendations(findings)]
+        finally:
+            ENRICH_INFLIGHT.dec(len(findings))
+    except Exception:
+        return [None] * len(findings)
@@ -0,0 +1,205 @@
+"""Streaming report writers for CI artifacts: SARIF 2.1.0 and NDJSON.
+
+Both take findings one at a time (`write`) as the scanner produces them and
+write each straight to the output. Only the distinct rules and the skipped
+files are kept until `close`, never the findings themselves, so memory does
+not grow with the scan. Outputs whose name ends in `.gz` (or opened with
+`compress=True`) are gzip-compressed on the fly.
+
+Usage::
+
+    with open_report("report.sarif.gz", "sarif", root=".") as report:
+        for finding in iter_scan_project("."):
+            report.write(finding)
+        report.skipped = skipped
+"""
+import abc
+import gzip
+import json
+import os
+import pathlib
+import re
+import sys
+from urllib.parse import quote
+
+from app.services.persistence import fingerprint
+from app.services.rule_packs import ruleset_version
+
+FORMATS = ("sarif", "ndjson")
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+_LEVELS = {"CRITICAL": "error", "HIGH": "error", "MEDIUM": "warning"}
+# GitHub code scanning ranks alerts by this CVSS-like score
+_SECURITY_SEVERITY = {"CRITICAL": "9.5", "HIGH": "7.5", "MEDIUM": "5.0"}
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+
+
+def rule_id(finding) -> str:
+    """The finding's rule id; built-in rules get one derived from their pattern."""
+    if finding.get("rule_id"):
+        return finding["rule_id"]
+    # `eval\(` -> py-eval, `pickle\.loads\(` -> py-pickle-loads
+    return "py-" + (_SLUG.sub("-", finding.get("pattern") or "").strip("-").lower() or "rule")
+
+
+class _Report(abc.ABC):
+    """Base writer: owns the output stream and the context manager protocol."""
+
+    def __init__(self, stream, root: str = "."):
+        self._out = stream
+        self.root = os.path.abspath(root)
+        self.skipped = []
+        self.count = 0
+
+    @abc.abstractmethod
+    def write(self, finding):
+        """Write one finding to the output."""
+
+    def _finish(self, error):
+        pass
+
+    def close(self, error: BaseException = None):
+        """Finish the report and close the output; `error` is what ended the scan, if it failed."""
+        try:
+            self._finish(error)
+        finally:
+            if self._out not in (sys.stdout, sys.stderr):
+                self._out.close()
+            else:
+                self._out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(exc)
+        return False
+
+
+class NdjsonReport(_Report):
+    """One finding dict per line, as `json.dumps` writes it."""
+
+    def write(self, finding):
+        self._out.write(json.dumps(finding) + "\n")
+        self.count += 1
+
+
+class SarifReport(_Report):
+    """A SARIF 2.1.0 log with one run.
+
+    The run's `results` array is opened first and each result is appended as
+    it arrives. The tool's `rules`, which need every rule seen, and the
+    `invocations` with the skipped files follow it when the report is
+    closed; member order does not matter in JSON. A report closed because
+    the scan raised is marked `executionSuccessful: false`.
+
+    `partialFingerprints` hash the root-relative URI rather than the path as
+    given, so alerts keep their identity whatever directory the checkout
+    lives in.
+    """
+
+    def __init__(self, stream, root: str = "."):
+        super().__init__(stream, root)
+        self._rules = {}  # rule id -> (index, descriptor)
+        self._out.write(
+            '{"$schema": ' + json.dumps(SARIF_SCHEMA) + ', "version": "2.1.0", "runs": [{"results": ['
+        )
+
+    def _uri(self, path) -> str:
+        path = os.path.abspath(path or "")
+        if path == self.root or path.startswith(self.root + os.sep):
+            path = os.path.relpath(path, self.root)
+        return quote(path.replace(os.sep, "/"))
+
+    def _rule_index(self, finding) -> (str, int):
+        rid = rule_id(finding)
+        entry = self._rules.get(rid)
+        if entry is None:
+            severity = finding.get("severity") or ""
+            text = finding.get("message") or f"Potentially dangerous call matching `{finding.get('pattern')}`."
+            descriptor = {
+                "id": rid,
+                "shortDescription": {"text": text},
+                "defaultConfiguration": {"level": _LEVELS.get(severity, "note")},
+                "properties": {
+                    "pattern": finding.get("pattern"),
+                    "severity": severity,
+                    "security-severity": _SECURITY_SEVERITY.get(severity, "2.0"),
+                    "tags": ["security"],
+                },
+            }
+            entry = self._rules[rid] = (len(self._rules), descriptor)
+        return rid, entry[0]
+
+    def write(self, finding):
+        rid, index = self._rule_index(finding)
+        severity = finding.get("severity") or ""
+        code = finding.get("code") or ""
+        uri = self._uri(finding.get("file"))
+        region = {"snippet": {"text": code}}
+        if finding.get("line"):
+            region["startLine"] = finding["line"]
+        result = {
+            "ruleId": rid,
+            "ruleIndex": index,
+            "level": _LEVELS.get(severity, "note"),
+            "message": {"text": finding.get("message") or f"{severity.title()} risk: `{code}`"},
+            "locations": [{"physicalLocation": {
+                "artifactLocation": {"uri": uri, "uriBaseId": "SRCROOT"},
+                "region": region,
+            }}],
+            "partialFingerprints": {
+                "invisithreat/v1": fingerprint(uri, finding.get("pattern"), code),
+            },
+        }
+        if finding.get("ai_recommendation"):
+            result["properties"] = {"recommendation": finding["ai_recommendation"]}
+        self._out.write((", " if self.count else "") + json.dumps(result))
+        self.count += 1
+
+    def _finish(self, error):
+        notifications = [
+            {
+                "level": "warning" if skip["reason"] != "truncated" else "note",
+                "message": {"text": f"{skip['reason']}: {skip['file']}"},
+                "locations": [{"physicalLocation": {"artifactLocation": {"uri": self._uri(skip["file"])}}}],
+            }
+            for skip in self.skipped if skip.get("file")
+        ]
+        if error is not None:
+            notifications.append({
+                "level": "error",
+                "message": {"text": f"scan failed: {type(error).__name__}: {error}"},
+            })
+        tail = {
+            "tool": {"driver": {
+                "name": "InvisiThreat",
+                "version": ruleset_version(),
+                "rules": [descriptor for _index, descriptor in sorted(self._rules.values(), key=lambda e: e[0])],
+            }},
+            "originalUriBaseIds": {"SRCROOT": {"uri": pathlib.Path(self.root).as_uri().rstrip("/") + "/"}},
+            "invocations": [{"executionSuccessful": error is None, "toolExecutionNotifications": notifications}],
+        }
+        self._out.write("], " + json.dumps(tail)[1:-1] + "}]}\n")
+
+
+_WRITERS = {"sarif": SarifReport, "ndjson": NdjsonReport}
+
+
+def open_report(path: str, fmt: str, root: str = ".", compress: bool = None):
+    """Open a streaming report writer for `fmt` ("sarif" or "ndjson").
+
+    `path` "-" writes to stdout. `compress` defaults to whether `path` ends
+    in `.gz`.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"unknown report format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if compress is None:
+        compress = path.endswith(".gz")
+    if path == "-":
+        stream = gzip.open(sys.stdout.buffer, "wt", encoding="utf-8") if compress else sys.stdout
+    elif compress:
+        stream = gzip.open(path, "wt", encoding="utf-8")
+    else:
+        stream = open(path, "w", encoding="utf-8")
+    return _WRITERS[fmt](stream, root)
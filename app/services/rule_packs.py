@@ -0,0 +1,342 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sre_parse
+
+from app.services.metrics import FINDINGS, phase
+from app.services.sast import (
+    RULESET_VERSION as BUILTIN_RULESET_VERSION,
+    _bytes_exact,
+    _compile_rules,
+    _literal_prefix,
+    _match,
+    _match_buffer,
+    _may_match,
+    _needs_decoding,
+    _plan_rules,
+    _prefilter_literals,
+    decode_source,
+    scan_buffer,
+)
+
+logger = logging.getLogger(__name__)
+
+# Directory of rule packs (*.json, and *.yaml/*.yml when PyYAML is installed)
+RULE_PACK_DIR = os.getenv(
+    "RULE_PACK_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules")
+)
+
+def _default_cache_path() -> str:
+    # Per user and private: a cache others can write could change the rules
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "invisithreat", "rule-packs.json")
+
+
+# Where the matcher layouts of the packs are kept between runs; "" disables it
+RULE_PACK_CACHE = os.getenv("RULE_PACK_CACHE", _default_cache_path())
+
+LANGUAGE_EXTENSIONS = {
+    "python": (".py",),
+    "javascript": (".js", ".mjs", ".cjs", ".jsx", ".ts", ".tsx"),
+    "shell": (".sh", ".bash"),
+    "yaml": (".yml", ".yaml"),
+}
+SEVERITIES = ("CRITICAL", "HIGH", "MEDIUM")
+_REQUIRED = ("id", "languages", "pattern", "severity", "message")
+
+# Bump when the cached layout, how `sast._plan_rules` lays it out, or what
+# the compiled rules match changes (it is part of `ruleset_version`)
+_CACHE_FORMAT = 3
+
+# A leading `(?i)` style flag group; rewritten to a scoped `(?i:...)` group
+# because a global flag is only allowed at the start of the combined matcher
+_GLOBAL_FLAGS = re.compile(r"\(\?([imsx]+)\)")
+_BACKREFS = (_sre_parse.GROUPREF, _sre_parse.GROUPREF_EXISTS)
+
+
+class RulePackError(ValueError):
+    """Raised for a rule pack that cannot be parsed or has an invalid rule."""
+
+
+class _ExtensionRules:
+    """The rules of one file extension, compiled into a single matcher."""
+
+    def __init__(self, rules, plan):
+        patterns = [r["pattern"] for r in rules]
+        severities = [r["severity"] for r in rules]
+        self.extras = [{"rule_id": r["id"], "message": r["message"]} for r in rules]
+        # Both matchers are compiled up front so a pack that only breaks once
+        # its rules are combined fails at load time, not on the first scan
+        self._compiled = {
+            as_bytes: _compile_rules(patterns, as_bytes=as_bytes, severities=severities, plan=plan)
+            for as_bytes in (True, False)
+        }
+        self._literals = _prefilter_literals(patterns)
+        self._bytes_exact = _bytes_exact(patterns)
+
+    def compiled(self, as_bytes: bool):
+        # The str matcher is only needed for files with carriage returns, and
+        # for non-ASCII files when `\b`, `\w` and the like are in use
+        return self._compiled[as_bytes]
+
+    def scan(self, buf, endpos: int):
+        if not _may_match(buf, endpos, self._literals):
+            return []
+        if _needs_decoding(buf, endpos, self._bytes_exact):
+            matcher, table = self.compiled(False)
+            return _match(decode_source(buf[:endpos]), matcher, table, self.extras)
+        matcher, table = self.compiled(True)
+        return _match_buffer(buf, endpos, matcher, table, self.extras)
+
+
+def _pack_files(directory: str):
+    patterns = ["*.json", "*.yaml", "*.yml"]
+    return sorted(p for pattern in patterns for p in glob.glob(os.path.join(directory, pattern)))
+
+
+def _parse(path: str, raw: bytes):
+    if path.endswith(".json"):
+        return json.loads(raw)
+    try:
+        import yaml
+    except ImportError:
+        logger.warning("rule_packs: PyYAML is not installed, skipping %s", path)
+        return {"rules": []}
+    return yaml.safe_load(raw)
+
+
+def _validate(path: str, data, seen_ids):
+    rules = data.get("rules") if isinstance(data, dict) else None
+    if not isinstance(rules, list):
+        raise RulePackError(f"{path}: expected an object with a 'rules' list")
+    for rule in rules:
+        missing = [k for k in _REQUIRED if not rule.get(k)]
+        if missing:
+            raise RulePackError(f"{path}: rule {rule.get('id')!r} lacks {', '.join(missing)}")
+        if rule["id"] in seen_ids:
+            raise RulePackError(f"{path}: duplicate rule id {rule['id']!r}")
+        seen_ids.add(rule["id"])
+        if isinstance(rule["languages"], str):
+            rule["languages"] = [rule["languages"]]
+        unknown = [lang for lang in rule["languages"] if lang not in LANGUAGE_EXTENSIONS]
+        if unknown:
+            raise RulePackError(f"{path}: rule {rule['id']!r} has unknown languages {unknown}")
+        rule["severity"] = str(rule["severity"]).upper()
+        if rule["severity"] not in SEVERITIES:
+            raise RulePackError(f"{path}: rule {rule['id']!r} has severity {rule['severity']!r}")
+        rule["pattern"] = _combinable_pattern(path, rule)
+    return rules
+
+
+def _has_backref(subpattern) -> bool:
+    for op, av in subpattern:
+        if op in _BACKREFS:
+            return True
+        for arg in av if isinstance(av, (tuple, list)) else (av,):
+            parts = arg if isinstance(arg, (tuple, list)) else (arg,)
+            if any(isinstance(p, _sre_parse.SubPattern) and _has_backref(p) for p in parts):
+                return True
+    return False
+
+
+def _combinable_pattern(path: str, rule) -> str:
+    """Check that `rule`'s pattern still works inside the combined matcher.
+
+    Every rule of an extension becomes one branch of a single regex (see
+    `sast._plan_rules`), so a leading global flag group is rewritten as a
+    scoped one, and named groups and backreferences, whose names and numbers
+    would clash or shift, are rejected.
+    """
+    pattern = rule["pattern"]
+    m = _GLOBAL_FLAGS.match(pattern)
+    if m:
+        pattern = f"(?{m.group(1)}:{pattern[m.end():]})"
+    try:
+        parsed = _sre_parse.parse(pattern)
+        re.compile(pattern)
+    except re.error as e:
+        raise RulePackError(f"{path}: rule {rule['id']!r} has an invalid pattern: {e}")
+    if parsed.state.flags & ~re.UNICODE:
+        raise RulePackError(f"{path}: rule {rule['id']!r} sets a global flag other than a leading (?imsx)")
+    if parsed.state.groupdict:
+        raise RulePackError(f"{path}: rule {rule['id']!r} uses named groups; use (?:...) instead")
+    if _has_backref(parsed):
+        raise RulePackError(f"{path}: rule {rule['id']!r} uses backreferences, which are not supported")
+    return pattern
+
+
+def _rules_by_extension(sources):
+    """Parse and validate the packs; returns the rule entries per extension."""
+    seen_ids = set()
+    by_ext = {}
+    for path, raw in sources:
+        for rule in _validate(path, _parse(path, raw), seen_ids):
+            entry = {k: rule[k] for k in ("id", "pattern", "severity", "message")}
+            extensions = {ext for lang in rule["languages"] for ext in LANGUAGE_EXTENSIONS[lang]}
+            for ext in sorted(extensions):
+                by_ext.setdefault(ext, []).append(entry)
+    return by_ext
+
+
+def _plan_key(patterns) -> str:
+    h = hashlib.sha256(f"{_CACHE_FORMAT}\0{BUILTIN_RULESET_VERSION}\n".encode())
+    for p in patterns:
+        h.update(p.encode("utf-8", "surrogatepass") + b"\0")
+    return h.hexdigest()
+
+
+def _valid_plan(patterns, plan) -> bool:
+    """Whether a cached `sast._plan_rules` result fits `patterns`.
+
+    The cache only saves the layout work: every rule must still appear, as
+    the named group `_plan_rules` gives it, with its own regex remainder.
+    """
+    try:
+        source, shadows = plan
+        if not isinstance(source, str) or len(shadows) != len(patterns):
+            return False
+        if any(not isinstance(j, int) or not 0 <= j < len(patterns) for js in shadows for j in js):
+            return False
+    except (TypeError, ValueError):
+        return False
+    return all(f"(?P<r{i}>{_literal_prefix(p)[1]})" in source for i, p in enumerate(patterns))
+
+
+def _trusted(path: str) -> bool:
+    """Whether `path` and its directory belong to this user and only they can write them."""
+    if not hasattr(os, "getuid"):
+        return True
+    for target in (path, os.path.dirname(os.path.abspath(path))):
+        try:
+            st = os.stat(target)
+        except OSError:
+            return False
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            logger.warning("rule_packs: ignoring cache %s, not private to this user", path)
+            return False
+    return True
+
+
+def _read_cache(path: str):
+    if not _trusted(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    plans = data.get("plans") if isinstance(data, dict) else None
+    return plans if isinstance(plans, dict) else {}
+
+
+def _write_cache(path: str, plans):
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"plans": plans}, f)
+        # Atomic, so concurrent workers never read a half-written cache
+        os.replace(tmp, path)
+    except OSError:
+        logger.warning("rule_packs: cannot write cache %s", path, exc_info=True)
+
+
+def load_rule_packs(directory: str = None, cache_path: str = None):
+    """Load every rule pack in `directory` and return `(version, rules by extension)`.
+
+    Packs are parsed and validated on every load. Only the matcher layout of
+    each extension (`sast._plan_rules`) is cached, in `cache_path`, keyed by
+    its patterns; a cached layout is used only if the file is private to the
+    current user and the layout fits the patterns just read. Every combined
+    matcher is compiled here, so a bad pack fails at load time.
+    """
+    directory = RULE_PACK_DIR if directory is None else directory
+    cache_path = RULE_PACK_CACHE if cache_path is None else cache_path
+
+    sources = []
+    h = hashlib.sha256(f"{_CACHE_FORMAT}\0{BUILTIN_RULESET_VERSION}\n".encode())
+    for path in _pack_files(directory):
+        with open(path, "rb") as f:
+            raw = f.read()
+        sources.append((path, raw))
+        h.update(os.path.basename(path).encode() + b"\0" + raw + b"\0")
+    key = h.hexdigest()
+
+    cached = _read_cache(cache_path) if cache_path else {}
+    plans = {}
+    rules = {}
+    for ext, entries in _rules_by_extension(sources).items():
+        patterns = [r["pattern"] for r in entries]
+        plan_key = _plan_key(patterns)
+        plan = cached.get(plan_key)
+        if not _valid_plan(patterns, plan):
+            plan = _plan_rules(patterns)
+        plans[plan_key] = [plan[0], [list(js) for js in plan[1]]]
+        try:
+            rules[ext] = _ExtensionRules(entries, (plan[0], plan[1]))
+        except re.error as e:
+            raise RulePackError(f"rules for {ext} cannot be combined into one matcher: {e}")
+    if cache_path and plans != cached:
+        _write_cache(cache_path, plans)
+    return key[:16], rules
+
+
+_loaded = None
+_load_lock = threading.Lock()
+
+
+def _packs():
+    global _loaded
+    if _loaded is None:
+        with _load_lock:
+            if _loaded is None:
+                _loaded = load_rule_packs()
+    return _loaded
+
+
+def ruleset_version() -> str:
+    """Hash of the built-in rules and every rule pack (see `scan_cache`)."""
+    return _packs()[0]
+
+
+def supported_extensions():
+    """Extensions the project scanner should read: Python plus every pack language."""
+    return {".py"} | set(_packs()[1])
+
+
+def is_supported(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in supported_extensions()
+
+
+def scan_source(buf, path: str, mode: str = None, endpos: int = None):
+    """Scan file contents with the rules that apply to `path`'s extension.
+
+    Python files (and, as `/scan-file` always did, files of any extension no
+    pack covers) get the built-in engine of `sast.scan_buffer`, plus any pack
+    rules for Python. Other files only run their extension's pack rules, all
+    in one pass over the buffer.
+    """
+    if endpos is None:
+        endpos = len(buf)
+    ext = os.path.splitext(path)[1].lower()
+    rules = _packs()[1].get(ext)
+    with phase("match"):
+        if ext == ".py" or rules is None:
+            findings = scan_buffer(buf, mode, endpos)
+            if rules is not None:
+                findings = sorted(findings + rules.scan(buf, endpos), key=lambda f: f["line"])
+        else:
+            findings = rules.scan(buf, endpos)
+    for f in findings:
+        FINDINGS.inc(severity=f["severity"])
+    return findings
@@ -1,11 +1,22 @@
+import ast
+import hashlib
+import os
 import re
+from bisect import bisect_right
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sre_parse
+
+from app.services.metrics import AST_FALLBACKS, PREFILTER_SKIPS
 
 DANGEROUS_PATTERNS = [
     r"eval\(",
     r"exec\(",
-    r"os\\.system\(",
-    r"subprocess\\.Popen\(",
-    r"pickle\\.loads\(",
+    r"os\.system\(",
+    r"subprocess\.Popen\(",
+    r"pickle\.loads\(",
     r"input\("
 ]
 
@@ -19,58 +30,577 @@ def _classify_severity(pattern: str) -> str:
     return "HIGH"
 
 
-def scan_code(code: str):
+_META = set(".^$*+?{}[]|()")
+_QUANTIFIERS = set("*+?{")
+# Zero-width assertions that may be shared in the prefix trie like a literal
+_ANCHORS = ("\\b", "\\B", "\\A", "^")
+
+
+def _top_level_alternation(pattern: str) -> bool:
+    """Whether `pattern` contains a `|` outside of groups and character classes."""
+    depth = 0
+    in_class = False
+    pos = 0
+    while pos < len(pattern):
+        ch = pattern[pos]
+        if ch == "\\":
+            pos += 2
+            continue
+        if in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+            # A "]" right after "[" or "[^" is a literal member
+            if pattern.startswith("^", pos + 1):
+                pos += 1
+            if pattern.startswith("]", pos + 1):
+                pos += 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            return True
+        pos += 1
+    return False
+
+
+def _literal_prefix(pattern: str):
+    """Split `pattern` into its leading literal tokens and the regex remainder.
+
+    Tokens are regex fragments: escaped plain characters and escaped
+    punctuation, plus the zero-width anchors in `_ANCHORS` (so that rules
+    written as `\\bword` still share a prefix). The scan stops at the first
+    other metacharacter and gives back a token that is followed by a
+    quantifier. Patterns with a top-level `|` get no prefix.
+    """
+    if _top_level_alternation(pattern):
+        return (), pattern
+    tokens = []
+    pos = 0
+    while pos < len(pattern):
+        ch = pattern[pos]
+        anchor = next((a for a in _ANCHORS if pattern.startswith(a, pos)), None)
+        if anchor is not None:
+            step, token = len(anchor), anchor
+        elif ch == "\\":
+            if pos + 1 >= len(pattern) or pattern[pos + 1].isalnum():
+                break
+            step, token = 2, re.escape(pattern[pos + 1])
+        elif ch in _META:
+            break
+        else:
+            step, token = 1, re.escape(ch)
+        if pos + step < len(pattern) and pattern[pos + step] in _QUANTIFIERS:
+            break
+        tokens.append(token)
+        pos += step
+    return tuple(tokens), pattern[pos:]
+
+
+def _literal_text(tokens):
+    """The characters a token prefix consumes, ignoring anchors."""
+    # Every other token is one character, escaped or not
+    return "".join(t[-1] for t in tokens if t not in _ANCHORS)
+
+
+def _plan_rules(patterns):
+    """Lay out the single-pass matcher for `patterns`.
+
+    The literal prefixes of all rules are merged into a trie and emitted as one
+    factored alternation, with each rule's regex remainder wrapped in a named
+    group `r<index>`. The regex engine therefore branches on shared prefixes
+    instead of trying every rule at every offset, and the cost per character
+    stays flat as rules are added.
+
+    Returns `(source, shadows)`: the alternation and, per rule, the indexes of
+    the rules that can also match at the same offset (those whose prefix is a
+    prefix of its own, or vice versa). Both are plain data so the plan can be
+    cached (see `rule_packs`).
+    """
+    trie = {}
+    prefixes = []
+    for i, p in enumerate(patterns):
+        tokens, rest = _literal_prefix(p)
+        # Rules can only meet at one offset if the text they consume agrees
+        prefixes.append(_literal_text(tokens))
+        node = trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(None, []).append(f"(?P<r{i}>{rest})")
+
+    def emit(node):
+        alts = list(node.get(None, []))
+        alts += [token + emit(child) for token, child in sorted(
+            (k, v) for k, v in node.items() if k is not None)]
+        return alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+
+    shadows = [
+        [j for j in range(len(patterns))
+         if j != i and (prefixes[i].startswith(prefixes[j]) or prefixes[j].startswith(prefixes[i]))]
+        for i in range(len(patterns))
+    ]
+    return emit(trie) if patterns else "(?!)", shadows
+
+
+# Literals shorter than this occur in almost every file, and checking more
+# than this many costs about as much as the regex pass they would spare
+_PREFILTER_MIN_LITERAL = 3
+_PREFILTER_MAX_LITERALS = 16
+_PREFILTER_CHARS = re.compile(r"[\t -~]*")
+
+
+def _prefilter_literals(patterns):
+    """The byte strings of which any text matched by one of `patterns` contains one.
+
+    Each rule contributes the literal text of its prefix (see
+    `_literal_prefix`), cut at the first character that is not printable
+    ASCII so it reads the same whatever the file's encoding and line endings.
+    Returns None ("always scan") when a rule has no such literal, or when the
+    literals are too short or too many for the check to pay off.
+    """
+    literals = set()
+    for p in patterns:
+        text = _PREFILTER_CHARS.match(_literal_text(_literal_prefix(p)[0])).group()
+        if len(text) < _PREFILTER_MIN_LITERAL:
+            return None
+        literals.add(text.encode("ascii"))
+    # Any text containing a longer literal also contains the shorter one inside it
+    literals = [lit for lit in literals if not any(o != lit and o in lit for o in literals)]
+    if not literals or len(literals) > _PREFILTER_MAX_LITERALS:
+        return None
+    return tuple(sorted(literals))
+
+
+def _may_match(buf, endpos: int, literals) -> bool:
+    """Cheap byte-level check run before the regex: False means no rule can match.
+
+    `bytes.find` scans several times faster than the rule alternation, so
+    files without any of the literals are rejected without a regex pass,
+    decoding or line splitting.
+    """
+    if literals is None:
+        return True
+    if any(buf.find(lit, 0, endpos) >= 0 for lit in literals):
+        return True
+    PREFILTER_SKIPS.inc()
+    return False
+
+
+def _compile_rules(patterns, as_bytes: bool = False, severities=None, plan=None):
+    """Compile `patterns` into `(matcher, table)` for `_match`/`_match_buffer`.
+
+    `plan` is a cached result of `_plan_rules(patterns)`; `severities`
+    defaults to `_classify_severity` of each pattern. MULTILINE keeps `^`/`$`
+    anchored to lines exactly like the old per-line `re.search` loop did.
+    With `as_bytes` the regexes are compiled for UTF-8 encoded input, so raw
+    (memory-mapped) file contents can be searched without decoding them.
+    """
+    compile_ = (lambda p: re.compile(p.encode("utf-8"), re.MULTILINE)) if as_bytes else (
+        lambda p: re.compile(p, re.MULTILINE))
+    if severities is None:
+        severities = [_classify_severity(p) for p in patterns]
+    source, shadows = plan or _plan_rules(patterns)
+    matcher = compile_(source)
+
+    # group name -> (rule index, pattern, severity, shadow), resolved once.
+    # Shadowing rules are re-checked individually on a hit.
+    singles = {j: compile_(patterns[j]) for js in shadows for j in js}
+    table = {}
+    for i, p in enumerate(patterns):
+        shadow = tuple((j, patterns[j], severities[j], singles[j]) for j in shadows[i])
+        table[f"r{i}"] = (i, p, severities[i], shadow)
+    return matcher, table
+
+
+_REPEATS = tuple(getattr(_sre_parse, op) for op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+                 if hasattr(_sre_parse, op))
+
+
+def _bytes_exact_items(items) -> bool:
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            continue
+        if op is _sre_parse.AT:
+            if av in (_sre_parse.AT_BOUNDARY, _sre_parse.AT_NON_BOUNDARY):
+                return False
+        elif op is _sre_parse.IN:
+            # Positive sets of ASCII characters only; a negated set or a
+            # non-ASCII member would be matched against single UTF-8 bytes
+            if not all((o is _sre_parse.LITERAL and a < 128) or (o is _sre_parse.RANGE and a[1] < 128)
+                       for o, a in av):
+                return False
+        elif op in _REPEATS:
+            if not _bytes_exact_items(av[2]):
+                return False
+        elif op is _sre_parse.SUBPATTERN:
+            if av[1] & re.IGNORECASE or not _bytes_exact_items(av[3]):
+                return False
+        elif op is _sre_parse.BRANCH:
+            if not all(_bytes_exact_items(branch) for branch in av[1]):
+                return False
+        else:
+            return False
+    return True
+
+
+def _bytes_exact(patterns) -> bool:
+    """Whether the bytes matchers of `patterns` agree with the str ones on any UTF-8 input.
+
+    True for patterns made of literals, ASCII sets, line anchors, groups,
+    alternations and repeats. Word boundaries, `\\w`/`\\s`/`\\d`, `.`,
+    negated sets and case-insensitive groups are Unicode-aware on str but
+    work byte by byte on bytes, so they only agree on ASCII input.
+    """
+    for p in patterns:
+        try:
+            parsed = _sre_parse.parse(p)
+        except re.error:
+            return False
+        if parsed.state.flags & re.IGNORECASE or not _bytes_exact_items(parsed):
+            return False
+    return True
+
+
+_MATCHER, _RULE_TABLE = _compile_rules(DANGEROUS_PATTERNS)
+_BYTES_MATCHER, _BYTES_RULE_TABLE = _compile_rules(DANGEROUS_PATTERNS, as_bytes=True)
+_BYTES_EXACT = _bytes_exact(DANGEROUS_PATTERNS)
+_PREFILTER = _prefilter_literals(DANGEROUS_PATTERNS)
+_NEWLINE = re.compile("\n")
+_NON_ASCII = re.compile(b"[\x80-\xff]")
+_BYTES_NEWLINE = re.compile(b"\n")
+
+
+def _line_starts(code: str):
+    """Return the offset at which every line of `code` starts."""
+    return [0] + [m.end() for m in _NEWLINE.finditer(code)]
+
+
+def _match(code: str, matcher, table, extras=None):
+    """Run a compiled rule set over `code` in one pass and build findings.
+
+    `extras`, if given, holds per rule index a dict of additional keys (rule
+    id, message) to put on its findings.
+    """
     findings = []
-    lines = code.split("\n")
-
-    for i, line in enumerate(lines):
-        for pattern in DANGEROUS_PATTERNS:
-            if re.search(pattern, line):
-                findings.append({
-                    "line": i + 1,
-                    "code": line.strip(),
-                    "pattern": pattern,
-                    "severity": _classify_severity(pattern)
-                })
+    starts = None
+    seen = set()
+    search = matcher.search
+    pos = 0
 
-    return findings
+    while True:
+        m = search(code, pos)
+        if m is None:
+            break
+        offset = m.start()
+        # Resume one character later (not at m.end()) so overlapping hits
+        # of other rules are still found, as they were with per-rule searches
+        pos = offset + 1
+        idx, pattern, severity, shadow = table[m.lastgroup]
+        if starts is None:
+            # Only pay for the newline index once we know there is a hit
+            starts = _line_starts(code)
+        lineno = bisect_right(starts, offset)
+        hits = [(idx, pattern, severity)]
+        for j, other, other_severity, single in shadow:
+            if single.match(code, offset):
+                hits.append((j, other, other_severity))
+        for rule in hits:
+            if (lineno, rule[0]) in seen:
+                continue
+            seen.add((lineno, rule[0]))
+            findings.append((lineno,) + rule)
+
+    # Preserve the historical order: by line, then by rule position
+    findings.sort(key=lambda f: (f[0], f[1]))
+
+    results = []
+    for lineno, idx, pattern, severity in findings:
+        start = starts[lineno - 1]
+        end = starts[lineno] - 1 if lineno < len(starts) else len(code)
+        results.append({
+            "line": lineno,
+            "code": code[start:end].strip(),
+            "pattern": pattern,
+            "severity": severity
+        })
+        if extras:
+            results[-1].update(extras[idx])
 
+    return results
 
-def scan_code_with_ai(code: str):
+
+def _decode_line(raw: bytes) -> str:
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def _match_buffer(buf, endpos: int, matcher, table, extras=None):
+    """`_match` over a bytes-like buffer (bytes or mmap) up to `endpos`.
+
+    Nothing is decoded or copied except the lines that produce findings, and
+    line numbers are counted incrementally between hits rather than from a
+    full newline index, so memory does not grow with the file.
+    """
+    findings = []
+    seen = set()
+    search = matcher.search
+    count_newlines = _BYTES_NEWLINE.findall
+    pos = 0
+    counted = 0  # offset up to which newlines have been counted
+    lineno = 1
+    line_text = {}
+
+    while True:
+        m = search(buf, pos, endpos)
+        if m is None:
+            break
+        offset = m.start()
+        pos = offset + 1
+        idx, pattern, severity, shadow = table[m.lastgroup]
+        lineno += len(count_newlines(buf, counted, offset))
+        counted = offset
+        if lineno not in line_text:
+            start = buf.rfind(b"\n", 0, offset) + 1
+            end = buf.find(b"\n", offset, endpos)
+            line_text[lineno] = _decode_line(buf[start:endpos if end < 0 else end]).strip()
+        hits = [(idx, pattern, severity)]
+        for j, other, other_severity, single in shadow:
+            if single.match(buf, offset, endpos):
+                hits.append((j, other, other_severity))
+        for rule in hits:
+            if (lineno, rule[0]) in seen:
+                continue
+            seen.add((lineno, rule[0]))
+            findings.append((lineno,) + rule)
+
+    findings.sort(key=lambda f: (f[0], f[1]))
+    results = []
+    for lineno, idx, pattern, severity in findings:
+        results.append({"line": lineno, "code": line_text[lineno], "pattern": pattern, "severity": severity})
+        if extras:
+            results[-1].update(extras[idx])
+    return results
+
+
+# ---------------------------------------------------------------------------
+# AST analysis mode
+#
+# Rules register for the node types they care about; `_scan_ast` walks the
+# tree once and hands every node to the rules keyed by its type, so adding a
+# rule never adds a traversal. Findings reuse the regex `pattern` strings so
+# severities, recommendations and persistence stay unchanged downstream.
+# ---------------------------------------------------------------------------
+
+_AST_RULES = {}
+
+# Fully-qualified call targets -> the DANGEROUS_PATTERNS entry they report as
+_DANGEROUS_CALLS = {
+    "eval": DANGEROUS_PATTERNS[0],
+    "exec": DANGEROUS_PATTERNS[1],
+    "os.system": DANGEROUS_PATTERNS[2],
+    "subprocess.Popen": DANGEROUS_PATTERNS[3],
+    "pickle.loads": DANGEROUS_PATTERNS[4],
+    "input": DANGEROUS_PATTERNS[5],
+}
+_BUILTIN_MODULES = ("builtins", "__builtins__")
+
+
+def _ast_rule(*node_types):
+    """Register a rule callback for one or more AST node types."""
+    def register(fn):
+        for node_type in node_types:
+            _AST_RULES.setdefault(node_type, []).append(fn)
+        return fn
+    return register
+
+
+class _AstContext:
+    """Per-file state shared by the rules during the single traversal."""
+
+    def __init__(self):
+        # local name -> fully-qualified name, filled from import statements
+        self.aliases = {}
+        self.hits = []
+
+    def qualname(self, node):
+        """Resolve a Name/Attribute chain to a dotted name through imports."""
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+        parts.append(self.aliases.get(node.id, node.id))
+        name = ".".join(reversed(parts))
+        head, _, rest = name.partition(".")
+        if head in _BUILTIN_MODULES and rest:
+            return rest
+        return name
+
+
+@_ast_rule(ast.Import)
+def _track_import(node, ctx):
+    for alias in node.names:
+        if alias.asname:
+            ctx.aliases[alias.asname] = alias.name
+        else:
+            # `import os.path` binds `os`
+            head = alias.name.split(".", 1)[0]
+            ctx.aliases[head] = head
+
+
+@_ast_rule(ast.ImportFrom)
+def _track_import_from(node, ctx):
+    if node.level or not node.module:
+        return
+    for alias in node.names:
+        if alias.name == "*":
+            continue
+        ctx.aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+
+
+@_ast_rule(ast.Call)
+def _dangerous_call(node, ctx):
+    pattern = _DANGEROUS_CALLS.get(ctx.qualname(node.func))
+    if pattern is not None:
+        ctx.hits.append((node.lineno, pattern))
+
+
+def _scan_ast(code: str):
+    """Return findings from one parse and one traversal of `code`.
+
+    Raises SyntaxError (or ValueError/RecursionError) when the file cannot be
+    parsed so the caller can fall back to the regex engine.
+    """
+    tree = ast.parse(code)
+    ctx = _AstContext()
+    # Depth-first in source order so imports are seen before later uses
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        for rule in _AST_RULES.get(type(node), ()):
+            rule(node, ctx)
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
+    order = {p: i for i, p in enumerate(DANGEROUS_PATTERNS)}
+    hits = sorted(set(ctx.hits), key=lambda h: (h[0], order.get(h[1], len(order))))
+    if not hits:
+        return []
+    starts = _line_starts(code)
+    results = []
+    for lineno, pattern in hits:
+        start = starts[lineno - 1] if lineno <= len(starts) else len(code)
+        end = starts[lineno] - 1 if lineno < len(starts) else len(code)
+        results.append({
+            "line": lineno,
+            "code": code[start:end].strip(),
+            "pattern": pattern,
+            "severity": _RULE_TABLE[f"r{order[pattern]}"][2]
+        })
+    return results
+
+
+def _ruleset_version():
+    """Hash everything that decides what a scan reports.
+
+    Stored alongside cached results so they are discarded as soon as a rule is
+    added, removed or re-classified.
+    """
+    h = hashlib.sha256()
+    for pattern in DANGEROUS_PATTERNS:
+        h.update(f"{pattern}\0{_classify_severity(pattern)}\n".encode())
+    for name, pattern in sorted(_DANGEROUS_CALLS.items()):
+        h.update(f"call\0{name}\0{pattern}\n".encode())
+    for node_type, rules in sorted(_AST_RULES.items(), key=lambda kv: kv[0].__name__):
+        for rule in rules:
+            h.update(f"ast\0{node_type.__name__}\0{rule.__name__}\n".encode())
+    return h.hexdigest()[:16]
+
+
+RULESET_VERSION = _ruleset_version()
+
+
+def scan_code(code: str, mode: str = None):
+    """Scan source text and return findings.
+
+    `mode` selects the engine: "regex" (default) matches raw text, "ast"
+    analyses Python syntax and ignores strings, comments and docstrings. The
+    default can be changed with the SAST_MODE environment variable. Code that
+    does not parse as Python is always scanned with the regex engine.
+    """
+    mode = (mode or os.getenv("SAST_MODE", "regex")).lower()
+    if mode == "ast":
+        try:
+            return _scan_ast(code)
+        except (SyntaxError, ValueError, RecursionError):
+            AST_FALLBACKS.inc()
+    return _match(code, _MATCHER, _RULE_TABLE)
+
+
+def decode_source(raw) -> str:
+    """Decode like a text-mode `open`: UTF-8, then latin-1, universal newlines."""
+    raw = bytes(raw)
+    try:
+        code = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        code = raw.decode("latin-1")
+    return code.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _needs_decoding(buf, endpos: int, bytes_exact: bool) -> bool:
+    """Whether `buf` must be decoded rather than searched with a bytes matcher."""
+    if buf.find(b"\r", 0, endpos) >= 0:
+        return True
+    return not bytes_exact and _NON_ASCII.search(buf, 0, endpos) is not None
+
+
+def scan_buffer(buf, mode: str = None, endpos: int = None):
+    """Scan raw file contents (bytes or an mmap) and return findings.
+
+    Equivalent to `scan_code(decode_source(buf[:endpos]), mode)`. The regex
+    engine searches the bytes in place and decodes only the lines it reports;
+    the AST engine, files with carriage returns (whose newline translation
+    changes offsets) and non-ASCII files the bytes matcher would read
+    differently (see `_bytes_exact`) go through the decoded text. In regex mode
+    files without any rule literal are rejected first (see `_may_match`);
+    the AST engine resolves aliases, so it always gets the whole file.
+    """
+    if endpos is None:
+        endpos = len(buf)
+    mode = (mode or os.getenv("SAST_MODE", "regex")).lower()
+    if mode != "ast" and not _may_match(buf, endpos, _PREFILTER):
+        return []
+    if mode == "ast" or _needs_decoding(buf, endpos, _BYTES_EXACT):
+        return scan_code(decode_source(buf[:endpos]), mode)
+    return _match_buffer(buf, endpos, _BYTES_MATCHER, _BYTES_RULE_TABLE)
+
+
+def scan_code_with_ai(code: str, mode: str = None):
     """Run rule-based scan then enrich findings with AI suggestions when available."""
-    findings = scan_code(code)
+    return add_ai_recommendations(scan_code(code, mode))
+
 
-    # Import here so we don't require OpenAI at module import time
+def add_ai_recommendations(findings):
+    """Set `ai_recommendation` on `findings` when an AI provider is configured."""
+    # Import here so we don't require the AI stack at module import time
     try:
-        from app.services.ai_helper import generate_ai_recommendation, is_ai_available
+        from app.services.ai_helper import INLINE_TIMEOUT, generate_ai_recommendations, is_ai_available
     except Exception:
-        generate_ai_recommendation = None
+        generate_ai_recommendations = None
         is_ai_available = lambda: False
 
-    if is_ai_available() and generate_ai_recommendation:
-        # Execute AI recommendations concurrently with a timeout per call to avoid blocking
+    if is_ai_available() and generate_ai_recommendations and findings:
+        # Findings are packed into a few multi-finding prompts (see ai_helper);
+        # the caller is waiting, so the whole call has a deadline
         try:
-            from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
-            snippets = [f.get("code", "") for f in findings]
-            with ThreadPoolExecutor(max_workers=min(4, max(1, len(snippets)))) as ex:
-                futures = {ex.submit(generate_ai_recommendation, s): idx for idx, s in enumerate(snippets)}
-                for fut in as_completed(futures):
-                    idx = futures[fut]
-                    try:
-                        res = fut.result(timeout=8)
-                        findings[idx]["ai_recommendation"] = res if res else None
-                    except FuturesTimeout:
-                        findings[idx]["ai_recommendation"] = None
-                    except Exception:
-                        findings[idx]["ai_recommendation"] = None
+            recs = generate_ai_recommendations(findings, timeout=INLINE_TIMEOUT)
         except Exception:
-            # Fallback: attempt serial calls with a short timeout
-            for f in findings:
-                try:
-                    snippet = f.get("code", "")
-                    f["ai_recommendation"] = generate_ai_recommendation(snippet)
-                except Exception:
-                    f["ai_recommendation"] = None
+            recs = [None] * len(findings)
+        for f, res in zip(findings, recs):
+            f["ai_recommendation"] = res if res else None
     else:
         # Do not attach AI fields when AI is not configured — keep response concise
         pass
@@ -0,0 +1,84 @@
+import json
+import os
+import sqlite3
+
+from app.services.rule_packs import ruleset_version
+
+
+class ScanCache:
+    """Per-file findings cache kept in a local SQLite file.
+
+    Entries are keyed by path and scan mode and remember the file's size,
+    mtime and content hash. A matching size/mtime is trusted directly; when
+    only the mtime moved (fresh checkout, `touch`) the caller can still reuse
+    the entry by comparing content hashes. The whole cache is dropped when
+    `rule_packs.ruleset_version()` changes so stale findings never survive a
+    rule update.
+    """
+
+    def __init__(self, path: str, mode: str = None):
+        # Resolved like `sast.scan_code` does, so entries match the findings' mode
+        self.mode = (mode or os.getenv("SAST_MODE", "regex")).lower()
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT, mode TEXT, size INTEGER, mtime_ns INTEGER,"
+            " sha256 TEXT, findings TEXT, PRIMARY KEY (path, mode))"
+        )
+        version = ruleset_version()
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'ruleset'").fetchone()
+        if row is None or row[0] != version:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('ruleset', ?)",
+                (version,),
+            )
+            self._conn.commit()
+        # One query up front instead of one per file
+        self._entries = {
+            path: (size, mtime_ns, sha256, findings)
+            for path, size, mtime_ns, sha256, findings in self._conn.execute(
+                "SELECT path, size, mtime_ns, sha256, findings FROM files WHERE mode = ?",
+                (self.mode,),
+            )
+        }
+        self._pending = []
+
+    def lookup(self, path: str, size: int, mtime_ns: int):
+        """Return `(findings, sha256)` for `path`.
+
+        `findings` is the cached list when size and mtime still match, else
+        None; `sha256` is the last known content hash (or None) so the caller
+        can fall back to a content comparison.
+        """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None, None
+        if entry[0] == size and entry[1] == mtime_ns:
+            return json.loads(entry[3]), entry[2]
+        return None, entry[2]
+
+    def cached_findings(self, path: str):
+        entry = self._entries.get(path)
+        return json.loads(entry[3]) if entry else []
+
+    def store(self, path: str, size: int, mtime_ns: int, sha256: str, findings):
+        data = json.dumps(findings)
+        self._entries[path] = (size, mtime_ns, sha256, data)
+        self._pending.append((path, self.mode, size, mtime_ns, sha256, data))
+
+    def close(self):
+        try:
+            if self._pending:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (path, mode, size, mtime_ns, sha256, findings)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    self._pending,
+                )
+                self._conn.commit()
+                self._pending = []
+        finally:
+            self._conn.close()
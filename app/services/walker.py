@@ -0,0 +1,289 @@
+"""Directory walking for project scans.
+
+`iter_files` walks a tree with `os.scandir` and prunes, before descending:
+
+- the directories in EXCLUDED_DIRS, which never hold project code;
+- paths matching the configured exclude patterns (SCAN_EXCLUDE, a comma
+  separated list, plus any passed by the caller);
+- untracked paths ignored by the `.gitignore` files of the tree and by
+  `.git/info/exclude`, unless SCAN_GITIGNORE=false. As in git, ignore rules
+  do not apply to files `git ls-files` reports as tracked (e.g. added with
+  `git add -f`), so committed code cannot be hidden from the scanner by an
+  ignore line.
+
+Exclude patterns use the `.gitignore` syntax, relative to the root of the
+scan, and take precedence over every `.gitignore`. Every pattern list is
+compiled once into a single regex per file (see `IgnoreRules`), so a path is
+checked with one match per applicable `.gitignore` rather than one per line.
+"""
+import os
+import re
+import subprocess
+
+# Directories that never contain project code worth scanning
+EXCLUDED_DIRS = (".git", "venv", ".venv", "__pycache__", "node_modules", "site-packages", ".tox")
+
+SCAN_EXCLUDE = [p.strip() for p in os.getenv("SCAN_EXCLUDE", "").split(",") if p.strip()]
+SCAN_GITIGNORE = os.getenv("SCAN_GITIGNORE", "true").lower() in ("1", "true", "yes")
+
+
+def _glob_to_regex(glob: str) -> str:
+    """Translate one `.gitignore` glob (without `!` or a trailing `/`) to a regex."""
+    out = []
+    pos = 0
+    n = len(glob)
+    while pos < n:
+        ch = glob[pos]
+        if ch == "*":
+            if glob.startswith("**", pos):
+                at_start = pos == 0 or glob[pos - 1] == "/"
+                at_end = pos + 2 == n or glob[pos + 2] == "/"
+                if at_start and at_end:
+                    if pos + 2 == n:
+                        out.append(".*")           # "a/**": everything inside
+                    else:
+                        out.append("(?:.*/)?")     # "**/b", "a/**/b": any depth
+                        pos += 1
+                    pos += 2
+                    continue
+            out.append("[^/]*")
+            while pos < n and glob[pos] == "*":
+                pos += 1
+            continue
+        if ch == "?":
+            out.append("[^/]")
+        elif ch == "[":
+            end = pos + 1
+            if end < n and glob[end] in "!^":
+                end += 1
+            if end < n and glob[end] == "]":
+                end += 1
+            end = glob.find("]", end)
+            if end < 0:
+                out.append(re.escape(ch))
+            else:
+                body = glob[pos + 1:end].replace("\\", "\\\\")
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                pos = end
+        elif ch == "\\" and pos + 1 < n:
+            pos += 1
+            out.append(re.escape(glob[pos]))
+        else:
+            out.append(re.escape(ch))
+        pos += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """The patterns of one `.gitignore` file (or exclude list), compiled.
+
+    Paths are given relative to the directory the patterns apply to, with `/`
+    separators. As in git, the last matching pattern decides, and patterns
+    ending in `/` only match directories.
+    """
+
+    def __init__(self, lines):
+        entries = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip("\r")
+            # Trailing spaces are ignored unless escaped
+            stripped = line.rstrip(" ")
+            if stripped.endswith("\\") and len(stripped) < len(line):
+                stripped += " "
+            line = stripped
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate or line.startswith("\\!") or line.startswith("\\#"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # A slash anywhere but at the end anchors the pattern to its directory
+            anchored = "/" in line
+            regex = _glob_to_regex(line.lstrip("/"))
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            try:
+                re.compile(regex)
+            except re.error:
+                continue  # git ignores malformed patterns too, e.g. "[z-a]"
+            entries.append((regex, negate, dir_only))
+
+        # Alternatives are tried in order, so listing the patterns last to
+        # first makes the match report the pattern git would apply
+        self._negated = {}
+        self._files = self._compile([e for e in entries if not e[2]])
+        self._dirs = self._compile(entries)
+
+    def _compile(self, entries):
+        if not entries:
+            return None
+        alts = []
+        for regex, negate, _dir_only in reversed(entries):
+            name = f"p{len(self._negated)}"
+            self._negated[name] = negate
+            alts.append(f"(?P<{name}>{regex})")
+        return re.compile("(?:" + "|".join(alts) + ")", re.DOTALL)
+
+    def __bool__(self):
+        return self._dirs is not None
+
+    def match(self, rel_path: str, is_dir: bool):
+        """True if ignored, False if re-included by a `!` pattern, None if no pattern applies."""
+        regex = self._dirs if is_dir else self._files
+        if regex is None:
+            return None
+        m = regex.fullmatch(rel_path)
+        if m is None:
+            return None
+        return not self._negated[m.lastgroup]
+
+
+def read_ignore_file(path: str):
+    """Return the compiled rules of a `.gitignore`-style file, or None if unreadable or empty."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            rules = IgnoreRules(f)
+    except OSError:
+        return None
+    return rules or None
+
+
+def exclude_rules(patterns=None):
+    """Compile SCAN_EXCLUDE and `patterns` into one `IgnoreRules` (or None)."""
+    rules = IgnoreRules(list(SCAN_EXCLUDE) + list(patterns or ()))
+    return rules or None
+
+
+def is_excluded(rel_path: str, rules) -> bool:
+    """Whether `rel_path` (with `/` separators) is excluded without walking to it.
+
+    For paths that come from elsewhere than `iter_files`, such as archive
+    members and `git diff` output: true if a parent directory is in
+    EXCLUDED_DIRS, or if `rules` (from `exclude_rules`, may be None) exclude
+    the path or one of its parent directories. `.gitignore` files are not read.
+    """
+    parts = rel_path.split("/")
+    if any(p in EXCLUDED_DIRS for p in parts[:-1]):
+        return True
+    if rules is None:
+        return False
+    for i in range(1, len(parts)):
+        if rules.match("/".join(parts[:i]), True):
+            return True
+    return bool(rules.match(rel_path, False))
+
+
+def tracked_files(root: str):
+    """The files git tracks under `root`, relative with `/`, or None outside a work tree."""
+    try:
+        out = subprocess.run(
+            ["git", "-C", root, "ls-files", "-z", "--cached"], check=True, capture_output=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {os.fsdecode(path) for path in out.split(b"\0") if path}
+
+
+class _Tracked:
+    """Tracked files of a scan and every directory that holds one."""
+
+    def __init__(self, files):
+        self.files = files
+        self.dirs = set()
+        for path in files:
+            # Stop at the first parent already known: its own parents are too
+            end = path.rfind("/")
+            while end > 0 and path[:end] not in self.dirs:
+                self.dirs.add(path[:end])
+                end = path.rfind("/", 0, end)
+
+
+def _ignored(excluded, stack, rel_path: str, is_dir: bool, tracked=None, in_ignored=False) -> bool:
+    if excluded is not None:
+        decision = excluded.match(rel_path, is_dir)
+        if decision is not None:
+            return decision
+    if tracked is not None:
+        if rel_path in (tracked.dirs if is_dir else tracked.files):
+            return False
+    if in_ignored:
+        return True  # untracked, inside an ignored directory
+    # The deepest `.gitignore` that has an opinion wins
+    for base, rules in reversed(stack):
+        decision = rules.match(rel_path[len(base):], is_dir)
+        if decision is not None:
+            return decision
+    return False
+
+
+def iter_files(root: str, extensions=None, exclude=None, gitignore: bool = None):
+    """Yield the paths of the files under `root` that a project scan should read.
+
+    `extensions` (lowercase, with the dot) limits the files yielded;
+    `exclude` adds `.gitignore`-style patterns to SCAN_EXCLUDE and
+    `gitignore` overrides SCAN_GITIGNORE. Paths are yielded in the same order
+    as `os.walk` would produce them: a directory's files first, then its
+    subdirectories, both in directory order. Symlinked directories are not
+    followed and unreadable directories are skipped.
+    """
+    extensions = tuple(extensions) if extensions is not None else None
+    gitignore = SCAN_GITIGNORE if gitignore is None else gitignore
+
+    stack = []
+    tracked = None
+    if gitignore:
+        rules = read_ignore_file(os.path.join(root, ".git", "info", "exclude"))
+        if rules is not None:
+            stack.append(("", rules))
+        files = tracked_files(root)
+        if files:
+            tracked = _Tracked(files)
+    yield from _walk(root, "", exclude_rules(exclude), stack, extensions, gitignore, tracked, False)
+
+
+def _walk(top: str, rel: str, excluded, stack, extensions, gitignore, tracked, in_ignored):
+    try:
+        with os.scandir(top) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    if gitignore and any(e.name == ".gitignore" for e in entries):
+        rules = read_ignore_file(os.path.join(top, ".gitignore"))
+        if rules is not None:
+            stack = stack + [(rel, rules)]
+
+    dirs = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        rel_path = rel + entry.name
+        if is_dir:
+            if entry.name in EXCLUDED_DIRS or _ignored(excluded, stack, rel_path, True, tracked, in_ignored):
+                continue
+            # Like `os.walk`, list symlinked directories but do not enter them
+            try:
+                if entry.is_symlink():
+                    continue
+            except OSError:
+                continue
+            # Entered for its tracked files only if git would ignore it
+            ignored = in_ignored or (
+                tracked is not None and _ignored(excluded, stack, rel_path, True, None, in_ignored)
+            )
+            dirs.append((entry, ignored))
+        elif extensions is None or entry.name.lower().endswith(extensions):
+            if not _ignored(excluded, stack, rel_path, False, tracked, in_ignored):
+                yield entry.path
+
+    for entry, ignored in dirs:
+        yield from _walk(
+            entry.path, rel + entry.name + "/", excluded, stack, extensions, gitignore, tracked, ignored,
+        )
@@ -0,0 +1,69 @@
+"""Compare the per-line regex loop with the single-pass matcher as rules grow.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_rules
+"""
+import random
+import re
+import time
+
+from app.services.sast import DANGEROUS_PATTERNS, _classify_severity, _compile_rules, _match
+
+
+def _legacy_scan(code, patterns):
+    """The original rules x lines loop, kept here as the reference point."""
+    findings = []
+    for i, line in enumerate(code.split("\n")):
+        for pattern in patterns:
+            if re.search(pattern, line):
+                findings.append({
+                    "line": i + 1,
+                    "code": line.strip(),
+                    "pattern": pattern,
+                    "severity": _classify_severity(pattern)
+                })
+    return findings
+
+
+def _corpus(lines=20000, seed=0):
+    rnd = random.Random(seed)
+    filler = [
+        "x = compute(a, b)",
+        "for item in items:",
+        "    total += item.value",
+        "def handler(request):",
+        "    return response",
+        "# regular comment",
+    ]
+    hits = ["y = eval(data)", "exec(code)", "value = input()"]
+    out = []
+    for _ in range(lines):
+        out.append(rnd.choice(hits) if rnd.random() < 0.01 else rnd.choice(filler))
+    return "\n".join(out)
+
+
+def _time(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    code = _corpus()
+    print(f"corpus: {len(code) / 1e6:.2f} MB, {code.count(chr(10)) + 1} lines")
+    print(f"{'rules':>6} {'legacy (s)':>12} {'compiled (s)':>13} {'speedup':>8}")
+    for extra in (0, 10, 50, 100, 200):
+        patterns = DANGEROUS_PATTERNS + [rf"unsafe_call_{k}\(" for k in range(extra)]
+        matcher, table = _compile_rules(patterns)
+        legacy = _time(lambda: _legacy_scan(code, patterns))
+        compiled = _time(lambda: _match(code, matcher, table))
+        print(f"{len(patterns):>6} {legacy:>12.4f} {compiled:>13.4f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
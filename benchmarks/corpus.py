@@ -0,0 +1,59 @@
+"""Deterministic synthetic source corpus for the benchmarks.
+
+The same seed, file count, file size and hit density always produce
+byte-identical files, so timings from different commits compare like for like.
+"""
+import os
+import random
+
+_FILLER = [
+    "x = compute(a, b)",
+    "for item in items:",
+    "    total += item.value",
+    "def handler(request):",
+    "    return response",
+    "# regular comment",
+    "class Model(Base):",
+    "    name = Column(String)",
+    "result = [f(v) for v in values if v]",
+    "logger.info('processed %d rows', count)",
+]
+# Lines that trigger the built-in rules
+_HITS = [
+    "y = eval(data)",
+    "exec(code)",
+    "value = input()",
+]
+
+
+def make_source(nbytes: int, density: float, rnd: random.Random) -> str:
+    """Return roughly `nbytes` of Python-looking source.
+
+    `density` is the fraction of lines that contain a finding.
+    """
+    lines = []
+    size = 0
+    while size < nbytes:
+        line = rnd.choice(_HITS) if rnd.random() < density else rnd.choice(_FILLER)
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(root: str, files: int = 200, file_bytes: int = 16 * 1024,
+                    density: float = 0.01, seed: int = 0):
+    """Write `files` source files under `root` and return the total bytes written.
+
+    Files are spread over nested package directories, ten per directory, like
+    a real project tree.
+    """
+    rnd = random.Random(seed)
+    total = 0
+    for i in range(files):
+        directory = os.path.join(root, f"pkg{i // 100}", f"mod{(i // 10) % 10}")
+        os.makedirs(directory, exist_ok=True)
+        data = make_source(file_bytes, density, rnd).encode("utf-8")
+        with open(os.path.join(directory, f"file{i}.py"), "wb") as f:
+            f.write(data)
+        total += len(data)
+    return total
@@ -0,0 +1,436 @@
+"""Load test of the scan and enrichment endpoints against a mock LLM provider.
+
+Run from the repository root:
+
+    python -m benchmarks.loadtest --duration 60 --concurrency 16 --rate-429 0.05
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --project-path /srv/project
+
+Without `--url` the test starts its own stack: a `benchmarks.mock_llm`
+server with the given behavior options, and `uvicorn app.main:app` on a
+fresh SQLite database with OpenRouter pointed at the mock. `--app-env`
+passes settings such as LLM_RATE_LIMIT_RPM or ENRICH_WORKERS to that
+server; the rest of its environment is inherited.
+
+For `--duration` seconds, `--concurrency` clients send requests picked by
+`--mix` weights:
+
+- `scan-file`: `POST /scan-file?include_ai=true` with a generated upload;
+- `scan-project`: `POST /scan-project` on a generated project (or on
+  `--project-path`, which must exist on the server).
+
+Finding lines are made structurally unique (`--unique-snippets`), so
+`rec_cache` does not answer them all after the first request. Once the
+load stops, the background enrichment of every `scan-file` scan is
+followed on `/scans/{scan_id}/enrichment` for up to `--drain` seconds.
+
+The report gives, per endpoint, throughput and latency percentiles, then
+the share of findings that got a recommendation inline and in the
+background, and the LLM counters from `/metrics` and the mock. It is
+printed and, with `--out`, written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks import mock_llm
+from benchmarks.corpus import make_source
+
+OPERATIONS = ("scan-file", "scan-project")
+
+# Finding lines whose shape differs for every `n`: attribute names are kept
+# by `rec_cache.normalize_snippet`, so each one is a distinct cache key
+_UNIQUE_HITS = {
+    "eval(": "y = eval(req.field_{n})",
+    "exec(": "exec(job.step_{n})",
+    "input(": "value = input(prompt.question_{n})",
+}
+
+
+class _Snippets:
+    """Sources for uploads and the generated project, with unique finding lines."""
+
+    def __init__(self, unique: float, seed: int):
+        self.unique = unique
+        self._rnd = random.Random(seed)
+        self._n = 0
+
+    def make(self, nbytes: int, density: float) -> str:
+        lines = make_source(nbytes, density, self._rnd).splitlines()
+        for i, line in enumerate(lines):
+            for call, template in _UNIQUE_HITS.items():
+                if call in line and self._rnd.random() < self.unique:
+                    self._n += 1
+                    lines[i] = template.format(n=self._n)
+                    break
+        return "\n".join(lines) + "\n"
+
+
+def _parse_mix(value):
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; expected {', '.join(OPERATIONS)}")
+        try:
+            weights[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad weight in {part!r}")
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return weights
+
+
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+# -- stack ---------------------------------------------------------------------
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Stack:
+    """The mock provider and an app server started for the test."""
+
+    def __init__(self, args, work_dir):
+        self.mock = mock_llm.MockLLMServer(mock_llm.MockBehavior(args)).start()
+        port = _free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ)
+        env.pop("FAKE_AI", None)
+        env.update({
+            "DATABASE_URL": "sqlite:///" + os.path.join(work_dir, "loadtest.db"),
+            "OPENROUTER_API_KEY": "mock",
+            "OPENROUTER_BASE_URL": self.mock.url,
+            "OPENROUTER_MODEL": "mock/primary",
+            "OPENROUTER_FALLBACK_MODELS": "mock/fallback",
+        })
+        env.update(args.app_env)
+        self.log_path = os.path.join(work_dir, "server.log")
+        self._log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(args.app_workers)],
+            env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"the app server exited with {self.process.returncode}; see {self.log_path}")
+            try:
+                if httpx.get(self.url + "/openapi.json", timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"the app server did not start within {timeout:.0f}s; see {self.log_path}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            # Shutdown lets queued enrichments finish; do not wait on slow replies forever
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+        self.mock.stop()
+
+
+# -- load ----------------------------------------------------------------------
+
+
+class _Recorder:
+    """Per-operation samples and what the responses said about recommendations."""
+
+    def __init__(self):
+        self.latencies = {op: [] for op in OPERATIONS}
+        self.statuses = {op: Counter() for op in OPERATIONS}
+        self.findings = Counter()      # op -> findings returned
+        self.inline_recs = Counter()   # op -> findings returned with a recommendation
+        self.scan_ids = []
+
+    def record(self, op, status, elapsed, body=None):
+        self.latencies[op].append(elapsed)
+        self.statuses[op][status] += 1
+        if body is None:
+            return
+        findings = body.get("findings") or []
+        self.findings[op] += len(findings)
+        self.inline_recs[op] += sum(1 for f in findings if f.get("ai_recommendation"))
+        if body.get("scan_id") is not None:
+            self.scan_ids.append(body["scan_id"])
+
+
+async def _client_loop(client, args, snippets, stop_at, rnd, recorder):
+    ops = list(args.mix)
+    weights = [args.mix[op] for op in ops]
+    while time.monotonic() < stop_at:
+        op = rnd.choices(ops, weights)[0]
+        if op == "scan-file":
+            payload = snippets.make(args.file_kb * 1024, args.density).encode("utf-8")
+            request = client.build_request(
+                "POST", "/scan-file", params={"include_ai": "true"},
+                files={"file": ("loadtest.py", payload, "text/x-python")},
+            )
+        else:
+            request = client.build_request(
+                "POST", "/scan-project", params={"path": args.project_path, "workers": args.project_workers},
+            )
+        start = time.perf_counter()
+        try:
+            resp = await client.send(request)
+        except httpx.HTTPError as e:
+            recorder.record(op, type(e).__name__, time.perf_counter() - start)
+            continue
+        elapsed = time.perf_counter() - start
+        body = None
+        if resp.status_code == 200:
+            try:
+                body = resp.json()
+            except ValueError:
+                pass
+        recorder.record(op, str(resp.status_code), elapsed, body)
+
+
+async def _drain_enrichment(client, scan_ids, drain):
+    """Follow each scan's enrichment until it is done or `drain` seconds pass."""
+    progress = {}
+    pending = set(scan_ids)
+    deadline = time.monotonic() + drain
+    limit = asyncio.Semaphore(16)
+
+    async def poll(scan_id):
+        async with limit:
+            try:
+                resp = await client.get(f"/scans/{scan_id}/enrichment")
+            except httpx.HTTPError:
+                return
+        if resp.status_code == 200:
+            progress[scan_id] = resp.json()
+            if progress[scan_id]["state"] == "done":
+                pending.discard(scan_id)
+        elif resp.status_code == 404:
+            # Another worker process owns it, or it was evicted
+            pending.discard(scan_id)
+
+    while True:
+        await asyncio.gather(*(poll(scan_id) for scan_id in list(pending)))
+        if not pending or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(1.0)
+
+    totals = Counter()
+    for p in progress.values():
+        dropped = sum(p["dropped"].values())
+        totals["findings"] += p["done"] + p["failed"] + dropped + p["queued"] + p["in_flight"]
+        totals["done"] += p["done"]
+        totals["failed"] += p["failed"]
+        totals["dropped"] += dropped
+        totals["unfinished"] += p["queued"] + p["in_flight"]
+    totals["scans"] = len(scan_ids)
+    totals["scans_tracked"] = len(progress)
+    totals["scans_finished"] = sum(1 for p in progress.values() if p["state"] == "done")
+    return dict(totals)
+
+
+async def _llm_counters(client):
+    """The `invisithreat_llm_*` samples of the app's `/metrics`, if enabled."""
+    try:
+        resp = await client.get("/metrics")
+    except httpx.HTTPError:
+        return {}
+    if resp.status_code != 200:
+        return {}
+    out = {}
+    for line in resp.text.splitlines():
+        if line.startswith("invisithreat_llm_"):
+            name, _, value = line.rpartition(" ")
+            out[name] = float(value)
+    return out
+
+
+async def _run_load(args, url):
+    snippets = _Snippets(args.unique_snippets, args.seed)
+    recorder = _Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(*(
+            _client_loop(client, args, snippets, stop_at, random.Random(args.seed + i), recorder)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.monotonic() - started
+        enrichment = await _drain_enrichment(client, recorder.scan_ids, args.drain)
+        llm = await _llm_counters(client)
+    return recorder, elapsed, enrichment, llm
+
+
+# -- report --------------------------------------------------------------------
+
+
+def _summary(recorder, elapsed):
+    endpoints = {}
+    for op in OPERATIONS:
+        latencies = sorted(recorder.latencies[op])
+        if not latencies:
+            continue
+        ok = recorder.statuses[op]["200"]
+        endpoints[op] = {
+            "requests": len(latencies),
+            "ok": ok,
+            "statuses": dict(recorder.statuses[op]),
+            "throughput_rps": round(ok / elapsed, 3),
+            "latency_s": {
+                "mean": round(sum(latencies) / len(latencies), 4),
+                **{f"p{q}": round(_percentile(latencies, q), 4) for q in (50, 90, 99)},
+                "max": round(latencies[-1], 4),
+            },
+            "findings": recorder.findings[op],
+            "inline_recommendation_rate": (
+                round(recorder.inline_recs[op] / recorder.findings[op], 4) if recorder.findings[op] else None
+            ),
+        }
+    return endpoints
+
+
+def _print_report(report):
+    print(f"{'endpoint':<14} {'req':>7} {'ok':>7} {'req/s':>8} {'p50 s':>8} {'p90 s':>8} "
+          f"{'p99 s':>8} {'max s':>8} {'inline AI':>10}")
+    for op, data in report["endpoints"].items():
+        lat = data["latency_s"]
+        rate = data["inline_recommendation_rate"]
+        print(f"{op:<14} {data['requests']:>7} {data['ok']:>7} {data['throughput_rps']:>8.2f} "
+              f"{lat['p50']:>8.3f} {lat['p90']:>8.3f} {lat['p99']:>8.3f} {lat['max']:>8.3f} "
+              f"{'-' if rate is None else f'{rate:.1%}':>10}")
+        errors = {k: v for k, v in data["statuses"].items() if k != "200"}
+        if errors:
+            print(f"{'':<14} errors: {errors}")
+
+    e = report["enrichment"]
+    if e.get("findings"):
+        print(f"background enrichment: {e['done']}/{e['findings']} findings done ({e['done'] / e['findings']:.1%}), "
+              f"{e['failed']} failed, {e['dropped']} dropped, {e['unfinished']} unfinished; "
+              f"{e['scans_finished']}/{e['scans']} scans finished")
+    if report["llm_metrics"]:
+        print("app LLM counters:", ", ".join(f"{k}={v:g}" for k, v in sorted(report["llm_metrics"].items())))
+    if report.get("mock"):
+        print("mock provider:", json.dumps(report["mock"]))
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="invisithreat-load-")
+    stack = None
+    try:
+        if args.project_path is None and args.url is None:
+            args.project_path = os.path.join(work_dir, "project")
+            snippets = _Snippets(args.unique_snippets, args.seed + 1)
+            for i in range(args.project_files):
+                directory = os.path.join(args.project_path, f"pkg{i // 10}")
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, f"mod{i}.py"), "w", encoding="utf-8") as f:
+                    f.write(snippets.make(args.file_kb * 1024, args.density))
+
+        url = args.url
+        if url is None:
+            stack = _Stack(args, work_dir)
+            stack.wait_ready()
+            url = stack.url
+        recorder, elapsed, enrichment, llm = asyncio.run(_run_load(args, url))
+        mock_stats = stack.mock.behavior.snapshot() if stack else None
+    finally:
+        if stack is not None:
+            stack.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "spawned",
+        "load": {
+            "duration_s": round(elapsed, 3),
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "file_kb": args.file_kb,
+            "density": args.density,
+            "unique_snippets": args.unique_snippets,
+        },
+        "endpoints": _summary(recorder, elapsed),
+        "enrichment": enrichment,
+        "llm_metrics": llm,
+        "mock": mock_stats,
+    }
+    _print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"report written to {args.out}")
+
+
+def _env_pair(value):
+    key, sep, val = value.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {value!r}")
+    return key, val
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the scan endpoints against a mock LLM provider.")
+    parser.add_argument("--url", help="app to test; default: start the app and a mock provider locally")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load (default: 30)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients (default: 8)")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("scan-file=4,scan-project=1"),
+                        help="operation weights (default: scan-file=4,scan-project=1)")
+    parser.add_argument("--file-kb", type=int, default=8, help="size of each upload and project file (default: 8)")
+    parser.add_argument("--density", type=float, default=0.02, help="fraction of lines with a finding (default: 0.02)")
+    parser.add_argument("--unique-snippets", type=float, default=1.0,
+                        help="fraction of finding lines that are new to the recommendation cache (default: 1)")
+    parser.add_argument("--project-path", help="folder for scan-project, as seen by the server "
+                        "(default: a generated project; required with --url)")
+    parser.add_argument("--project-files", type=int, default=20, help="files in the generated project (default: 20)")
+    parser.add_argument("--project-workers", type=int, default=1, help="`workers` of scan-project (default: 1)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout in seconds (default: 300)")
+    parser.add_argument("--drain", type=float, default=60.0,
+                        help="seconds to follow background enrichment after the load (default: 60)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated sources and mix (default: 0)")
+    parser.add_argument("--out", help="also write the report as JSON to this file")
+    spawn = parser.add_argument_group("started app (without --url)")
+    spawn.add_argument("--app-workers", type=int, default=1, help="uvicorn worker processes (default: 1)")
+    spawn.add_argument("--app-env", type=_env_pair, action="append", default=[], metavar="KEY=VALUE",
+                       help="environment for the app, e.g. LLM_RATE_LIMIT_RPM=600; repeatable")
+    mock_llm.add_arguments(parser)
+    args = parser.parse_args()
+    if args.url and args.project_path is None and args.mix.get("scan-project"):
+        parser.error("--project-path is required to run scan-project against --url")
+    try:
+        mock_llm.MockBehavior(args)
+    except ValueError as e:
+        parser.error(str(e))
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
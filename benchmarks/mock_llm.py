@@ -0,0 +1,301 @@
+"""Local stand-in for the OpenRouter / OpenAI chat-completions API.
+
+Point the app at it instead of a real provider to exercise `llm_client`
+(retries, 429 back-off, timeouts, circuit breakers) without spending quota:
+
+    python -m benchmarks.mock_llm --port 8089 --latency lognormal:0.8:0.6 --rate-429 0.05
+    OPENROUTER_API_KEY=mock OPENROUTER_BASE_URL=http://127.0.0.1:8089/v1 uvicorn app.main:app
+
+`POST /v1/chat/completions` answers like the real API. Batched prompts from
+`ai_helper.generate_ai_recommendations` get a JSON array with one
+recommendation per finding id, so the batch path is exercised too. Every
+request draws its fate at random (seeded), in this order:
+
+- `--rpm`: a provider-side quota; requests over it get 429 with the
+  Retry-After of the next free slot;
+- `--rate-429`: extra random 429s, with `--retry-after` seconds (as seconds
+  or, with `--retry-after-date`, an HTTP date; omitted when negative);
+- `--error-rate`: HTTP 500;
+- `--slow-rate`: the reply is held for `--slow-seconds`, past the client's
+  LLM_TIMEOUT if that is set lower;
+- `--malformed-rate`: HTTP 200 with a body that is not JSON, has no
+  `choices`, or answers a batch with prose instead of an array.
+
+Everything else is answered after a delay drawn from `--latency`.
+`GET /stats` returns the counts of each outcome and the latencies served.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_BATCH_MARKER = "\nFindings:\n"
+_MALFORMED = ("not-json", "no-choices", "prose")
+
+
+def parse_latency(spec: str):
+    """Return a function drawing one delay in seconds from a `kind:arg[:arg]` spec.
+
+    Kinds: `fixed:S`, `uniform:LOW:HIGH`, `normal:MEAN:SD`,
+    `lognormal:MEDIAN:SIGMA` and `exp:MEAN`. Negative draws count as 0.
+    """
+    kind, _, rest = spec.partition(":")
+    try:
+        params = [float(p) for p in rest.split(":")] if rest else []
+    except ValueError:
+        raise ValueError(f"bad latency spec {spec!r}")
+    shapes = {
+        "fixed": (1, lambda rnd, s: s),
+        "uniform": (2, lambda rnd, low, high: rnd.uniform(low, high)),
+        "normal": (2, lambda rnd, mean, sd: rnd.gauss(mean, sd)),
+        "lognormal": (2, lambda rnd, median, sigma: rnd.lognormvariate(math.log(median), sigma)),
+        "exp": (1, lambda rnd, mean: rnd.expovariate(1 / mean)),
+    }
+    if kind not in shapes or len(params) != shapes[kind][0]:
+        raise ValueError(f"bad latency spec {spec!r}; expected one of fixed:S, uniform:LOW:HIGH, "
+                         "normal:MEAN:SD, lognormal:MEDIAN:SIGMA, exp:MEAN")
+    draw = shapes[kind][1]
+    return lambda rnd: max(0.0, draw(rnd, *params))
+
+
+def add_arguments(parser):
+    """Add the mock's behavior options to `parser` (shared with `benchmarks.loadtest`)."""
+    group = parser.add_argument_group("mock LLM behavior")
+    group.add_argument("--latency", default="lognormal:0.5:0.5",
+                       help="reply delay distribution (default: lognormal:0.5:0.5)")
+    group.add_argument("--rpm", type=float, default=0, help="provider quota in requests per minute; 0 for none")
+    group.add_argument("--burst", type=float, default=0,
+                       help="requests allowed at once under --rpm (default: one second of quota, at least 1)")
+    group.add_argument("--rate-429", type=float, default=0.0, help="fraction of random 429 replies")
+    group.add_argument("--retry-after", type=float, default=1.0,
+                       help="Retry-After seconds on random 429s; negative omits the header (default: 1)")
+    group.add_argument("--retry-after-date", action="store_true", help="send Retry-After as an HTTP date")
+    group.add_argument("--error-rate", type=float, default=0.0, help="fraction of HTTP 500 replies")
+    group.add_argument("--slow-rate", type=float, default=0.0, help="fraction of replies held for --slow-seconds")
+    group.add_argument("--slow-seconds", type=float, default=90.0, help="delay of slow replies (default: 90)")
+    group.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of malformed 200 replies")
+    group.add_argument("--mock-seed", type=int, default=0, help="seed of the mock's random draws (default: 0)")
+
+
+class MockBehavior:
+    """What the mock does with each request; built from the `add_arguments` options."""
+
+    def __init__(self, args):
+        self.latency = parse_latency(args.latency)
+        self.rate_429 = args.rate_429
+        self.retry_after = args.retry_after
+        self.retry_after_date = args.retry_after_date
+        self.error_rate = args.error_rate
+        self.slow_rate = args.slow_rate
+        self.slow_seconds = args.slow_seconds
+        self.malformed_rate = args.malformed_rate
+        rates = (self.rate_429, self.error_rate, self.slow_rate, self.malformed_rate)
+        if min(rates) < 0 or sum(rates) > 1:
+            raise ValueError("failure rates must be fractions that add up to at most 1")
+        self._bounds = [sum(rates[:i + 1]) for i in range(len(rates))]
+        self.rate = args.rpm / 60.0
+        self.capacity = args.burst or max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._rnd = random.Random(args.mock_seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "quota_429": 0, "random_429": 0, "error_500": 0,
+                      "slow": 0, "malformed": 0}
+        self.latencies = []
+
+    def _take_quota(self) -> float:
+        """0 if the request fits the quota, else seconds until it would."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def decide(self):
+        """Return `(outcome, value)` for the next request and count it."""
+        with self._lock:
+            self.stats["requests"] += 1
+            wait = self._take_quota()
+            # One draw against cumulative thresholds, so each rate is the
+            # fraction of all requests that get that outcome
+            roll = self._rnd.random()
+            if wait:
+                outcome, value = "quota_429", math.ceil(wait)
+            elif roll < self._bounds[0]:
+                outcome, value = "random_429", self.retry_after
+            elif roll < self._bounds[1]:
+                outcome, value = "error_500", None
+            elif roll < self._bounds[2]:
+                outcome, value = "slow", self.slow_seconds
+            elif roll < self._bounds[3]:
+                outcome, value = "malformed", self._rnd.choice(_MALFORMED)
+            else:
+                outcome, value = "ok", self.latency(self._rnd)
+                self.latencies.append(value)
+            self.stats[outcome] += 1
+            return outcome, value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lat = sorted(self.latencies)
+        data = dict(self.stats)
+        if lat:
+            data["latency_s"] = {
+                "mean": round(sum(lat) / len(lat), 4),
+                "p50": round(lat[len(lat) // 2], 4),
+                "max": round(lat[-1], 4),
+            }
+        return data
+
+
+def _reply_text(prompt: str, malformed: bool = False) -> str:
+    """The assistant message for `prompt`: a JSON array for batch prompts."""
+    head, marker, payload = prompt.partition(_BATCH_MARKER)
+    if not marker:
+        return "Mock recommendation: validate the input and avoid executing dynamic code."
+    if malformed:
+        return "Sure! Here are my recommendations for each of the findings above."
+    try:
+        items = json.loads(payload)
+    except ValueError:
+        items = []
+    return json.dumps([
+        {"id": item.get("id"), "recommendation": f"Mock recommendation for `{item.get('pattern')}`."}
+        for item in items if isinstance(item, dict)
+    ])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real provider
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status: int, body, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, self.server.behavior.snapshot())
+        elif self.path.rstrip("/") in ("/v1/models", "/models"):
+            self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        try:
+            request = json.loads(body)
+            prompt = request["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._send(400, {"error": {"message": "invalid request body"}})
+            return
+
+        behavior = self.server.behavior
+        outcome, value = behavior.decide()
+        number = behavior.stats["requests"]
+        if outcome in ("quota_429", "random_429"):
+            headers = {}
+            if value is not None and value >= 0:
+                headers["Retry-After"] = (
+                    formatdate(time.time() + value, usegmt=True) if behavior.retry_after_date else f"{value:g}"
+                )
+            self._send(429, {"error": {"message": "Rate limit exceeded", "code": 429}}, headers)
+            return
+        if outcome == "error_500":
+            self._send(500, {"error": {"message": "Internal server error", "code": 500}})
+            return
+        if outcome == "malformed" and value == "not-json":
+            self._send(200, b'{"choices": [{"message": {"content": "trunc')
+            return
+        if outcome == "malformed" and value == "no-choices":
+            self._send(200, {"id": "mock", "object": "chat.completion"})
+            return
+
+        time.sleep(value if outcome in ("ok", "slow") else 0)
+        text = _reply_text(prompt, malformed=outcome == "malformed")
+        try:
+            self._send(200, {
+                "id": f"mock-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model") or "mock",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4},
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out on a slow reply
+
+
+class MockLLMServer:
+    """The mock served from a background thread; `url` is the base URL for the app."""
+
+    def __init__(self, behavior: MockBehavior, host: str = "127.0.0.1", port: int = 0):
+        self.behavior = behavior
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.behavior = behavior
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve from a daemon thread; returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI-compatible chat-completions API.")
+    parser.add_argument("--host", default="127.0.0.1", help="bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8089, help="port (default: 8089)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        behavior = MockBehavior(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = MockLLMServer(behavior, args.host, args.port)
+    print(f"mock LLM listening on {server.url}; stats at {server.url[:-3]}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+        print(json.dumps(behavior.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Benchmark suite for the scan, persistence and enrichment pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.suite run --out baseline.json     # on the reference commit
+    python -m benchmarks.suite run --out bench_results.json
+    python -m benchmarks.suite compare bench_results.json baseline.json
+
+`run` builds a deterministic corpus (see `benchmarks.corpus`) in a temporary
+directory and measures:
+
+- `sast.scan_code` throughput in MB/s, regex and AST engines;
+- `project_scanner.scan_project` wall time for each `--workers` count;
+- `POST /scan-file` on a fresh SQLite database, with persistence;
+- the same request end to end with background enrichment in FAKE_AI mode.
+
+Each figure is the best of `--repeat` runs. Results are written as JSON
+together with the corpus parameters and the machine they ran on. `compare`
+flags every metric that got worse than the baseline by more than
+`--threshold` and exits with status 1 if there is one.
+
+A baseline is just the results of `run` on the reference commit. Timings
+only compare on the same machine, so no baseline is committed: produce one
+next to the results it is compared with (e.g. in the same CI job, from the
+target branch) and pass its path to `compare`, which warns when the two were
+measured on different machines or corpora.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.corpus import generate_corpus, make_source
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _metric(value, unit, better):
+    return {"value": round(value, 6), "unit": unit, "better": better}
+
+
+def bench_scan_code(args, results):
+    import random
+
+    from app.services.sast import scan_code
+
+    code = make_source(args.file_kb * 1024 * 16, args.density, random.Random(args.seed))
+    megabytes = len(code.encode("utf-8")) / 1e6
+    for mode in ("regex", "ast"):
+        elapsed = _best(lambda: scan_code(code, mode), args.repeat)
+        results[f"scan_code.{mode}.mb_per_s"] = _metric(megabytes / elapsed, "MB/s", "higher")
+
+
+def bench_scan_project(args, results, corpus_dir):
+    from app.services.project_scanner import scan_project
+
+    for workers in args.workers:
+        elapsed = _best(lambda: scan_project(corpus_dir, "regex", workers=workers, cache_path=""), args.repeat)
+        results[f"scan_project.workers_{workers}.seconds"] = _metric(elapsed, "s", "lower")
+
+
+def bench_scan_file(args, results, work_dir):
+    # Point the app at a throwaway database before anything imports it
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(work_dir, "bench.db")
+    os.environ.pop("FAKE_AI", None)
+    import random
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    payload = make_source(args.file_kb * 1024 * 4, args.density * 10, random.Random(args.seed)).encode("utf-8")
+    client = TestClient(app)
+
+    def post():
+        response = client.post("/scan-file", files={"file": ("bench.py", payload)})
+        response.raise_for_status()
+        return response.json()["summary"]["total"]
+
+    findings = post()
+    elapsed = _best(post, args.repeat)
+    results["scan_file.sqlite.seconds"] = _metric(elapsed, "s", "lower")
+    results["scan_file.sqlite.findings_per_s"] = _metric(findings / elapsed, "findings/s", "higher")
+
+    # Enrichment runs on its own workers after the response; waiting for them
+    # includes the batched enrichment and the bulk recommendation update
+    from app.services.enrichment import wait_idle
+
+    def post_and_enrich():
+        post()
+        wait_idle()
+
+    os.environ["FAKE_AI"] = "true"
+    try:
+        elapsed = _best(post_and_enrich, args.repeat)
+    finally:
+        os.environ.pop("FAKE_AI", None)
+    results["scan_file.fake_ai_enrichment.seconds"] = _metric(elapsed, "s", "lower")
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="invisithreat-bench-")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        corpus_bytes = generate_corpus(
+            corpus_dir, files=args.files, file_bytes=args.file_kb * 1024,
+            density=args.density, seed=args.seed,
+        )
+        results = {}
+        bench_scan_code(args, results)
+        bench_scan_project(args, results, corpus_dir)
+        bench_scan_file(args, results, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": {
+            "files": args.files,
+            "file_kb": args.file_kb,
+            "density": args.density,
+            "seed": args.seed,
+            "bytes": corpus_bytes,
+        },
+        "repeat": args.repeat,
+        "results": results,
+    }
+    out = args.out
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    for name, metric in sorted(results.items()):
+        print(f"{name:<40} {metric['value']:>14.4f} {metric['unit']}")
+    print(f"results written to {out}")
+
+
+def compare_reports(current, baseline, threshold):
+    """Return `(rows, regressions)` comparing two result reports.
+
+    A metric regresses when it moved in its worse direction by more than
+    `threshold` (a fraction, e.g. 0.1 for 10%).
+    """
+    rows = []
+    regressions = []
+    for name, metric in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None or not base["value"]:
+            rows.append((name, None, metric["value"], None, "new"))
+            continue
+        change = (metric["value"] - base["value"]) / base["value"]
+        worse = -change if metric["better"] == "higher" else change
+        status = "REGRESSION" if worse > threshold else ("improved" if worse < -threshold else "ok")
+        rows.append((name, base["value"], metric["value"], change, status))
+        if status == "REGRESSION":
+            regressions.append(name)
+    return rows, regressions
+
+
+def compare(args):
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if current.get("corpus") != baseline.get("corpus"):
+        print("warning: corpus parameters differ, results may not be comparable", file=sys.stderr)
+    if current.get("machine") != baseline.get("machine"):
+        print("warning: measured on different machines, results may not be comparable", file=sys.stderr)
+
+    rows, regressions = compare_reports(current, baseline, args.threshold)
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}  status")
+    for name, base, value, change, status in rows:
+        base_s = f"{base:>12.4f}" if base is not None else f"{'-':>12}"
+        change_s = f"{change:>+7.1%}" if change is not None else f"{'-':>8}"
+        print(f"{name:<40} {base_s} {value:>12.4f} {change_s}  {status}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def _worker_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the InvisiThreat scan pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="run the benchmarks and write JSON results")
+    run_p.add_argument("--out", default="bench_results.json", help="results file (default: bench_results.json)")
+    run_p.add_argument("--files", type=int, default=200, help="corpus file count (default: 200)")
+    run_p.add_argument("--file-kb", type=int, default=16, help="size of each corpus file in KiB (default: 16)")
+    run_p.add_argument("--density", type=float, default=0.01, help="fraction of lines with a finding (default: 0.01)")
+    run_p.add_argument("--seed", type=int, default=0, help="corpus seed (default: 0)")
+    run_p.add_argument("--workers", type=_worker_list, default=[1, 2, 4], help="worker counts, e.g. 1,2,4")
+    run_p.add_argument("--repeat", type=int, default=3, help="runs per measurement; the best is kept (default: 3)")
+    run_p.set_defaults(func=run)
+
+    cmp_p = sub.add_parser("compare", help="compare results with a baseline")
+    cmp_p.add_argument("current", help="results file from `run`")
+    cmp_p.add_argument("baseline", help="results file of `run` on the reference commit, same machine")
+    cmp_p.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction (default: 0.10)")
+    cmp_p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+# The guard is required for the process pool: workers re-import this module
+if __name__ == "__main__":
+    main()
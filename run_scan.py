@@ -1,15 +1,92 @@
+import argparse
+import os
+import subprocess
 import sys
-from app.services.project_scanner import scan_project
+from collections import Counter
+from app.services.project_scanner import iter_scan_project
+from app.services.reports import FORMATS, open_report
 
-results = scan_project(".")
 
-critical = [f for f in results if f["severity"] == "CRITICAL"]
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scan the project and fail on CRITICAL findings.",
+        epilog="Exit status: 0 without CRITICAL findings, 1 with some, 2 if git failed (--diff-base).",
+    )
+    parser.add_argument("path", nargs="?", default=".", help="folder to scan (default: current directory)")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of scanner processes; 0 uses one per CPU (default: 1)",
+    )
+    parser.add_argument(
+        "--cache", default=os.getenv("SCAN_CACHE", ""), metavar="FILE",
+        help="reuse findings of unchanged files from this cache file (default: $SCAN_CACHE; none if unset)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="rescan every file, even with $SCAN_CACHE set")
+    parser.add_argument(
+        "--exclude", action="append", default=[], metavar="PATTERN",
+        help="skip paths matching this .gitignore-style pattern; repeatable (adds to $SCAN_EXCLUDE)",
+    )
+    parser.add_argument(
+        "--diff-base", metavar="REF",
+        help="only report findings on lines changed since REF (e.g. origin/main)",
+    )
+    parser.add_argument(
+        "--format", choices=FORMATS,
+        help="also write every finding to --output as SARIF 2.1.0 or NDJSON, streamed as the scan runs",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", metavar="FILE",
+        help="report file for --format; '-' is stdout, a .gz name is gzip-compressed (default: -)",
+    )
+    parser.add_argument("--gzip", action="store_true", help="gzip the report whatever its file name")
+    args = parser.parse_args()
 
-print("Total findings:", len(results))
-print("Critical findings:", len(critical))
+    skipped = []
+    if args.diff_base:
+        from app.services.diff_scanner import iter_scan_diff
+        findings = iter_scan_diff(args.diff_base, args.path, skipped=skipped)
+    else:
+        findings = iter_scan_project(
+            args.path, workers=args.workers, cache_path="" if args.no_cache else args.cache, skipped=skipped,
+            exclude=args.exclude,
+        )
 
-if len(critical) > 0:
-    print("CRITICAL vulnerabilities detected!")
-    sys.exit(1)
-else:
-    print("No critical vulnerabilities found.")
+    # Findings are counted and written one at a time, never kept
+    severities = Counter()
+    try:
+        if args.format:
+            with open_report(args.output, args.format, root=args.path, compress=args.gzip or None) as report:
+                for finding in findings:
+                    severities[finding["severity"]] += 1
+                    report.write(finding)
+                report.skipped = skipped
+        else:
+            for finding in findings:
+                severities[finding["severity"]] += 1
+    except subprocess.CalledProcessError as e:
+        # Not a scan result: keep it apart from the CRITICAL gate's status 1
+        print(f"error: git failed: {(e.stderr or '').strip() or e}", file=sys.stderr)
+        sys.exit(2)
+
+    critical = severities["CRITICAL"]
+    # Keep a report written to stdout parseable
+    out = sys.stderr if args.format and args.output == "-" else sys.stdout
+
+    print("Total findings:", sum(severities.values()), file=out)
+    print("Critical findings:", critical, file=out)
+    if skipped:
+        # Binary, unreadable and oversized files; truncated ones were partly scanned
+        print("Skipped or truncated files:", len(skipped), file=out)
+        for skip in skipped:
+            print(f"  {skip['file']} ({skip['reason']})", file=out)
+
+    if critical > 0:
+        print("CRITICAL vulnerabilities detected!", file=out)
+        sys.exit(1)
+    else:
+        print("No critical vulnerabilities found.", file=out)
+
+
+# The guard is required for the process pool: workers re-import this module
+if __name__ == "__main__":
+    main()
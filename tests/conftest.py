@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Point the app at a throwaway database before anything imports `app.database`
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from app.database import engine  # noqa: E402
+from app.migrations import upgrade  # noqa: E402
+
+# The schema comes from the versioned migrations, as in app.main
+upgrade(engine)
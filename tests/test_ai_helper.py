@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from app.services import ai_helper, rec_cache
+from app.services.rec_cache import RecommendationCache
+
+
+class FakeClient:
+    """Answers batch prompts with `batch_reply` and single prompts with `single`."""
+
+    def __init__(self, batch_reply=None, single="single fix"):
+        self.batch_reply = batch_reply
+        self.single = single
+        self.batches = []  # (messages, future)
+        self.singles = 0
+
+    def submit(self, messages):
+        fut = Future()
+        self.batches.append((messages, fut))
+        if self.batch_reply is not None:
+            fut.set_result(self.batch_reply)
+        return fut  # never resolved without a reply: a request still running
+
+    def complete(self, messages, timeout=None):
+        self.singles += 1
+        return self.single
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RecommendationCache()
+    monkeypatch.setattr(rec_cache, "recommendation_cache", cache)
+    monkeypatch.delenv("FAKE_AI", raising=False)
+    return cache
+
+
+def _findings(tag, n):
+    return [{"code": f"{tag}_{i}(x)", "pattern": f"{tag}{i}", "file": "a.py"} for i in range(n)]
+
+
+def test_malformed_batch_reply_falls_back_per_finding(cache, monkeypatch):
+    client = FakeClient(batch_reply='[{"id": "f0", "recommendation": "batched"}, {"id": "f1"')
+    monkeypatch.setattr(ai_helper, "_client", client)
+    assert ai_helper.generate_ai_recommendations(_findings("malformed", 2)) == ["single fix"] * 2
+    assert len(client.batches) == 1 and client.singles == 2
+    assert not cache._inflight
+
+
+def test_batch_reply_may_skip_findings(cache, monkeypatch):
+    client = FakeClient(batch_reply='Sure:\n```json\n[{"id": "f1", "recommendation": "batched"}]\n```')
+    monkeypatch.setattr(ai_helper, "_client", client)
+    assert ai_helper.generate_ai_recommendations(_findings("partial", 2)) == ["single fix", "batched"]
+    assert client.singles == 1
+
+
+def test_timeout_returns_none_and_releases_claims(cache, monkeypatch):
+    client = FakeClient()  # batch reply never arrives
+    monkeypatch.setattr(ai_helper, "_client", client)
+    assert ai_helper.generate_ai_recommendations(_findings("slow", 3), timeout=0.05) == [None] * 3
+    assert client.singles == 0
+    assert not cache._inflight
+
+
+def test_concurrent_callers_share_one_request(cache, monkeypatch):
+    client = FakeClient(batch_reply='[{"id": "f0", "recommendation": "batched"}]')
+    monkeypatch.setattr(ai_helper, "_client", client)
+    finding = _findings("shared", 1)[0]
+    model = ai_helper._current_model()
+
+    # Another caller already owns the key: the batch waits for its answer
+    _, _, owner = cache.claim(finding["code"], finding["pattern"], model)
+    assert owner
+    out = []
+    t = threading.Thread(target=lambda: out.append(ai_helper.generate_ai_recommendations([finding], timeout=5)))
+    t.start()
+    while not cache.stats["coalesced"]:
+        t.join(0.01)
+    cache.release(finding["code"], "from the other caller", finding["pattern"], model)
+    t.join(5)
+    assert out == [["from the other caller"]]
+    assert not client.batches
+    assert cache.stats["coalesced"] == 1
+
+    # A single-finding call made while the batch is in flight joins it
+    client = FakeClient()
+    monkeypatch.setattr(ai_helper, "_client", client)
+    other = _findings("inflight", 1)[0]
+    t = threading.Thread(target=lambda: out.append(ai_helper.generate_ai_recommendations([other], timeout=5)))
+    t.start()
+    while not client.batches:
+        t.join(0.01)
+    single = ai_helper.submit_ai_recommendation(other["code"], other["pattern"])
+    while cache.stats["coalesced"] < 2:
+        t.join(0.01)
+    client.batches[0][1].set_result('[{"id": "f0", "recommendation": "batched"}]')
+    t.join(5)
+    assert out[-1] == ["batched"] and single.result(1) == "batched"
+    assert client.singles == 0
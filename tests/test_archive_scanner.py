@@ -0,0 +1,43 @@
+import io
+import tarfile
+
+from app.services import archive_scanner
+
+
+class _Zeros(io.RawIOBase):
+    def __init__(self, n):
+        self.n = n
+
+    def readinto(self, b):
+        k = min(len(b), self.n)
+        b[:k] = b"\0" * k
+        self.n -= k
+        return k
+
+
+def _tar_gz(*members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        for name, size, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            tf.addfile(info, io.BytesIO(data) if data is not None else _Zeros(size))
+    buf.seek(0)
+    return buf
+
+
+def test_unscanned_tar_members_count_toward_the_byte_limit(monkeypatch):
+    monkeypatch.setattr(archive_scanner, "ARCHIVE_MAX_BYTES", 1024 * 1024)
+    src = b"x = eval(data)\n"
+    archive = _tar_gz(("blob.bin", 8 * 1024 * 1024, None), ("a.py", len(src), src))
+    skipped = []
+    findings = list(archive_scanner.iter_scan_archive(archive_scanner.open_archive(archive), skipped=skipped))
+    assert findings == []
+    assert [(s["file"], s["reason"]) for s in skipped] == [("blob.bin", "archive_size_limit")]
+
+
+def test_members_under_the_limit_are_scanned():
+    src = b"x = eval(data)\n"
+    archive = _tar_gz(("blob.bin", 4096, None), ("a.py", len(src), src))
+    findings = list(archive_scanner.iter_scan_archive(archive_scanner.open_archive(archive)))
+    assert [(f["file"], f["line"]) for f in findings] == [("a.py", 1)]
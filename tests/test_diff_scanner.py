@@ -0,0 +1,49 @@
+import subprocess
+
+import pytest
+
+from app.services.diff_scanner import _unquote, changed_lines, scan_diff
+
+
+def _git(repo, *args):
+    subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "config", "user.email", "dev@example.com")
+    _git(tmp_path, "config", "user.name", "dev")
+    (tmp_path / "base.py").write_text("x = 1\n")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "base")
+    return tmp_path
+
+
+def test_unquote_decodes_git_escapes():
+    assert _unquote('"b/a\\"b\\\\c.py"') == 'b/a"b\\c.py'
+    assert _unquote('"b/caf\\303\\251.py"') == "b/café.py"
+    assert _unquote("b/plain.py") == "b/plain.py"
+
+
+def test_paths_with_spaces_quotes_and_plus_lines(repo):
+    (repo / "a b.py").write_text("y = 2\neval(y)\n")
+    (repo / 'q"uote.py').write_text("eval(z)\n")
+    # An added line starting with "++ " must not be read as a file header
+    (repo / "base.py").write_text("x = 1\n++ y\nz = 3\n\neval(x)\n")
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "change")
+    _git(repo, "checkout", "-q", "-b", "topic")
+
+    changes = changed_lines("HEAD~1", str(repo))
+    assert changes == {"a b.py": {1, 2}, 'q"uote.py': {1}, "base.py": {2, 3, 4, 5}}
+    files = sorted(f["file"].rsplit("/", 1)[-1] for f in scan_diff("HEAD~1", str(repo)))
+    assert files == ["a b.py", "base.py", 'q"uote.py']
+
+
+def test_git_failure_exits_with_a_distinct_status(repo):
+    proc = subprocess.run(
+        ["python", "run_scan.py", str(repo), "--diff-base", "no-such-ref"], capture_output=True, text=True,
+    )
+    assert proc.returncode == 2
+    assert "git failed" in proc.stderr
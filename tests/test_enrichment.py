@@ -0,0 +1,112 @@
+import pytest
+
+from app.services import recommender
+from app.services.enrichment import EnrichmentScheduler
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def generate(findings):
+        calls.append([f["code"] for f in findings])
+        return [f"fix {f['code']}" for f in findings]
+
+    monkeypatch.setattr(recommender, "generate_recommendations", generate)
+    return calls
+
+
+def _finding(code, severity="MEDIUM"):
+    # The pattern keeps snippets apart however `rec_cache` normalizes the code
+    return {"code": code, "pattern": code, "severity": severity}
+
+
+def _drain(scheduler):
+    # No worker threads: take and process batches in the test's own thread
+    while True:
+        with scheduler._cond:
+            batch = scheduler._take_batch()
+        if not batch:
+            return
+        scheduler._process(batch)
+
+
+def test_budget_caps_what_is_queued_and_keeps_the_worst(calls):
+    scheduler = EnrichmentScheduler(workers=0)
+    run = scheduler.start(budget=2)
+    futures = run.add_many(_finding(f"m{i}") for i in range(5))
+    assert sum(f is not None for f in futures) == 2
+    assert run.dropped["budget"] == 3
+
+    high = run.add(_finding("h", "HIGH"))       # replaces a queued MEDIUM
+    critical = run.add(_finding("c", "CRITICAL"))  # always queued
+    assert run.dropped["budget"] == 4
+    run.close()
+    _drain(scheduler)
+
+    assert run.finished
+    assert critical.result() == "fix c" and high.result() == "fix h"
+    assert run.sent == 2
+    p = run.progress()
+    assert p["done"] + p["failed"] + sum(p["dropped"].values()) == 7
+    assert p["dropped"] == {"budget": 5, "deadline": 0, "cancelled": 0}
+
+
+def test_deadline_drops_findings_not_started(calls):
+    scheduler = EnrichmentScheduler(workers=0)
+    run = scheduler.start(deadline=0)
+    futures = run.add_many(_finding(f"m{i}", "HIGH") for i in range(3))
+    run.close()
+    assert run.wait(timeout=1)
+    assert [f.result() for f in futures] == [None] * 3
+    assert run.dropped == {"budget": 0, "deadline": 3, "cancelled": 0}
+    assert run.sent == 0 and not calls
+
+
+def test_identical_snippets_are_sent_once(calls):
+    scheduler = EnrichmentScheduler(workers=0)
+    first, second = scheduler.start(), scheduler.start()
+    a = first.add(_finding("eval(x)", "HIGH"))
+    b = second.add(_finding("eval(x)", "HIGH"))
+    _drain(scheduler)
+    assert calls == [["eval(x)"]]
+    assert a.result() == b.result() == "fix eval(x)"
+    assert first.sent == second.sent == 1
+
+
+def test_older_runs_go_first_within_a_severity(calls):
+    scheduler = EnrichmentScheduler(workers=0, batch_size=1)
+    older, newer = scheduler.start(), scheduler.start()
+    older.add(_finding("old", "HIGH"))
+    newer.add_many(_finding(f"new{i}", "HIGH") for i in range(3))
+    newer.add(_finding("worse", "CRITICAL"))
+    _drain(scheduler)
+    assert [c[0] for c in calls] == ["worse", "old", "new2", "new1", "new0"]
+
+
+def test_prefilled_findings_cost_no_budget(calls):
+    scheduler = EnrichmentScheduler(workers=0)
+    run = scheduler.start(budget=0)
+    fut = run.add(dict(_finding("x"), ai_recommendation="already"))
+    assert run.add_many([_finding("y")]) == [None]
+    _drain(scheduler)
+    assert fut.result() == "already"
+    assert run.sent == 0 and not calls
+    assert run.progress()["done"] == 1
+
+
+def test_finding_set_rows_are_built_only_when_queued(calls, monkeypatch):
+    from app.services.findings import FindingSet
+
+    built = []
+    row = FindingSet._row
+    monkeypatch.setattr(FindingSet, "_row", lambda self, i: built.append(i) or row(self, i))
+    findings = FindingSet(_finding(f"m{i}") for i in range(100))
+
+    scheduler = EnrichmentScheduler(workers=0)
+    run = scheduler.start(budget=2)
+    futures = run.add_many(findings)
+    assert built == [0, 1]
+    assert sum(f is not None for f in futures) == 2
+    _drain(scheduler)
+    assert [f.result() for f in futures[:2]] == ["fix m0", "fix m1"]
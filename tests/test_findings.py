@@ -0,0 +1,64 @@
+import json
+import pickle
+
+import pytest
+
+from app.services.findings import FindingSet
+
+_FINDINGS = [
+    {"line": 3, "code": "eval(x)", "pattern": r"eval\(", "severity": "CRITICAL", "file": "a.py"},
+    {"line": None, "code": "naïve = input()  \udcff", "pattern": r"input\(", "severity": "MEDIUM"},
+    {"line": 7, "code": "", "pattern": "js-eval", "severity": "HIGH", "rule_id": "js-eval",
+     "message": "eval of \"untrusted\" input", "file": "b.js"},
+    {"line": 4, "code": "eval(y)", "pattern": r"eval\(", "severity": "CRITICAL", "file": "a.py"},
+]
+
+
+def test_rows_round_trip_as_dicts():
+    findings = FindingSet(_FINDINGS)
+    assert len(findings) == 4 and list(findings) == _FINDINGS
+    # Same key order as the scanners' dicts
+    assert [list(f) for f in findings] == [list(f) for f in _FINDINGS]
+    assert findings[-1] == _FINDINGS[-1]
+    with pytest.raises(IndexError):
+        findings[4]
+    assert list(pickle.loads(pickle.dumps(findings))) == _FINDINGS
+    assert findings._rules.count(findings._rules[0]) == 1  # rule strings stored once
+
+    merged = FindingSet(_FINDINGS[:2])
+    merged.extend(FindingSet(_FINDINGS[2:]))
+    assert list(merged) == _FINDINGS
+
+
+def test_iter_json_matches_json_dumps():
+    findings = FindingSet(_FINDINGS)
+    assert list(findings.iter_json()) == [json.dumps(f) for f in _FINDINGS]
+    findings.set_recommendations(["use ast.literal_eval", None, "avoid eval", "use ast.literal_eval"])
+    assert list(findings.iter_json()) == [json.dumps(f) for f in findings]
+
+
+def test_set_recommendations():
+    findings = FindingSet(_FINDINGS)
+    with pytest.raises(ValueError):
+        findings.set_recommendations(["too few"])
+    findings.set_recommendations(f"fix {i}" for i in range(4))
+    assert [f["ai_recommendation"] for f in findings] == [f"fix {i}" for i in range(4)]
+    assert [rec for *_rest, rec in findings.index_records()] == [f"fix {i}" for i in range(4)]
+
+    # Rows appended afterwards, and sets without recommendations, extend with None
+    findings.append(_FINDINGS[0])
+    findings.extend(FindingSet(_FINDINGS[:1]))
+    assert [f["ai_recommendation"] for f in findings][4:] == [None, None]
+    plain = FindingSet(_FINDINGS[:1])
+    plain.extend(findings)
+    assert [f.get("ai_recommendation") for f in plain] == [None, "fix 0", "fix 1", "fix 2", "fix 3", None, None]
+
+
+def test_counts_and_filter_use_the_columns():
+    findings = FindingSet(_FINDINGS)
+    assert findings.counts() == {"CRITICAL": 2, "MEDIUM": 1, "HIGH": 1}
+    assert findings.counts("file") == {"a.py": 2, None: 1, "b.js": 1}
+    assert list(findings.filter(severity=["HIGH", "MEDIUM"])) == _FINDINGS[1:3]
+    assert list(findings.filter(pattern=r"eval\(", file="a.py")) == [_FINDINGS[0], _FINDINGS[3]]
+    with pytest.raises(ValueError):
+        findings.counts("line")
@@ -0,0 +1,71 @@
+import mmap
+
+import pytest
+
+from app.services import ingest
+from app.services.ingest import SNIFF_BYTES, SkippedFile, apply_limits, open_source
+from app.services.sast import scan_buffer
+
+
+def _file(tmp_path, data: bytes, name="m.py"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_large_files_are_memory_mapped(tmp_path, monkeypatch):
+    data = b"x = 1\n" * 20 + b"eval(x)\n"
+    small = _file(tmp_path, data[:24], "small.py")
+    large = _file(tmp_path, data, "large.py")
+    monkeypatch.setattr(ingest, "MMAP_THRESHOLD", 64)
+
+    with open_source(small) as (buf, endpos, size, truncated):
+        assert isinstance(buf, bytes) and (endpos, size, truncated) == (24, 24, False)
+    with open_source(large) as (buf, endpos, size, truncated):
+        assert isinstance(buf, mmap.mmap) and endpos == size == len(data) and not truncated
+        assert scan_buffer(buf, endpos=endpos) == scan_buffer(data)
+    assert buf.closed
+
+
+@pytest.mark.parametrize("threshold", [0, 1 << 20])
+def test_empty_files_are_scanned(tmp_path, monkeypatch, threshold):
+    monkeypatch.setattr(ingest, "MMAP_THRESHOLD", threshold)
+    with open_source(_file(tmp_path, b"")) as (buf, endpos, size, truncated):
+        assert (bytes(buf), endpos, size, truncated) == (b"", 0, 0, False)
+
+
+def test_binary_files_are_sniffed_from_the_start(tmp_path):
+    with pytest.raises(SkippedFile) as e:
+        with open_source(_file(tmp_path, b"eval(x)\n\0\1\2")):
+            pass
+    assert (e.value.reason, e.value.size) == ("binary", 11)
+    # A NUL past the sniffed prefix does not make a file binary
+    late = b"#" * SNIFF_BYTES + b"\0\neval(x)\n"
+    with open_source(_file(tmp_path, late)) as (buf, endpos, _size, _truncated):
+        assert endpos == len(late)
+
+
+def test_size_limits(tmp_path):
+    path = _file(tmp_path, b"eval(a)\neval(b)\neval(c)\n")
+    with pytest.raises(SkippedFile) as e:
+        with open_source(path, max_bytes=20):
+            pass
+    assert (e.value.reason, e.value.size) == ("too_large", 24)
+
+    # Truncation stops at the last full line under the limit
+    with open_source(path, max_bytes=20, oversize="truncate") as (buf, endpos, size, truncated):
+        assert (buf[:endpos], size, truncated) == (b"eval(a)\neval(b)\n", 24, True)
+
+    with pytest.raises(SkippedFile) as e:
+        with open_source(str(tmp_path / "missing.py")):
+            pass
+    assert e.value.reason == "unreadable"
+
+
+def test_apply_limits_to_uploads(monkeypatch):
+    assert apply_limits("a.py", b"eval(x)\n") == (8, None)
+    assert apply_limits("a.py", b"\0") == (0, {"file": "a.py", "reason": "binary", "size": 1})
+    monkeypatch.setattr(ingest, "MAX_FILE_BYTES", 10)
+    assert apply_limits("a.py", b"eval(a)\neval(b)\n") == (0, {"file": "a.py", "reason": "too_large", "size": 16})
+    monkeypatch.setattr(ingest, "OVERSIZE", "truncate")
+    assert apply_limits("a.py", b"eval(a)\neval(b)\n") == (8, {"file": "a.py", "reason": "truncated", "size": 16})
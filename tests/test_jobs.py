@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from app.database import SessionLocal
+from app.models import ScanJob
+from app.services import jobs
+
+
+def _job(db, heartbeat_at, owner="other-host:1"):
+    job = ScanJob(status="running", path=".", owner=owner, heartbeat_at=heartbeat_at, created_at=jobs._now())
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def test_recovery_only_fails_jobs_without_a_recent_heartbeat():
+    db = SessionLocal()
+    try:
+        now = jobs._now()
+        live = _job(db, now)
+        stale = _job(db, now - timedelta(seconds=jobs.JOB_STALE_AFTER + 5))
+        legacy = _job(db, None, owner=None)
+        jobs.recover_interrupted_jobs()
+        db.expire_all()
+        assert db.get(ScanJob, live).status == "running"
+        # Stored and read back as the same naive UTC value
+        assert db.get(ScanJob, live).heartbeat_at == now
+        assert db.get(ScanJob, stale).status == "failed"
+        assert db.get(ScanJob, legacy).status == "failed"
+    finally:
+        db.close()
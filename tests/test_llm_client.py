@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from app.services.llm_client import CircuitBreaker, LLMClient
+
+
+def _client(handler, models=("primary", "fallback")):
+    client = LLMClient("http://llm.test/v1", "key", models)
+    client.bucket_rate = client.bucket_capacity = 1000.0
+    client.max_attempts = 3
+    client._ensure_loop()
+    client._http = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def _reply(text):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def test_released_trial_lets_the_next_request_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.allow()        # the half-open trial
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_client_error_moves_on_to_the_next_model():
+    def handler(request):
+        model = json.loads(request.content)["model"]
+        return httpx.Response(404) if model == "primary" else _reply("from fallback")
+
+    client = _client(handler)
+    assert client.complete([{"role": "user", "content": "hi"}]) == "from fallback"
+    assert client.breakers["primary"].failures == 1
+    assert client.breakers["fallback"].state == "closed"
+
+
+def test_bad_request_on_a_half_open_trial_does_not_wedge_the_breaker():
+    client = _client(lambda request: httpx.Response(400), models=("primary",))
+    breaker = client.breakers["primary"]
+    breaker.cooldown = 0
+    breaker.opened_at = time.monotonic() - 1   # half-open
+    assert client.complete([{"role": "user", "content": "hi"}]) is None
+    assert breaker.allow()
+
+
+def test_malformed_reply_is_retried_and_counted_against_the_model():
+    replies = iter([httpx.Response(200, json={"id": "x"}), _reply("ok")])
+    client = _client(lambda request: next(replies), models=("primary",))
+    assert client.complete([{"role": "user", "content": "hi"}]) == "ok"
+    assert client.breakers["primary"].failures == 0
+
+
+def test_timeout_cancels_the_request_and_releases_the_trial():
+    async def handler(request):
+        await asyncio.sleep(5)
+        return _reply("late")
+
+    client = _client(handler, models=("primary",))
+    breaker = client.breakers["primary"]
+    breaker.cooldown = 0
+    breaker.opened_at = time.monotonic() - 1
+    start = time.monotonic()
+    assert client.complete([{"role": "user", "content": "hi"}], timeout=0.2) is None
+    assert time.monotonic() - start < 2
+    time.sleep(0.1)   # the cancellation lands on the client's loop
+    assert breaker.allow()
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Finding, FindingStat, ScannedFile
+from app.services import persistence
+from app.services.findings import FindingSet
+from app.services.persistence import FindingWriter, bulk_update_recommendations, create_scan
+
+
+@pytest.fixture
+def db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+@pytest.fixture(params=["upsert", "fallback"])
+def writer_for(request, monkeypatch):
+    if request.param == "fallback":
+        monkeypatch.setattr(persistence, "_upsert_insert", lambda dialect: None)
+
+    def make(db, **kw):
+        writer = FindingWriter(db, create_scan(db, "project").id, **kw)
+        assert (writer._upsert is None) == (request.param == "fallback")
+        return writer
+    return make
+
+
+def _findings(tag):
+    return [
+        {"file": "a.py", "line": 1, "code": "eval(x)", "pattern": tag, "severity": "CRITICAL"},
+        {"file": "a.py", "line": 9, "code": " eval(x) ", "pattern": tag, "severity": "CRITICAL"},  # same fingerprint
+        {"file": "b.py", "line": 2, "code": "eval(x)", "pattern": tag, "severity": "CRITICAL"},
+        {"line": 3, "code": "input()", "pattern": tag + "-input", "severity": "MEDIUM"},
+    ]
+
+
+def test_repeats_are_counted_on_one_row(db, writer_for):
+    writer = writer_for(db, default_path="default.py")
+    ids = writer.write(_findings("persist-upsert"))
+    assert ids[0] == ids[1] and len(set(ids)) == 3
+    # Across calls too, and a FindingSet gives the same rows as dicts
+    assert writer.write(FindingSet(_findings("persist-upsert")[:1])) == ids[:1]
+
+    rows = db.execute(
+        select(Finding.id, ScannedFile.path, Finding.count)
+        .join(ScannedFile, Finding.file_id == ScannedFile.id)
+        .where(Finding.scan_id == writer.scan_id)
+        .order_by(Finding.id)
+    ).all()
+    assert [(path, count) for _id, path, count in rows] == [("a.py", 3), ("b.py", 1), ("default.py", 1)]
+    assert [r[0] for r in rows] == sorted(set(ids))
+
+    stats = dict(db.execute(
+        select(FindingStat.pattern, FindingStat.count).where(FindingStat.pattern.like("persist-upsert%"))
+    ).all())
+    assert stats == {"persist-upsert": 4, "persist-upsert-input": 1}
+
+
+def test_scans_do_not_share_rows(db, writer_for):
+    first = writer_for(db).write(_findings("persist-scans"))
+    second = writer_for(db).write(_findings("persist-scans"))
+    assert not set(first) & set(second)
+
+
+def test_bulk_update_recommendations(db, writer_for):
+    ids = writer_for(db).write(_findings("persist-recs"))
+    assert bulk_update_recommendations(db, [(ids[0], "fix"), (ids[0], "again"), (ids[2], ""), (None, "x")]) == 1
+    assert db.get(Finding, ids[0]).recommendation == "fix"
+    assert db.get(Finding, ids[2]).recommendation is None
@@ -0,0 +1,51 @@
+from app.services.project_scanner import _batches, iter_scan_project, scan_project
+
+
+def _project(root):
+    for d in range(3):
+        pkg = root / f"pkg{d}"
+        pkg.mkdir()
+        for f in range(4):
+            lines = ["x = 1\n"] * (f * 7) + [f"eval(a{d}{f})\n", "os.system(c)\n"] * (d + f + 1)
+            (pkg / f"m{f}.py").write_text("".join(lines))
+    (root / "pkg1" / "blob.py").write_bytes(b"eval(x)\0\0\0")
+
+
+def test_batches_are_cut_by_size(tmp_path):
+    paths = []
+    for i, size in enumerate([10, 50, 5, 5, 100, 1]):
+        (tmp_path / f"f{i}").write_bytes(b"x" * size)
+        paths.append(str(tmp_path / f"f{i}"))
+    assert [len(b) for b in _batches(paths, batch_bytes=60)] == [2, 3, 1]
+    assert [b for b in _batches(["missing"], batch_bytes=60)] == [["missing"]]
+
+
+def test_parallel_scan_keeps_walk_order(tmp_path, monkeypatch):
+    _project(tmp_path)
+    serial_skipped, parallel_skipped = [], []
+    serial = list(iter_scan_project(str(tmp_path), cache_path="", skipped=serial_skipped))
+    assert len({f["file"] for f in serial}) == 12
+
+    # Small batches so the pool gets several and may finish them out of order
+    monkeypatch.setattr(_batches, "__defaults__", (64, None))
+    parallel = list(iter_scan_project(str(tmp_path), workers=2, cache_path="", skipped=parallel_skipped))
+    assert parallel == serial
+    assert parallel_skipped == serial_skipped and [s["reason"] for s in serial_skipped] == ["binary"]
+
+
+def test_parallel_cached_scan_keeps_walk_order(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    _project(project)
+    serial = list(scan_project(str(project), cache_path=""))
+
+    monkeypatch.setattr(_batches, "__defaults__", (64, None))
+    cache = str(tmp_path / "cache.db")
+    assert list(scan_project(str(project), workers=2, cache_path=cache)) == serial
+    # Second run: every file but the edited one comes from the cache
+    (project / "pkg2" / "m0.py").write_text("exec(y)\n")
+    rescanned = list(scan_project(str(project), workers=2, cache_path=cache))
+    edited = str(project / "pkg2" / "m0.py")
+    assert [f for f in rescanned if f["file"] != edited] == [f for f in serial if f["file"] != edited]
+    assert [f["pattern"] for f in rescanned if f["file"] == edited] == [r"exec\("]
+    assert list(dict.fromkeys(f["file"] for f in rescanned)) == list(dict.fromkeys(f["file"] for f in serial))
@@ -0,0 +1,20 @@
+from app.services.rec_cache import cache_key
+
+
+def test_identifiers_and_whitespace_share_a_key():
+    assert cache_key("x = eval(data)  # parse", "eval\\(") == cache_key("result=eval( payload )", "eval\\(")
+
+
+def test_literals_and_dotted_names_stay_in_the_key():
+    assert cache_key('eval("1 + 1")') != cache_key("eval(\"__import__('os')\")")
+    assert cache_key("os.chmod(p, 0o777)") != cache_key("os.chmod(p, 0o600)")
+    assert cache_key("pickle.loads(x)") != cache_key("json.loads(x)")
+
+
+def test_database_tier_uses_the_migrated_table():
+    from app.services.rec_cache import RecommendationCache
+
+    RecommendationCache().put("os.system(cmd)", "use subprocess.run", "os\\.system\\(", "m")
+    fresh = RecommendationCache()
+    assert fresh.lookup("os.system(cmd)", "os\\.system\\(", "m") == "use subprocess.run"
+    assert fresh.stats["db_hits"] == 1 and fresh.stats["errors"] == 0
@@ -0,0 +1,43 @@
+import contextlib
+import json
+import os
+
+import pytest
+
+from app.services.reports import open_report
+
+
+def _finding(root):
+    return {"file": os.path.join(root, "src", "app.py"), "line": 3, "code": "eval(x)",
+            "pattern": "eval\\(", "severity": "CRITICAL"}
+
+
+def _sarif(path, root, findings, fail=False):
+    with pytest.raises(RuntimeError) if fail else contextlib.nullcontext():
+        with open_report(str(path), "sarif", root=root) as report:
+            for finding in findings:
+                report.write(finding)
+            if fail:
+                raise RuntimeError("walk failed")
+    return json.loads(path.read_text())["runs"][0]
+
+
+def test_fingerprints_do_not_depend_on_the_checkout_path(tmp_path):
+    one, two = str(tmp_path / "ci-1"), str(tmp_path / "ci-2")
+    results = [
+        _sarif(tmp_path / f"{i}.sarif", root, [_finding(root)])["results"][0]
+        for i, root in enumerate((one, two))
+    ]
+    assert results[0]["partialFingerprints"] == results[1]["partialFingerprints"]
+    assert results[0]["locations"][0]["physicalLocation"]["artifactLocation"]["uri"] == "src/app.py"
+
+
+def test_failed_scan_is_not_reported_as_successful(tmp_path):
+    root = str(tmp_path)
+    ok = _sarif(tmp_path / "ok.sarif", root, [_finding(root)])
+    failed = _sarif(tmp_path / "failed.sarif", root, [_finding(root)], fail=True)
+    assert ok["invocations"][0]["executionSuccessful"] is True
+    invocation = failed["invocations"][0]
+    assert invocation["executionSuccessful"] is False
+    assert "walk failed" in invocation["toolExecutionNotifications"][-1]["message"]["text"]
+    assert len(failed["results"]) == 1
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from app.services import rule_packs
+
+
+def _write_pack(directory, *patterns):
+    rules = [
+        {"id": f"r{i}", "languages": ["javascript"], "pattern": p, "severity": "HIGH", "message": "m"}
+        for i, p in enumerate(patterns)
+    ]
+    with open(os.path.join(directory, "pack.json"), "w", encoding="utf-8") as f:
+        json.dump({"rules": rules}, f)
+
+
+def _scan(rules, data: bytes):
+    return [(f["line"], f["rule_id"]) for f in rules[".js"].scan(data, len(data))]
+
+
+def test_leading_global_flag_is_scoped(tmp_path):
+    _write_pack(tmp_path, r"(?i)document\.write\(", r"\beval\(")
+    _version, rules = rule_packs.load_rule_packs(str(tmp_path), "")
+    assert _scan(rules, b"DOCUMENT.WRITE(x)\neval(1)\n") == [(1, "r0"), (2, "r1")]
+
+
+@pytest.mark.parametrize("pattern", [r"(a)\1", r"(?P<name>a)", r"(?a)foo", r"foo(?i)"])
+def test_patterns_that_cannot_be_combined_fail_at_load(tmp_path, pattern):
+    _write_pack(tmp_path, pattern, r"\beval\(")
+    with pytest.raises(rule_packs.RulePackError):
+        rule_packs.load_rule_packs(str(tmp_path), "")
+
+
+def test_tampered_cached_plan_is_not_used(tmp_path):
+    packs = tmp_path / "packs"
+    packs.mkdir()
+    _write_pack(packs, r"\beval\(")
+    cache = tmp_path / "cache" / "rule-packs.json"
+    rule_packs.load_rule_packs(str(packs), str(cache))
+
+    data = json.loads(cache.read_text())
+    for plan in data["plans"].values():
+        plan[0] = "(?!)"
+    cache.write_text(json.dumps(data))
+
+    _version, rules = rule_packs.load_rule_packs(str(packs), str(cache))
+    assert _scan(rules, b"eval(1)\n") == [(1, "r0")]
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX permissions")
+def test_cache_writable_by_others_is_ignored(tmp_path):
+    cache = tmp_path / "cache" / "rule-packs.json"
+    _write_pack(tmp_path, r"\beval\(")
+    rule_packs.load_rule_packs(str(tmp_path), str(cache))
+    assert rule_packs._read_cache(str(cache))
+    os.chmod(cache, 0o666)
+    assert rule_packs._read_cache(str(cache)) == {}
+
+
+def test_unicode_aware_rules_read_non_ascii_files_like_text(tmp_path):
+    _write_pack(tmp_path, r"\beval\(", r"x.y", r"[^a]z")
+    _version, rules = rule_packs.load_rule_packs(str(tmp_path), "")
+    # `é` is a word character: no boundary before `eval`; `.` and `[^a]` take it whole
+    assert _scan(rules, "éeval(1)\nxéy\néz\neval(2)\n".encode("utf-8")) == [(2, "r1"), (3, "r2"), (4, "r0")]
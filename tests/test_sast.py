@@ -0,0 +1,118 @@
+import random
+import re
+
+from app.services.sast import (
+    DANGEROUS_PATTERNS, _compile_rules, _match, _match_buffer, _plan_rules, _prefilter_literals, scan_buffer,
+    scan_code,
+)
+
+# Overlapping prefixes (`ev`/`eval\(`/`evil`, `os\.`/`os\.system\(`), an anchor,
+# a quantified prefix and a top-level alternation
+_RULES = [r"eval\(", r"ev", r"evil", r"\bos\.system\(", r"os\.", r"exec\(\s*x", r"exec\(", r"e+x", r"in|put"]
+_TOKENS = ["eval(", "evil", "ev", "os.system(", "os.", "xos.system(", "exec(", "exec( x", "eex", "input",
+           "x", " ", "\n", "(", "e", "é"]
+
+_SAMPLE = """import os, pickle, subprocess
+os.system(cmd)
+subprocess.Popen(args)
+data = pickle.loads(blob)
+eval(expr); exec(src)
+name = input()
+"""
+
+
+def _keys(findings):
+    return [(f["line"], f["pattern"], f["severity"]) for f in findings]
+
+
+def test_regex_and_ast_modes_report_the_same_patterns():
+    regex = scan_code(_SAMPLE, mode="regex")
+    assert _keys(regex) == _keys(scan_code(_SAMPLE, mode="ast"))
+    assert {f["pattern"] for f in regex} == {
+        r"os\.system\(", r"subprocess\.Popen\(", r"pickle\.loads\(", r"eval\(", r"exec\(", r"input\(",
+    }
+
+
+def _per_rule(code, patterns):
+    """The reference: every rule tried on its own at every offset, one finding per line and rule."""
+    lines = code.split("\n")
+    hits = set()
+    for idx, p in enumerate(patterns):
+        rx = re.compile(p, re.MULTILINE)
+        for offset in range(len(code) + 1):
+            if rx.match(code, offset):
+                hits.add((code.count("\n", 0, offset) + 1, idx))
+    findings = []
+    for lineno, idx in sorted(hits):
+        p = patterns[idx]
+        sev = "CRITICAL" if "eval" in p.lower() else "MEDIUM" if "input" in p.lower() else "HIGH"
+        findings.append({"line": lineno, "code": lines[lineno - 1].strip(), "pattern": p, "severity": sev})
+    return findings
+
+
+def test_alternation_matches_like_per_rule_regexes():
+    text = _compile_rules(_RULES)
+    binary = _compile_rules(_RULES, as_bytes=True)
+    rng = random.Random(1)
+    for _ in range(500):
+        code = "".join(rng.choice(_TOKENS) for _ in range(rng.randint(0, 25)))
+        expected = _per_rule(code, _RULES)
+        assert _match(code, *text) == expected, code
+        if code.isascii():
+            # Non-ASCII text only takes the bytes path with byte-exact rules
+            raw = code.encode("ascii")
+            assert _match_buffer(raw, len(raw), *binary) == expected, code
+
+
+def test_shadowed_rules_are_rechecked_at_the_same_offset():
+    _, shadows = _plan_rules(_RULES)
+    # `eval\(` meets `ev` and the rules without a literal prefix (`e+x`, `in|put`)
+    assert shadows[0] == [1, 7, 8]
+    assert 2 not in shadows[0]  # `evil` and `eval(` never match at one offset
+    assert 4 in shadows[3] and 3 in shadows[4]
+    # One offset, two rules: the alternation picks one, the re-check adds the other
+    assert [f["pattern"] for f in _match("os.system(x)", *_compile_rules(_RULES))] == [
+        r"\bos\.system\(", r"os\.",
+    ]
+
+
+def test_builtin_rules_and_prefilter():
+    code = "x = eval(a)\nos.system(b)  # pickle.loads(c)\n"
+    assert _match(code, *_compile_rules(DANGEROUS_PATTERNS)) == _per_rule(code, DANGEROUS_PATTERNS)
+    assert _prefilter_literals(DANGEROUS_PATTERNS) == (
+        b"eval(", b"exec(", b"input(", b"os.system(", b"pickle.loads(", b"subprocess.Popen(",
+    )
+    assert _prefilter_literals([r"os\.", r"os\.system\("]) == (b"os.",)
+    assert _prefilter_literals([r"ev", r"eval\("]) is None  # too short to pay off
+    assert scan_buffer(b"print(1)\r\nx = eval(a)\r\n") == scan_code("print(1)\nx = eval(a)\n")
+
+
+def test_ast_mode_resolves_imports_and_ignores_text():
+    code = '''import os as o
+from pickle import loads as unpickle
+import subprocess.foo
+import builtins
+"""eval(docstring)"""
+o.system(cmd)  # exec(comment)
+unpickle(blob)
+subprocess.Popen(args)
+builtins.eval(expr)
+self.eval(expr)
+msg = "input(prompt)"
+'''
+    assert _keys(scan_code(code, mode="ast")) == [
+        (6, r"os\.system\(", "HIGH"),
+        (7, r"pickle\.loads\(", "HIGH"),
+        (8, r"subprocess\.Popen\(", "HIGH"),
+        (9, r"eval\(", "CRITICAL"),
+    ]
+    # The regex engine sees the text instead
+    assert [f["line"] for f in scan_code(code, mode="regex")] == [5, 6, 8, 9, 10, 11]
+
+
+def test_ast_mode_falls_back_to_regex_on_syntax_errors():
+    from app.services.metrics import AST_FALLBACKS
+
+    before = AST_FALLBACKS._values.get((), 0)
+    assert scan_code("def broken(:\n    eval(x)\n", mode="ast") == scan_code("def broken(:\n    eval(x)\n")
+    assert AST_FALLBACKS._values[()] == before + 1
@@ -0,0 +1,10 @@
+from app.services.scan_cache import ScanCache
+
+
+def test_default_mode_follows_sast_mode(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.db")
+    monkeypatch.setenv("SAST_MODE", "AST")
+    assert ScanCache(path).mode == "ast"
+    monkeypatch.delenv("SAST_MODE")
+    assert ScanCache(path).mode == "regex"
+    assert ScanCache(path, "ast").mode == "ast"
@@ -0,0 +1,194 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.routes import scan
+from app.services.enrichment import EnrichmentScheduler
+from app.services.persistence import FindingWriter, create_scan
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def stored_scan():
+    """A scan with five findings: three CRITICAL `eval`, one HIGH, one MEDIUM."""
+    findings = [
+        {"file": "a.py", "line": i, "code": f"eval(x{i})", "pattern": r"eval\(", "severity": "CRITICAL"}
+        for i in range(3)
+    ] + [
+        {"file": "b.py", "line": 1, "code": "os.system(c)", "pattern": r"os\.system\(", "severity": "HIGH"},
+        {"file": "b.py", "line": 2, "code": "input()", "pattern": r"input\(", "severity": "MEDIUM"},
+    ]
+    db = SessionLocal()
+    try:
+        scan_id = create_scan(db, "project").id
+        ids = FindingWriter(db, scan_id).write(findings)
+        db.commit()
+    finally:
+        db.close()
+    return scan_id, ids
+
+
+def _project(tmp_path, n):
+    for i in range(n):
+        (tmp_path / f"m{i}.py").write_text(f"x = 1\neval(data_{i})\n")
+    return str(tmp_path)
+
+
+def test_disconnect_cancels_the_stream_run(tmp_path, monkeypatch):
+    # No worker threads, so every recommendation stays queued
+    scheduler = EnrichmentScheduler(workers=0)
+    runs = []
+    start = scheduler.start
+    monkeypatch.setattr(scan, "enrichment_scheduler", scheduler)
+    monkeypatch.setattr(scheduler, "start", lambda *a, **kw: runs.append(start(*a, **kw)) or runs[-1])
+
+    events = scan._stream_project_scan(_project(tmp_path, 5), None, 1, "ndjson")
+    for _ in range(3):
+        assert json.loads(next(events))["event"] == "finding"
+    events.close()  # what Starlette does when the client goes away
+
+    (run,) = runs
+    assert run.closed and run.finished
+    # The third finding was sent but not queued yet when the client left
+    assert run.dropped["cancelled"] == 2
+    assert not scheduler._outstanding
+
+
+def test_vulnerabilities_pages_keep_the_list_body(client, stored_scan):
+    scan_id, ids = stored_scan
+    r = client.get("/vulnerabilities", params={"scan_id": scan_id, "limit": 2})
+    pages = [r.json()]
+    assert r.headers["X-Next-After"] == str(ids[1])
+    while "Link" in r.headers:
+        url = r.headers["Link"].split(">", 1)[0].lstrip("<")
+        r = client.get(url)
+        pages.append(r.json())
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert "X-Next-After" not in r.headers
+    assert [f["id"] for page in pages for f in page] == ids
+    assert set(pages[0][0]) == {"id", "scan_id", "pattern", "severity", "count", "recommendation"}
+
+
+def test_vulnerabilities_filters_and_projection(client, stored_scan):
+    scan_id, ids = stored_scan
+
+    def get(**params):
+        r = client.get("/vulnerabilities", params={"scan_id": scan_id, **params})
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    assert [f["severity"] for f in get(severity="CRITICAL,MEDIUM")] == ["CRITICAL"] * 3 + ["MEDIUM"]
+    assert [f["id"] for f in get(pattern=r"eval\(")] == ids[:3]
+    assert [f["id"] for f in get(after=ids[2])] == ids[3:]
+    assert get(since="2999-01-01T00:00:00") == []
+    assert len(get(until="2999-01-01T00:00:00")) == 5
+
+    rows = get(fields="file,line", severity="HIGH")
+    assert rows == [{"id": ids[3], "file": "b.py", "line": 1}]
+    assert client.get("/vulnerabilities", params={"fields": "file,secret"}).status_code == 400
+
+
+def test_vulnerabilities_export_streams_every_match(client, stored_scan):
+    scan_id, ids = stored_scan
+    r = client.get("/vulnerabilities/export", params={"scan_id": scan_id, "fields": "pattern"})
+    assert r.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["id"] for row in rows] == ids
+    assert set(rows[0]) == {"id", "pattern"}
+
+
+def test_vulnerability_stats(client, stored_scan):
+    scan_id, _ids = stored_scan
+
+    def stats(**params):
+        r = client.get("/vulnerabilities/stats", params=params)
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    body = stats(scan_id=scan_id)
+    assert body["total"] == 5
+    assert body["groups"] == [
+        {"severity": "CRITICAL", "count": 3}, {"severity": "HIGH", "count": 1}, {"severity": "MEDIUM", "count": 1},
+    ]
+    (day,) = stats(scan_id=scan_id, group_by="bucket", bucket="day")["groups"]
+    assert day["count"] == 5 and day["bucket"].endswith("T00:00:00")
+
+    # The rolling counters are bumped in the same transaction as the rows
+    def by_pattern():
+        return {g["pattern"]: g["count"] for g in stats(group_by="pattern")["groups"]}
+
+    before = by_pattern()
+    db = SessionLocal()
+    try:
+        FindingWriter(db, create_scan(db, "file").id).write(
+            [{"file": "c.py", "line": 1, "code": "eval(y)", "pattern": r"eval\(", "severity": "CRITICAL"}] * 2
+        )
+        db.commit()
+    finally:
+        db.close()
+    after = by_pattern()
+    assert after.pop(r"eval\(") == before.pop(r"eval\(", 0) + 2
+    assert after == before
+
+    for params in ({"group_by": "file"}, {"group_by": ""}, {"bucket": "week"}):
+        assert client.get("/vulnerabilities/stats", params=params).status_code == 400
+
+
+def test_recommendations_stream_in_completion_order(tmp_path, monkeypatch):
+    import threading
+
+    from app.services import recommender
+    from app.services.project_scanner import _iter_source_files
+
+    started, step = threading.Event(), threading.Semaphore(0)
+    calls = []
+
+    def generate(findings):
+        calls.extend(f["code"] for f in findings)
+        started.set()
+        step.acquire(timeout=5)  # one model call completes per release
+        return [f"fix {f['code']}" for f in findings]
+
+    monkeypatch.setattr(recommender, "generate_recommendations", generate)
+    scheduler = EnrichmentScheduler(workers=1, batch_size=1)
+    monkeypatch.setattr(scan, "enrichment_scheduler", scheduler)
+    for i in range(5):
+        (tmp_path / f"m{i}.py").write_text(f"name = input('{i}')\n")  # distinct cache keys
+    # The file walked last gets the one CRITICAL finding
+    with open(list(_iter_source_files(str(tmp_path)))[-1], "w") as f:
+        f.write("eval(data)\n")
+
+    events = scan._stream_project_scan(str(tmp_path), None, 1, "ndjson")
+    try:
+        found = {}
+        while len(found) < 5:
+            event = json.loads(next(events))
+            assert event["event"] == "finding"
+            found[event["id"]] = event["finding"]
+            if len(found) == 2:
+                assert started.wait(5)  # the worker holds finding 0; the rest queue behind it
+        recs = []
+        for _ in range(5):
+            step.release()
+            recs.append(json.loads(next(events)))
+        summary = json.loads(next(events))
+    finally:
+        for _ in range(5):
+            step.release()
+        scheduler.shutdown()
+
+    assert [r["event"] for r in recs] == ["recommendation"] * 5
+    assert found[4]["severity"] == "CRITICAL"
+    # Finding 4, the most severe, is answered right after the one in flight
+    ids = [r["id"] for r in recs]
+    assert ids[:2] == [0, 4] and sorted(ids) == list(range(5))
+    assert [found[i]["code"] for i in ids] == calls
+    assert all(r["ai_recommendation"] == f"fix {found[r['id']]['code']}" for r in recs)
+    assert summary["event"] == "summary" and summary["summary"]["total"] == 5
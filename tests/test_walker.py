@@ -0,0 +1,34 @@
+import os
+import subprocess
+
+from app.services.walker import iter_files
+
+
+def _git(repo, *args):
+    subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True)
+
+
+def _scan(root, **kw):
+    return sorted(os.path.relpath(p, root).replace(os.sep, "/") for p in iter_files(str(root), (".py",), **kw))
+
+
+def test_gitignore_does_not_hide_tracked_files(tmp_path):
+    (tmp_path / ".gitignore").write_text("secret.py\ngen/\n")
+    (tmp_path / "gen" / "deep").mkdir(parents=True)
+    for name in ("app.py", "secret.py", "gen/forced.py", "gen/scratch.py", "gen/deep/forced.py"):
+        (tmp_path / name).write_text("eval(x)\n")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", "app.py", ".gitignore")
+    _git(tmp_path, "add", "-f", "secret.py", "gen/forced.py", "gen/deep/forced.py")
+
+    assert _scan(tmp_path) == ["app.py", "gen/deep/forced.py", "gen/forced.py", "secret.py"]
+    # Explicit excludes still apply to tracked files
+    assert _scan(tmp_path, exclude=["gen/"]) == ["app.py", "secret.py"]
+
+
+def test_gitignore_applies_outside_a_work_tree(tmp_path):
+    (tmp_path / ".gitignore").write_text("secret.py\n")
+    (tmp_path / "app.py").write_text("x = 1\n")
+    (tmp_path / "secret.py").write_text("x = 1\n")
+    assert _scan(tmp_path) == ["app.py"]
+    assert _scan(tmp_path, gitignore=False) == ["app.py", "secret.py"]